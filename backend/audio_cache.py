@@ -0,0 +1,271 @@
+# backend/audio_cache.py
+import asyncio
+import logging
+import os
+import struct
+import subprocess
+import time
+import wave
+from pathlib import Path
+
+from pydub import AudioSegment
+
+from metrics import AUDIO_CACHE_LOOKUPS
+from workers import audio_scheduler, file_lock
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Upper bound for decoded PCM files on disk across all sessions and uvicorn workers (default 4 GB)
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+# Files used this recently are kept even over budget: a clip render may be about to open them
+AUDIO_CACHE_IN_USE_SECONDS = 60
+
+DECODED_SUFFIX = ".pcm.wav"  # <root>/<audio_sha256>.pcm.wav
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def _is_pcm_wav(audio_path: str) -> bool:
+    try:
+        with wave.open(audio_path, "rb") as wav:
+            return wav.getcomptype() == "NONE" and wav.getnchannels() > 0
+    except (wave.Error, EOFError, OSError):
+        return False
+
+
+# --- PCM WAV Reader (RIFF and RF64) ---
+class PcmWavReader:
+    """Reads frames from a PCM WAV by position, like `wave.Wave_read`, including RF64 files over 4 GB.
+
+    ffmpeg writes decodes longer than a RIFF header can describe as RF64
+    (`-rf64 auto`), and multichannel ones as WAVE_FORMAT_EXTENSIBLE; the
+    `wave` module reads neither.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        try:
+            self._parse_header()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _parse_header(self):
+        f = self._file
+        riff, _, form = struct.unpack("<4sI4s", f.read(12))
+        if riff not in (b"RIFF", b"RF64") or form != b"WAVE":
+            raise wave.Error("not a RIFF/RF64 WAVE file")
+        data_size64 = None
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise wave.Error("no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"ds64":
+                _, data_size64 = struct.unpack("<QQ", f.read(16))
+                f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+            elif chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                if chunk_size & 1:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+        if fmt is None or len(fmt) < 16:
+            raise wave.Error("missing fmt chunk")
+        format_tag, channels, frame_rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+        if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            format_tag = struct.unpack("<H", fmt[24:26])[0]  # First two bytes of the sub-format GUID
+        if format_tag != WAVE_FORMAT_PCM or not channels or not block_align:
+            raise wave.Error(f"unsupported WAVE format {format_tag}")
+        if chunk_size == 0xFFFFFFFF and data_size64 is not None:
+            chunk_size = data_size64
+        self._data_start = f.tell()
+        self._channels, self._frame_rate, self._block_align = channels, frame_rate, block_align
+        self._sample_width = (bits + 7) // 8
+        self._frame_count = chunk_size // block_align
+        self._position = 0
+
+    def getnchannels(self) -> int:
+        return self._channels
+
+    def getsampwidth(self) -> int:
+        return self._sample_width
+
+    def getframerate(self) -> int:
+        return self._frame_rate
+
+    def getnframes(self) -> int:
+        return self._frame_count
+
+    def setpos(self, position: int):
+        if not 0 <= position <= self._frame_count:
+            raise wave.Error("position not in range")
+        self._position = position
+
+    def readframes(self, count: int) -> bytes:
+        count = max(0, min(count, self._frame_count - self._position))
+        self._file.seek(self._data_start + self._position * self._block_align)
+        data = self._file.read(count * self._block_align)
+        self._position += len(data) // self._block_align
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _decode_with_ffmpeg(audio_path: str, audio_format: str | None, out_path: str):
+    # ffmpeg writes the PCM straight to disk: nothing is held in memory, and
+    # files past the 4 GB RIFF limit become RF64
+    command = [AudioSegment.converter, "-nostdin", "-v", "error", "-y"]
+    if audio_format:
+        command += ["-f", audio_format]
+    command += ["-i", audio_path, "-vn", "-c:a", "pcm_s16le", "-f", "wav", "-rf64", "auto", out_path]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.decode(errors='replace')[-500:]}")
+
+
+def decode_to_pcm_file(audio_path: str, audio_format: str | None, out_path: str) -> str:
+    """Returns the path of a PCM WAV holding the upload's audio. Runs in a worker process.
+
+    PCM WAV uploads are used as they are. Anything else is decoded to
+    `out_path` once, under its file lock, so uvicorn workers decoding the same
+    recording wait for one decode instead of each running their own.
+    """
+    if audio_format == "wav" and _is_pcm_wav(audio_path):
+        return audio_path
+    if os.path.exists(out_path):
+        return out_path
+    with file_lock(out_path):
+        if os.path.exists(out_path):
+            return out_path
+        logger.info(f"Decoding audio file {audio_path} (format: {audio_format}) to {out_path}")
+        tmp_path = f"{out_path}.tmp-{os.getpid()}"
+        try:
+            try:
+                _decode_with_ffmpeg(audio_path, audio_format, tmp_path)
+            except FileNotFoundError:
+                # No ffmpeg binary: pydub can still read some formats itself, decoding in memory
+                logger.info(f"ffmpeg not found, decoding {audio_path} with pydub instead.")
+                AudioSegment.from_file(audio_path, format=audio_format).export(tmp_path, format="wav")
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return out_path
+
+
+# --- Decoded Audio Files ---
+class DecodedAudioCache:
+    """Decoded PCM of each upload, kept as a WAV file under `root` and shared by all uvicorn workers.
+
+    Keyed by content hash, so re-uploads of the same recording share one
+    decode. Clip renders read only their range from the file, in the process
+    pool, so no whole recording is held in memory. After each decode the
+    least recently used files are deleted until all of them fit in
+    `max_bytes`; the orphan sweep removes the rest once unused for the
+    session TTL.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = AUDIO_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._paths: dict[str, str] = {}  # key -> decoded file (or the upload itself)
+        self._pending: dict[str, asyncio.Task] = {}
+
+    @property
+    def current_bytes(self) -> int:
+        """Decoded PCM on disk, from every worker."""
+        return sum(size for _, size, _ in self._scan())
+
+    def _scan(self) -> list[tuple[float, int, Path]]:
+        files = []
+        for path in self.root.glob(f"*{DECODED_SUFFIX}"):
+            try:
+                stat_result = path.stat()
+            except FileNotFoundError:
+                continue  # Removed by another worker meanwhile
+            files.append((stat_result.st_mtime, stat_result.st_size, path))
+        return files
+
+    def pcm_path(self, key: str) -> Path:
+        return self.root / f"{key}{DECODED_SUFFIX}"
+
+    async def get(self, key: str, session_id: str, audio_path: str, audio_format: str | None,
+                  background: bool = False) -> str:
+        path = self._paths.get(key)
+        if path is not None and os.path.exists(path):
+            if path != audio_path:
+                os.utime(path)  # Keeps it from the orphan sweep while in use
+            AUDIO_CACHE_LOOKUPS.inc(result="hit")
+            return path
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._decode(key, session_id, audio_path, audio_format, background))
+            self._pending[key] = task
+            # Mark failures as retrieved even if every waiter was cancelled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            AUDIO_CACHE_LOOKUPS.inc(result="miss")
+        else:
+            AUDIO_CACHE_LOOKUPS.inc(result="shared")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Waiting for in-flight decode of {key}")
+        # Shield so a cancelled request doesn't abort the decode other requests wait on
+        return await asyncio.shield(task)
+
+    async def _decode(self, key: str, session_id: str, audio_path: str, audio_format: str | None,
+                      background: bool) -> str:
+        try:
+            path = await audio_scheduler.run(session_id, "decode", decode_to_pcm_file, audio_path, audio_format,
+                                             str(self.pcm_path(key)), background=background)
+            self._paths[key] = path
+            if path != audio_path:
+                await asyncio.to_thread(self._trim, path)
+            return path
+        finally:
+            self._pending.pop(key, None)
+
+    def _trim(self, keep: str):
+        # LRU by mtime, which every use refreshes; works across workers since it only looks at the directory
+        files = self._scan()
+        total = sum(size for _, size, _ in files)
+        in_use_cutoff = time.time() - AUDIO_CACHE_IN_USE_SECONDS
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if str(path) == keep or mtime > in_use_cutoff:
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass  # Another worker trimmed it first
+            total -= size
+            logger.info(f"Removed decoded audio {path.name} ({size} bytes) to stay within the cache budget")
+        if total > self.max_bytes:
+            logger.warning(f"Decoded audio in use ({total} bytes) exceeds cache budget ({self.max_bytes} bytes).")
+
+    def evict(self, key: str):
+        # The file may serve other sessions (or other workers) with the same recording; the sweep removes it
+        self._paths.pop(key, None)
+
+    def has(self, key: str) -> bool:
+        """True if the key is decoded (by any worker) or currently being decoded here."""
+        return key in self._paths or key in self._pending or self.pcm_path(key).exists()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._paths
+
+    def __len__(self) -> int:
+        return len(self._paths)
@@ -0,0 +1,79 @@
+# backend/benchmarks/bench_parser.py
+"""Compares the single-pass transcript parser with the original regex parser.
+
+Run from backend/:  python benchmarks/bench_parser.py --hours 1 5 10
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcript_parser import iter_transcript_blocks  # noqa: E402
+from synthetic import make_srt  # noqa: E402
+
+def legacy_parse_timestamped_transcript(text):
+    # Frozen copy of the original core_logic parser, kept as the reference implementation
+    pattern = r"(\d{2}:\d{2}:\d{2}[.,]\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2}[.,]\d{3})\n(.*?)(?=\n\d{2}:\d{2}:\d{2}[.,]\d{3}\s*-->|\Z)"
+    matches = re.findall(pattern, text, re.DOTALL); blocks = []
+    for start, end, content in matches:
+        content = re.sub(r"^\s*\d+\s*\n", "", content); start_norm = start.replace(",", "."); end_norm = end.replace(",", ".")
+        text_clean = re.sub(r'\s+', ' ', content.strip())
+        text_clean = re.sub(r"(?<!\S)\b\d+\b(?!\S)", "", text_clean).strip()
+        text_clean = re.sub(r'\s{2,}', ' ', text_clean)
+        if text_clean: blocks.append({"start": start_norm, "end": end_norm, "text": text_clean.strip()})
+    return blocks
+
+
+def best_time(fn, text, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def peak_memory(fn, text) -> float:
+    # Peak bytes allocated while fn runs (the input text itself is excluded)
+    tracemalloc.start()
+    fn(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def consume_lazily(text: str) -> int:
+    # The streaming use case: blocks are processed one at a time and never collected
+    count = 0
+    for _ in iter_transcript_blocks(text[i:i + 65536] for i in range(0, len(text), 65536)):
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, nargs="+", default=[1, 5, 10], help="Synthetic transcript lengths")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing runs per parser (best is reported)")
+    args = parser.parse_args()
+
+    new_parse = lambda t: list(iter_transcript_blocks(t))
+    print(f"{'hours':>6} {'cues':>7} {'MB':>5} | {'legacy s':>8} {'new s':>7} {'speedup':>7} | "
+          f"{'legacy MB':>9} {'new MB':>6} {'lazy MB':>7} | same")
+    for hours in args.hours:
+        text = make_srt(hours)
+        legacy = legacy_parse_timestamped_transcript(text)
+        new = new_parse(text)
+        same = [(b["start"], b["end"], b["text"]) for b in legacy] == [(b["start"], b["end"], b["text"]) for b in new]
+        legacy_s = best_time(legacy_parse_timestamped_transcript, text, args.repeat)
+        new_s = best_time(new_parse, text, args.repeat)
+        print(f"{hours:>6g} {len(new):>7} {len(text) / 1e6:>5.1f} | {legacy_s:>8.3f} {new_s:>7.3f} {legacy_s / new_s:>6.1f}x | "
+              f"{peak_memory(legacy_parse_timestamped_transcript, text) / 1e6:>9.1f} {peak_memory(new_parse, text) / 1e6:>6.1f} "
+              f"{peak_memory(consume_lazily, text) / 1e6:>7.2f} | {same}")
+
+
+if __name__ == "__main__":
+    main()
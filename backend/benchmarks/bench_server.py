@@ -0,0 +1,477 @@
+# backend/benchmarks/bench_server.py
+"""Load test for /api/process and the segment audio endpoint, run against the app in-process.
+
+Each scenario uploads a synthetic SRT and audio file for a number of concurrent
+sessions, then fetches segment audio for each of them. The audio is WAV, or
+MP3/M4A encoded from it with ffmpeg (`--formats`), so decode cost shows up.
+OpenAI is replaced by a stub with configurable latency. Reports throughput,
+p50/p95/p99 latency per endpoint, per-stage timings (parse, group, gpt, and
+the audio worker jobs: decode, export, ...) and peak RSS, and writes
+everything to a JSON file. Worker job stages are their run time in the pool;
+`<stage>_queue` is the rest of the job's time (waiting in the audio
+scheduler for a worker, pool start-up, hand-off to the process), and
+`slice` is the part of each clip export spent reading its range of decoded
+PCM. Segment fetches refused with 503 by the audio scheduler's backpressure
+are reported as `audio_busy`.
+
+Run from backend/:
+    python benchmarks/bench_server.py --minutes 10 60 --sessions 1 4 --gpt-latency-ms 300
+    python benchmarks/bench_server.py --minutes 30 --formats wav mp3 m4a
+    python benchmarks/bench_server.py --compare old.json new.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from synthetic import make_srt, write_wav  # noqa: E402
+
+DEFAULT_OUTPUT_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+
+# --- Measurements ---
+def percentile(sorted_values: list[float], pct: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples: list[float], wall_seconds: float | None = None) -> dict:
+    values = sorted(samples)
+    summary = {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+        "total_ms": round(sum(values) * 1000, 2),
+    }
+    if wall_seconds:
+        summary["throughput_per_s"] = round(len(values) / wall_seconds, 2)
+    return summary
+
+
+class Recorder:
+    """Collects durations per name; one instance per scenario."""
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+
+    def add(self, name: str, seconds: float):
+        self.samples[name].append(seconds)
+
+
+RECORDER = Recorder()
+ENDPOINTS = ("process", "audio_first", "audio_repeat", "audio_busy")
+# Upload format -> (ffmpeg encoder arguments, content type); WAV is written directly
+INPUT_FORMATS = {
+    "wav": (None, "audio/wav"),
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "128k"], "audio/mpeg"),
+    "m4a": (["-c:a", "aac", "-b:a", "128k"], "audio/mp4"),
+}
+
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss is KB on Linux, bytes on macOS
+    scale = 1 / 1024 if sys.platform != "darwin" else 1 / (1024 * 1024)
+    workers = 0.0
+    import workers as audio_workers
+    pool = audio_workers._process_pool
+    for pid in (pool._processes or {}) if pool else ():
+        # Pool workers are still running, so RUSAGE_CHILDREN doesn't cover them yet; use their high-water mark
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                match = re.search(r"^VmHWM:\s+(\d+) kB", status.read(), re.MULTILINE)
+            workers = max(workers, int(match.group(1)) / 1024 if match else 0.0)
+        except OSError:
+            pass
+    return {"self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1),
+            "largest_worker": round(workers, 1)}
+
+
+# --- Stage Instrumentation (wrappers installed around the app's own functions) ---
+def timed_sync(name: str, fn):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            RECORDER.add(name, time.perf_counter() - started)
+    return wrapper
+
+
+def timed_async(name: str, fn):
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            RECORDER.add(name, time.perf_counter() - started)
+    return wrapper
+
+
+# Timings of the pool job the current scheduler.run call submits (same task, so same context)
+JOB_TIMES: contextvars.ContextVar[dict] = contextvars.ContextVar("JOB_TIMES")
+_read_seconds = 0.0
+
+
+def _timed_readframes(readframes):
+    def wrapper(self, count):
+        global _read_seconds
+        started = time.perf_counter()
+        try:
+            return readframes(self, count)
+        finally:
+            _read_seconds += time.perf_counter() - started
+    wrapper.timed = True
+    return wrapper
+
+
+def run_timed(fn, *args):
+    """Runs a job in the pool worker; returns (result, run seconds, seconds spent reading decoded PCM)."""
+    global _read_seconds
+    import audio_cache
+    if not getattr(audio_cache.PcmWavReader.readframes, "timed", False):
+        audio_cache.PcmWavReader.readframes = _timed_readframes(audio_cache.PcmWavReader.readframes)
+    _read_seconds = 0.0
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started, _read_seconds
+
+
+class TimedExecutor:
+    """Wraps the audio process pool; times each job inside the worker and hands the times to the scheduler wrapper."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def submit(self, fn, *args, **kwargs):
+        times = JOB_TIMES.get(None)
+        outer = Future()
+        inner = self.inner.submit(run_timed, fn, *args)
+
+        def done(future):
+            try:
+                result, run_seconds, read_seconds = future.result()
+            except BaseException as e:
+                outer.set_exception(e)
+                return
+            if times is not None:
+                times.update(run=run_seconds, read=read_seconds)
+            outer.set_result(result)
+        inner.add_done_callback(done)
+        return outer
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+def timed_scheduler_run(run):
+    # Splits each audio job into its run time in the pool and the wait before it got a worker
+    async def wrapper(session_id, stage, fn, *args, **kwargs):
+        times = {}
+        token = JOB_TIMES.set(times)
+        started = time.perf_counter()
+        try:
+            return await run(session_id, stage, fn, *args, **kwargs)
+        finally:
+            JOB_TIMES.reset(token)
+            if "run" in times:
+                RECORDER.add(stage, times["run"])
+                RECORDER.add(f"{stage}_queue", time.perf_counter() - started - times["run"])
+                if stage == "export":
+                    RECORDER.add("slice", times["read"])
+    return wrapper
+
+
+def instrument(main):
+    import segments
+    import workers
+
+    main.parse_transcript_upload = timed_async("parse", main.parse_transcript_upload)
+    segments.Transcript.group = timed_sync("group", segments.Transcript.group)
+    main.gpt_engine.process_segments = timed_async("gpt", main.gpt_engine.process_segments)
+    # All decode and render work reaches the pool through the audio scheduler, which looks the pool up per job
+    original = workers.get_process_pool
+    workers.get_process_pool = lambda: TimedExecutor(original())
+    workers.audio_scheduler.run = timed_scheduler_run(workers.audio_scheduler.run)
+
+
+# --- Stub OpenAI Client ---
+class StubCompletions:
+    """Echoes the input after `latency` seconds; JSON-mode batches get one reply per segment."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, model, messages, temperature, response_format=None, **kwargs):
+        self.calls += 1
+        prompt = messages[0]["content"]
+        await asyncio.sleep(self.latency)
+        if response_format:
+            segments = json.loads(prompt[prompt.rindex('{"segments"'):])["segments"]
+            content = json.dumps({"segments": segments})
+        else:
+            content = prompt.rsplit("\n", 1)[-1].strip('"')
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+def install_stub_client(main, latency: float) -> StubCompletions:
+    import core_logic
+    core_logic.OPENAI_API_KEY = "benchmark"
+    completions = StubCompletions(latency)
+    main.gpt_engine._client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    return completions
+
+
+# --- Scenarios ---
+def usable_formats(formats: list[str]) -> list[str]:
+    from pydub import AudioSegment
+    if shutil.which(AudioSegment.converter):
+        return formats
+    skipped = [f for f in formats if INPUT_FORMATS[f][0] is not None]
+    if skipped:
+        print(f"ffmpeg not found: skipping the {', '.join(skipped)} scenarios.")
+    return [f for f in formats if f not in skipped]
+
+
+def encode_input(wav_path: str, out_path: str, input_format: str):
+    from pydub import AudioSegment
+    encoder_args, _ = INPUT_FORMATS[input_format]
+    subprocess.run([AudioSegment.converter, "-nostdin", "-v", "error", "-y", "-i", wav_path, *encoder_args, out_path],
+                   check=True)
+
+
+async def run_session(client, srt_path: str, audio_path: str, args, recorder: Recorder):
+    extension = os.path.splitext(audio_path)[1]
+    content_type = INPUT_FORMATS[extension[1:]][1]
+    with open(srt_path, "rb") as srt, open(audio_path, "rb") as audio_file:
+        started = time.perf_counter()
+        response = await client.post("/api/process", data={
+            "target_words": str(args.target_words),
+            "fix_typos": str(args.fix).lower(),
+            "translate_norwegian": str(args.translate).lower(),
+            "segmentation": args.segmentation,
+            "audio_pauses": str(args.audio_pauses).lower(),
+        }, files={"transcript_file": ("bench.srt", srt, "text/plain"),
+                  "audio_file": (f"bench{extension}", audio_file, content_type)})
+        recorder.add("process", time.perf_counter() - started)
+    response.raise_for_status()
+    result = response.json()
+    session_id = result["session_id"]
+    segment_count = len(result["segments"])
+
+    indices = list(range(min(segment_count, args.segment_requests)))
+    for name in ("audio_first", "audio_repeat"):
+        # First pass decodes and renders; the second is served from the clip files
+        async def fetch(index: int):
+            fetch_started = time.perf_counter()
+            audio = await client.get(f"/api/audio/{session_id}/{index}")
+            recorder.add("audio_busy" if audio.status_code == 503 else name, time.perf_counter() - fetch_started)
+            if audio.status_code not in (200, 204, 503):
+                raise RuntimeError(f"/api/audio returned {audio.status_code}")
+        await asyncio.gather(*(fetch(i) for i in indices))
+    return segment_count
+
+
+async def run_scenario(main, minutes: float, sessions: int, input_format: str, args, inputs_dir: str) -> dict:
+    import httpx
+
+    recorder = Recorder()
+    RECORDER.samples = recorder.samples  # Stage wrappers write into this scenario
+    files = []
+    for i in range(sessions):
+        # Distinct audio per session, so the decode cache doesn't share work between them
+        srt_path = os.path.join(inputs_dir, f"{minutes:g}m.srt")
+        wav_path = os.path.join(inputs_dir, f"{minutes:g}m-{i}.wav")
+        audio_path = os.path.join(inputs_dir, f"{minutes:g}m-{i}.{input_format}")
+        if not os.path.exists(srt_path):
+            with open(srt_path, "w", encoding="utf-8") as f:
+                f.write(make_srt(minutes / 60))
+        if not os.path.exists(wav_path):
+            write_wav(wav_path, minutes * 60, args.signal, seed=i)
+        if not os.path.exists(audio_path):
+            encode_input(wav_path, audio_path, input_format)
+        files.append((srt_path, audio_path))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        segment_counts = await asyncio.gather(*(run_session(client, srt, wav, args, recorder) for srt, wav in files))
+        wall = time.perf_counter() - started
+
+    for session_id in list(main.session_store.session_ids()):
+        session = main.session_store.delete(session_id)
+        if session:
+            main.cleanup_session(session_id, session)
+
+    endpoints = {name: summarize(recorder.samples[name], wall) for name in ENDPOINTS if recorder.samples[name]}
+    stages = {name: summarize(values) for name, values in sorted(recorder.samples.items()) if name not in ENDPOINTS}
+    return {
+        # WAV scenarios keep their original names, so older result files still compare
+        "name": f"{minutes:g}min x{sessions}" + ("" if input_format == "wav" else f" {input_format}"),
+        "minutes": minutes,
+        "sessions": sessions,
+        "input_format": input_format,
+        "segments_per_session": segment_counts[0] if segment_counts else 0,
+        "wall_s": round(wall, 3),
+        "endpoints": endpoints,
+        "stages": stages,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+async def run_all(args) -> dict:
+    # The app keeps temp files relative to the working directory; keep them out of the tree
+    work_dir = tempfile.mkdtemp(prefix="bench-server-")
+    inputs_dir = os.path.join(work_dir, "inputs")
+    os.makedirs(inputs_dir)
+    os.chdir(work_dir)
+    try:
+        import logging
+        import main
+        logging.getLogger().setLevel(logging.WARNING)
+        instrument(main)
+        completions = install_stub_client(main, args.gpt_latency_ms / 1000)
+
+        scenarios = []
+        async with main.app.router.lifespan_context(main.app):
+            for input_format in usable_formats(args.formats):
+                for minutes in args.minutes:
+                    for sessions in args.sessions:
+                        scenario = await run_scenario(main, minutes, sessions, input_format, args, inputs_dir)
+                        scenarios.append(scenario)
+                        print_scenario(scenario)
+        return {"meta": run_metadata(args, completions.calls), "scenarios": scenarios}
+    finally:
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_metadata(args, gpt_calls: int) -> dict:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "gpt_calls": gpt_calls,
+        "args": {key: value for key, value in vars(args).items() if key not in ("compare", "output", "threshold", "min_delta_ms")},
+    }
+
+
+# --- Reporting ---
+def print_scenario(scenario: dict):
+    print(f"\n== {scenario['name']}: {scenario['segments_per_session']} segments/session, "
+          f"wall {scenario['wall_s']:.2f}s, peak RSS {scenario['peak_rss_mb']['self']} MB "
+          f"(largest worker {scenario['peak_rss_mb']['largest_worker']} MB)")
+    print(f"  {'':<14} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'total ms':>10} {'per s':>8}")
+    for group in ("endpoints", "stages"):
+        for name, stats in scenario[group].items():
+            print(f"  {name:<14} {stats['count']:>6} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+                  f"{stats['p99_ms']:>9.1f} {stats['total_ms']:>10.1f} {stats.get('throughput_per_s', ''):>8}")
+
+
+def compare(baseline_path: str, candidate_path: str, threshold: float, min_delta_ms: float) -> int:
+    """Prints p50/p95 changes per scenario and metric; returns 1 if any p95 regressed past the threshold.
+
+    Slowdowns smaller than `min_delta_ms` are ignored, so sub-millisecond stages don't flag on noise.
+    """
+    with open(baseline_path) as f:
+        baseline = {s["name"]: s for s in json.load(f)["scenarios"]}
+    with open(candidate_path) as f:
+        candidate = json.load(f)["scenarios"]
+
+    regressions = 0
+    print(f"{'scenario':<16} {'metric':<14} {'p50 old':>9} {'p50 new':>9} {'p95 old':>9} {'p95 new':>9} {'p95 Δ':>8}")
+    for scenario in candidate:
+        old = baseline.get(scenario["name"])
+        if old is None:
+            print(f"{scenario['name']:<16} (not in baseline)")
+            continue
+        for group in ("endpoints", "stages"):
+            for name, stats in scenario[group].items():
+                old_stats = old[group].get(name)
+                if not old_stats:
+                    continue
+                change = (stats["p95_ms"] - old_stats["p95_ms"]) / old_stats["p95_ms"] if old_stats["p95_ms"] else 0.0
+                flag = ""
+                if change > threshold and stats["p95_ms"] - old_stats["p95_ms"] >= min_delta_ms:
+                    flag = "  REGRESSION"
+                    regressions += 1
+                print(f"{scenario['name']:<16} {name:<14} {old_stats['p50_ms']:>9.1f} {stats['p50_ms']:>9.1f} "
+                      f"{old_stats['p95_ms']:>9.1f} {stats['p95_ms']:>9.1f} {change:>+7.0%}{flag}")
+        old_rss, new_rss = old["peak_rss_mb"]["self"], scenario["peak_rss_mb"]["self"]
+        print(f"{scenario['name']:<16} {'peak RSS MB':<14} {old_rss:>9} {new_rss:>9}")
+    print(f"\n{regressions} p95 regression(s) above {threshold:.0%}.")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, nargs="+", default=[5, 30], help="Transcript and audio length per session")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4], help="Concurrent sessions per scenario")
+    parser.add_argument("--segment-requests", type=int, default=20, help="Segment audio fetches per session")
+    parser.add_argument("--target-words", type=int, default=60)
+    parser.add_argument("--segmentation", default="word_count", help="Grouping strategy sent with each upload")
+    parser.add_argument("--audio-pauses", action="store_true", help="Let pause-aware grouping scan the audio")
+    parser.add_argument("--signal", choices=("tone", "noise"), default="tone", help="Synthetic audio content")
+    parser.add_argument("--formats", nargs="+", choices=tuple(INPUT_FORMATS), default=["wav"],
+                        help="Upload formats; mp3 and m4a are encoded from the WAV with ffmpeg")
+    parser.add_argument("--gpt-latency-ms", type=float, default=200, help="Stub OpenAI response latency")
+    parser.add_argument("--no-fix", dest="fix", action="store_false", help="Skip the correction stage")
+    parser.add_argument("--translate", action="store_true", help="Also run the translation stage")
+    parser.add_argument("--prerender", action="store_true", help="Keep background clip pre-rendering on")
+    parser.add_argument("--output", help=f"JSON results path (default: {DEFAULT_OUTPUT_DIR}/<timestamp>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files and exit")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p95 slowdown counted as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore p95 slowdowns smaller than this")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold, args.min_delta_ms))
+
+    # Must be set before the app modules are imported: measure real work, not cache hits or throttling
+    os.environ["GPT_CACHE_ENABLED"] = "0"
+    os.environ.setdefault("GPT_REQUESTS_PER_MINUTE", "0")
+    os.environ.setdefault("GPT_TOKENS_PER_MINUTE", "0")
+    os.environ["SESSION_STORE"] = "memory"
+    # Pre-rendering would race the measured on-demand path (decode -> slice -> export)
+    os.environ["PRERENDER_CLIPS"] = "1" if args.prerender else "0"
+
+    results = asyncio.run(run_all(args))
+    output = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
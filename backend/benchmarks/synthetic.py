@@ -0,0 +1,50 @@
+# backend/benchmarks/synthetic.py
+"""Synthetic transcripts and audio shared by the benchmark scripts."""
+import math
+import os
+import random
+import sys
+import wave
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcript_parser import ms_to_timestamp  # noqa: E402
+
+WORDS = ("so", "we", "think", "the", "model", "is", "really", "about", "latency", "and", "memory",
+         "when", "you", "scale", "it", "to", "production", "right", "yeah", "okay")
+
+
+def make_srt(hours: float, cue_ms: int = 1500, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = []
+    for i in range(int(hours * 3600 * 1000 // cue_ms)):
+        start = i * cue_ms
+        srt_time = lambda ms: ms_to_timestamp(ms).replace(".", ",")
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 14)))
+        lines.append(f"{i + 1}\n{srt_time(start)} --> {srt_time(start + cue_ms - 100)}\n{text}\n")
+    return "\n".join(lines)
+
+
+def write_wav(path: str, seconds: float, signal: str = "tone", frame_rate: int = 16000, seed: int = 0):
+    """Writes mono 16-bit PCM: a sine tone (frequency varies with seed) or white noise.
+
+    One second of signal is generated and repeated, so long files are cheap to make.
+    """
+    rng = random.Random(seed)
+    if signal == "noise":
+        second = array("h", (rng.randint(-12000, 12000) for _ in range(frame_rate)))
+    else:
+        frequency = 220 + 10 * seed
+        second = array("h", (int(12000 * math.sin(2 * math.pi * frequency * i / frame_rate)) for i in range(frame_rate)))
+    if sys.byteorder == "big":
+        second.byteswap()
+    data = second.tobytes()
+    with wave.open(path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(frame_rate)
+        whole, rest = divmod(int(seconds * frame_rate), frame_rate)
+        for _ in range(whole):
+            out.writeframes(data)
+        out.writeframes(data[:rest * 2])
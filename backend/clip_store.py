@@ -0,0 +1,154 @@
+# backend/clip_store.py
+import asyncio
+import logging
+import os
+import shutil
+from pathlib import Path
+
+from pydub import AudioSegment
+
+from audio_cache import PcmWavReader
+from workers import audio_scheduler, file_lock
+
+logger = logging.getLogger(__name__)
+
+# Tried in order; WAV is the fallback when ffmpeg can't encode MP3
+CLIP_FORMATS = (("mp3", "audio/mpeg"), ("wav", "audio/wav"))
+
+
+def find_encoded(out_base: str) -> tuple[str, str] | None:
+    for export_format, content_type in CLIP_FORMATS:
+        path = f"{out_base}.{export_format}"
+        if os.path.exists(path):
+            return path, content_type
+    return None
+
+
+def render_clip(pcm_path: str, start_ms: int, end_ms: int, out_base: str) -> tuple[str, str] | None:
+    """Cuts start_ms..end_ms from a PCM WAV and encodes it to `<out_base>.mp3` (or .wav). Runs in a worker process.
+
+    Only the range's frames are read from disk. The clip's file lock makes
+    uvicorn workers asking for the same clip wait for one encode; the temp
+    name and rename mean readers never see a half-written clip. Returns None
+    if the range holds no audio.
+    """
+    with file_lock(out_base):
+        found = find_encoded(out_base)
+        if found:
+            return found
+        with PcmWavReader(pcm_path) as wav:
+            frame_rate, frame_count = wav.getframerate(), wav.getnframes()
+            first = min(frame_count, max(0, start_ms) * frame_rate // 1000)
+            stop = min(frame_count, end_ms * frame_rate // 1000)
+            if first >= stop:
+                return None
+            wav.setpos(first)
+            clip = AudioSegment(data=wav.readframes(stop - first), sample_width=wav.getsampwidth(),
+                                frame_rate=frame_rate, channels=wav.getnchannels())
+        last_error = None
+        for export_format, content_type in CLIP_FORMATS:
+            final_path = f"{out_base}.{export_format}"
+            tmp_path = f"{final_path}.tmp-{os.getpid()}"
+            try:
+                clip.export(tmp_path, format=export_format)
+                os.replace(tmp_path, final_path)
+                return final_path, content_type
+            except Exception as e:
+                last_error = e
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    raise RuntimeError(f"Failed to export audio clip: {last_error}")
+
+
+# --- Encoded Clip Store ---
+class ClipStore:
+    """Per-session directory of pre-encoded segment clips, rendered in a process pool.
+
+    Clips are named by their millisecond range (`<start>-<end>.mp3`), so a clip
+    stays valid as long as its segment's timestamps do.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._pending: dict[tuple[str, int, int], asyncio.Task] = {}
+        self._background: set[asyncio.Task] = set()
+
+    def session_dir(self, session_id: str) -> Path:
+        return self.root / session_id
+
+    def _clip_base(self, session_id: str, start_ms: int, end_ms: int) -> Path:
+        return self.session_dir(session_id) / f"{start_ms}-{end_ms}"
+
+    def find_clip(self, session_id: str, start_ms: int, end_ms: int) -> tuple[Path, str] | None:
+        base = self._clip_base(session_id, start_ms, end_ms)
+        for export_format, content_type in CLIP_FORMATS:
+            path = base.with_name(f"{base.name}.{export_format}")
+            if path.exists():
+                return path, content_type
+        return None
+
+    async def ensure_clip(self, session_id: str, pcm_path: str, start_ms: int, end_ms: int,
+                          background: bool = False) -> tuple[Path, str] | None:
+        """Returns the encoded clip, rendering it from the decoded audio if needed. None if the range is empty."""
+        found = self.find_clip(session_id, start_ms, end_ms)
+        if found:
+            return found
+        key = (session_id, start_ms, end_ms)
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._render(session_id, pcm_path, start_ms, end_ms, background))
+            self._pending[key] = task
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _render(self, session_id: str, pcm_path: str, start_ms: int, end_ms: int, background: bool):
+        try:
+            self.session_dir(session_id).mkdir(parents=True, exist_ok=True)
+            # The segment's own range names the file; the worker clamps it to the audio
+            out_base = str(self._clip_base(session_id, start_ms, end_ms))
+            rendered = await audio_scheduler.run(session_id, "export", render_clip, pcm_path, start_ms, end_ms,
+                                                 out_base, background=background)
+            if rendered is None:
+                return None
+            path, content_type = rendered
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Rendered clip {path}")
+            return Path(path), content_type
+        finally:
+            self._pending.pop((session_id, start_ms, end_ms), None)
+
+    def schedule_session(self, session_id: str, segment_ranges: list[tuple[int, int]], load_pcm):
+        """Renders every segment clip in the background. `load_pcm` is an async callable returning the decoded file."""
+        task = asyncio.create_task(self._render_session(session_id, segment_ranges, load_pcm))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _render_session(self, session_id: str, segment_ranges: list[tuple[int, int]], load_pcm):
+        try:
+            pcm_path = await load_pcm()
+            # No more clips in flight than the session may run at once, so a segment
+            # the user asks for only waits behind those, not the whole session
+            limit = asyncio.Semaphore(audio_scheduler.session_concurrency)
+
+            async def render_one(start_ms: int, end_ms: int):
+                async with limit:
+                    await self.ensure_clip(session_id, pcm_path, start_ms, end_ms, background=True)
+
+            results = await asyncio.gather(*(render_one(s, e) for s, e in segment_ranges), return_exceptions=True)
+            failures = [r for r in results if isinstance(r, Exception)]
+            if failures:
+                logger.warning(f"[{session_id}] {len(failures)} clips failed to pre-render: {failures[0]}")
+            logger.info(f"[{session_id}] Pre-rendered {len(segment_ranges) - len(failures)} clips.")
+        except Exception as e:
+            logger.error(f"[{session_id}] Clip pre-rendering failed: {e}")
+
+    def remove_clips(self, session_id: str, segment_ranges: list[tuple[int, int]]):
+        """Deletes the encoded clips of ranges no segment uses any more (blocking; run off the loop)."""
+        for start_ms, end_ms in segment_ranges:
+            base = self._clip_base(session_id, start_ms, end_ms)
+            for export_format, _ in CLIP_FORMATS:
+                base.with_name(f"{base.name}.{export_format}").unlink(missing_ok=True)
+            base.with_name(f"{base.name}.lock").unlink(missing_ok=True)
+
+    def remove_session(self, session_id: str):
+        shutil.rmtree(self.session_dir(session_id), ignore_errors=True)
@@ -1,5 +1,6 @@
 # backend/core_logic.py
 import re
+import json
 from io import BytesIO
 import openai
 import os
@@ -9,6 +10,9 @@ import mimetypes
 import time
 import math
 from dotenv import load_dotenv
+from gpt_cache import gpt_cache, make_cache_key
+from transcript_parser import TranscriptStreamParser, iter_transcript_blocks
+from segments import Transcript
 
 load_dotenv() # Load variables from .env
 
@@ -19,29 +23,110 @@ logger = logging.getLogger(__name__)
 HIGHLIGHT_MARKER = "[HIGHLIGHTED SEGMENT] "
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") # Read from environment
 DEFAULT_TARGET_WORD_COUNT = 60 # <--- MAKE SURE THIS LINE EXISTS
+GPT_MODEL = "gpt-4o"
+FIX_TEMPERATURE = 0.2
+TRANSLATE_TEMPERATURE = 0.3
+
+# --- Prompts (shared by the sync helpers below and the async engine in gpt_engine.py) ---
+FIX_PROMPT_INSTRUCTIONS = ("Professional transcription editor: Correct the following transcript segment. "
+                           "Fix typos and grammatical errors. "
+                           "You may slightly adjust sentence structure for better flow. "
+                           "If a word clearly doesn't fit the context, replace it with the most likely intended word. "
+                           "Preserve the original meaning as much as possible. Output ONLY the corrected text.\\n\\n")
+TRANSLATE_PROMPT_INSTRUCTIONS = (
+    "Translate the following text accurately to Norwegian (Bokmål). "
+    "Preserve the original meaning, tone, and context as much as possible. "
+    "Output ONLY the translated Norwegian text.\n\n"
+    "Text to translate:\n"
+)
+
+# Batch mode: several consecutive segments per request, exchanged as a JSON object
+# {"segments": [...]} so the reply can be checked segment by segment
+BATCH_FIX_PROMPT_INSTRUCTIONS = (
+    "Professional transcription editor: The JSON object below holds consecutive transcript segments in \"segments\". "
+    "Correct each segment independently: fix typos and grammatical errors, "
+    "you may slightly adjust sentence structure for better flow, "
+    "and if a word clearly doesn't fit the context, replace it with the most likely intended word. "
+    "Preserve the original meaning as much as possible and never move text between segments. "
+    "Reply with a JSON object {\"segments\": [...]} holding ONLY the corrected texts, "
+    "exactly one string per input segment, in the same order.\n\n"
+)
+BATCH_TRANSLATE_PROMPT_INSTRUCTIONS = (
+    "Translate each of the consecutive transcript segments in \"segments\" of the JSON object below "
+    "accurately to Norwegian (Bokmål). "
+    "Preserve the original meaning, tone, and context as much as possible and never move text between segments. "
+    "Reply with a JSON object {\"segments\": [...]} holding ONLY the translated Norwegian texts, "
+    "exactly one string per input segment, in the same order.\n\n"
+)
+
+def build_fix_prompt(text_segment: str) -> str:
+    return FIX_PROMPT_INSTRUCTIONS + text_segment
+
+def build_translation_prompt(text_segment: str) -> str:
+    return TRANSLATE_PROMPT_INSTRUCTIONS + f'"""{text_segment}"""'
+
+def build_batch_prompt(instructions: str, text_segments: list[str]) -> str:
+    return instructions + json.dumps({"segments": text_segments}, ensure_ascii=False)
+
+def parse_batch_reply(reply: str, expected_count: int) -> list[str] | None:
+    # None unless the reply is {"segments": [...]} with one non-empty string per input segment
+    try:
+        segments = json.loads(reply).get("segments")
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(segments, list) or len(segments) != expected_count:
+        return None
+    if not all(isinstance(text, str) and text.strip() for text in segments):
+        return None
+    return [text.strip() for text in segments]
+
+# Cache keys cover model, prompt template, temperature and input text
+def fix_cache_key(text_segment: str) -> str:
+    return make_cache_key(GPT_MODEL, FIX_PROMPT_INSTRUCTIONS, FIX_TEMPERATURE, text_segment)
+
+def translation_cache_key(text_segment: str) -> str:
+    return make_cache_key(GPT_MODEL, TRANSLATE_PROMPT_INSTRUCTIONS, TRANSLATE_TEMPERATURE, text_segment)
+
+def batch_fix_cache_key(text_segment: str) -> str:
+    return make_cache_key(GPT_MODEL, BATCH_FIX_PROMPT_INSTRUCTIONS, FIX_TEMPERATURE, text_segment)
+
+def batch_translation_cache_key(text_segment: str) -> str:
+    return make_cache_key(GPT_MODEL, BATCH_TRANSLATE_PROMPT_INSTRUCTIONS, TRANSLATE_TEMPERATURE, text_segment)
+
+# --- Shared Sync Client ---
+_openai_client = None
+
+def get_openai_client() -> openai.OpenAI:
+    # One client for all sync calls, so its HTTP connection pool is reused
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
 
 # --- GPT Function ---
 def fix_segment_with_gpt(text_segment):
+    cache_key = fix_cache_key(text_segment)
+    cached = gpt_cache.get(cache_key) if gpt_cache else None
+    if cached is not None:
+        return cached, None
     if not OPENAI_API_KEY:
         logger.error("fix_segment_with_gpt called without API Key.") # Use logger
         # Return original text and an error flag/message instead of raising an exception
         # so the main process can continue but signal the failure.
         return text_segment, "OpenAI API Key missing"
-    prompt = ("Professional transcription editor: Correct the following transcript segment. "
-              "Fix typos and grammatical errors. "
-              "You may slightly adjust sentence structure for better flow. "
-              "If a word clearly doesn't fit the context, replace it with the most likely intended word. "
-              "Preserve the original meaning as much as possible. Output ONLY the corrected text.\\n\\n" + text_segment)
+    prompt = build_fix_prompt(text_segment)
     try:
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        client = get_openai_client()
         response = client.chat.completions.create(
-            model="gpt-4o", messages=[{"role": "user", "content": prompt}], temperature=0.2)
+            model=GPT_MODEL, messages=[{"role": "user", "content": prompt}], temperature=FIX_TEMPERATURE)
         reply = response.choices[0].message.content.strip()
         if not reply:
             logger.warning(f"GPT empty reply for: '{text_segment[:50]}...'.") # Use logger
             # Maybe return original + warning? Or just original?
             return text_segment, "GPT returned empty reply"
-        logger.debug(f"GPT corrected: '{text_segment[:50]}...' -> '{reply[:50]}...'") # Use logger
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"GPT corrected: '{text_segment[:50]}...' -> '{reply[:50]}...'") # Use logger
+        if gpt_cache: gpt_cache.put(cache_key, reply)
         return reply, None # Return corrected text and no error
     except openai.AuthenticationError as e:
         logger.error(f"OpenAI Auth Error: {e}.") # Use logger
@@ -51,34 +136,34 @@ def fix_segment_with_gpt(text_segment):
         return text_segment, f"OpenAI API Error: {e}"
 
 def translate_segment_to_norwegian_with_gpt(text_segment: str):
-    if not OPENAI_API_KEY:
-        logger.error("translate_segment_to_norwegian_with_gpt called without API Key.")
-        return text_segment, "OpenAI API Key missing"
-
     # Ensure the input text is not empty or just whitespace
     if not text_segment or text_segment.isspace():
         logger.info("translate_segment_to_norwegian_with_gpt received empty or whitespace input, returning as is.")
         return text_segment, None # Return original, no error
 
-    prompt = (
-        "Translate the following text accurately to Norwegian (Bokmål). "
-        "Preserve the original meaning, tone, and context as much as possible. "
-        "Output ONLY the translated Norwegian text.\n\n"
-        "Text to translate:\n"
-        f'"""{text_segment}"""'  # Use single quotes for the f-string part
-    )
+    # Cached translations are served even without an API key, as in fix_segment_with_gpt
+    cache_key = translation_cache_key(text_segment)
+    cached = gpt_cache.get(cache_key) if gpt_cache else None
+    if cached is not None:
+        return cached, None
+    if not OPENAI_API_KEY:
+        logger.error("translate_segment_to_norwegian_with_gpt called without API Key.")
+        return text_segment, "OpenAI API Key missing"
+    prompt = build_translation_prompt(text_segment)
     try:
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        client = get_openai_client()
         response = client.chat.completions.create(
-            model="gpt-4o",  # Or your preferred model
+            model=GPT_MODEL,  # Or your preferred model
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.3  # Temperature can be adjusted for translation tasks
+            temperature=TRANSLATE_TEMPERATURE  # Temperature can be adjusted for translation tasks
         )
         reply = response.choices[0].message.content.strip()
         if not reply:
             logger.warning(f"GPT empty reply for translation of: '{text_segment[:50]}...'.")
             return text_segment, "GPT returned empty reply for translation"
-        logger.debug(f"GPT translated: '{text_segment[:50]}...' -> '{reply[:50]}...'")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"GPT translated: '{text_segment[:50]}...' -> '{reply[:50]}...'")
+        if gpt_cache: gpt_cache.put(cache_key, reply)
         return reply, None  # Return translated text and no error
     except openai.AuthenticationError as e:
         logger.error(f"OpenAI Auth Error during translation: {e}.")
@@ -93,15 +178,8 @@ def clean_final_text(text):
 
 # --- Timestamp Parser ---
 def parse_timestamped_transcript(text):
-    # Keep logging, but don't use st.warning
-    pattern = r"(\d{2}:\d{2}:\d{2}[.,]\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2}[.,]\d{3})\n(.*?)(?=\n\d{2}:\d{2}:\d{2}[.,]\d{3}\s*-->|\Z)"
-    matches = re.findall(pattern, text, re.DOTALL); blocks = []
-    for start, end, content in matches:
-        content = re.sub(r"^\s*\d+\s*\n", "", content); start_norm = start.replace(",", "."); end_norm = end.replace(",", ".")
-        text_clean = re.sub(r'\s+', ' ', content.strip())
-        text_clean = re.sub(r"(?<!\S)\b\d+\b(?!\S)", "", text_clean).strip()
-        text_clean = re.sub(r'\s{2,}', ' ', text_clean)
-        if text_clean: blocks.append({"start": start_norm, "end": end_norm, "text": text_clean.strip()})
+    # Single pass over the lines; see transcript_parser for the streaming version
+    blocks = list(iter_transcript_blocks(text))
     logger.info(f"Parsed/cleaned {len(blocks)} non-empty blocks.") # Use logger
     if not blocks: logger.warning("No transcript blocks found after cleaning.") # Use logger
     return blocks
@@ -135,6 +213,19 @@ def get_audio_format_from_upload(upload_file) -> str | None:
         logger.warning(f"Could not determine audio format for {filename} (type: {content_type})") # Use logger
     return fmt
 
+def sniff_audio_format(header: bytes) -> str | None:
+    # Recognise the container from its first bytes, so non-audio uploads are rejected early
+    if header.startswith(b"ID3"): return "mp3"
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE": return "wav"
+    if header.startswith(b"OggS"): return "ogg"
+    if header.startswith(b"fLaC"): return "flac"
+    if header[4:8] == b"ftyp": return "m4a"
+    if header.startswith(b"\x1aE\xdf\xa3"): return "webm"
+    if len(header) >= 2 and header[0] == 0xFF and (header[1] & 0xE0) == 0xE0:
+        # MPEG frame sync: layer bits 00 mean ADTS AAC, anything else is MPEG audio
+        return "aac" if (header[1] & 0x06) == 0 else "mp3"
+    return None
+
 def get_audio_format_from_mime(mime: str | None) -> str | None:
     # Function is fine
     if not mime: return None
@@ -146,20 +237,5 @@ def get_audio_format_from_mime(mime: str | None) -> str | None:
 
 # --- Grouping Function ---
 def group_blocks_by_word_count(blocks, target_count=60):
-    # Keep logging, function is fine
-    grouped=[]; current_text=""; current_start=None; current_end=None; current_count=0
-    if not blocks: return grouped
-    for i, block in enumerate(blocks):
-        txt=block['text']; wc=len(txt.split()); is_new = (current_count == 0)
-        finalize = not is_new and (current_count >= target_count or (current_count + wc > target_count * 1.5 and current_count > 0))
-        if finalize:
-            # Store both original and potentially edited text from start
-            grouped.append({"text": current_text.strip(), "original_text": current_text.strip(), "start": current_start, "end": current_end, "gpt_error": None}) # Add gpt_error field
-            current_text=""; current_count=0; current_start=None; is_new=True
-        if is_new: current_start=block['start']; current_text=txt
-        else: current_text += " " + txt
-        current_end=block['end']; current_count+=wc
-        if i == len(blocks) - 1 and current_count > 0:
-             grouped.append({"text": current_text.strip(), "original_text": current_text.strip(), "start": current_start, "end": current_end, "gpt_error": None}) # Add gpt_error field
-    logger.info(f"Grouped into {len(grouped)} segments (~{target_count} words).") # Use logger
-    return grouped
\ No newline at end of file
+    # Dict-shaped grouping for callers outside the API; the grouping itself runs on the columnar Transcript
+    return Transcript.from_blocks(blocks).group_by_word_count(target_count).to_dicts()
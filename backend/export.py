@@ -0,0 +1,277 @@
+# backend/export.py
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from pydub import AudioSegment
+
+from audio_cache import PcmWavReader
+from clip_store import CLIP_FORMATS, ClipStore, find_encoded
+from core_logic import HIGHLIGHT_MARKER, clean_final_text
+from segments import Transcript
+from workers import audio_scheduler, file_lock
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+EXPORT_CHUNK_CHARS = 64 * 1024  # Generated text is sent in pieces of about this size
+EXPORT_AUDIO_GAP_MS = int(os.getenv("EXPORT_AUDIO_GAP_MS", "500"))  # Silence between non-adjacent segments
+ZIP_COPY_BYTES = 1024 * 1024
+
+# format -> (file extension, content type)
+EXPORT_FORMATS = {
+    "srt": ("srt", "application/x-subrip"),
+    "vtt": ("vtt", "text/vtt"),
+    "txt": ("txt", "text/plain"),
+    "timestamped": ("txt", "text/plain"),
+    "json": ("json", "application/json"),
+}
+
+
+def _srt_time(ms: int) -> str:
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
+
+
+def _vtt_time(ms: int) -> str:
+    return _srt_time(ms).replace(",", ".")
+
+
+# --- Cue Timing ---
+def segment_cues(transcript: Transcript, index: int, by_blocks: bool = True) -> Iterator[tuple[int, int, str]]:
+    """Yields (start_ms, end_ms, text) cues for one segment.
+
+    With `by_blocks`, cues keep the original transcript's block boundaries.
+    Unedited segments reuse the block texts as they are. Edited or translated
+    text is spread over the blocks in proportion to each block's original word
+    count, so the subtitles stay in step with the audio. Otherwise the whole
+    segment becomes one cue.
+    """
+    bounds = transcript.bounds
+    first, stop = bounds[index], bounds[index + 1]
+    edited = transcript.edited_texts[index]
+    starts, ends = transcript.starts, transcript.ends
+    if not by_blocks:
+        text = transcript.block_text(first, stop) if edited is None else edited
+        yield starts[first], ends[stop - 1], clean_final_text(text)
+        return
+    if edited is None:
+        for block in range(first, stop):
+            yield starts[block], ends[block], transcript.block_text(block, block + 1)
+        return
+
+    words = edited.split()
+    word_counts = transcript.word_counts
+    total = sum(word_counts[first:stop]) or 1
+    seen = taken = 0
+    for block in range(first, stop):
+        seen += word_counts[block]
+        upto = len(words) if block == stop - 1 else round(len(words) * seen / total)
+        if upto > taken:
+            yield starts[block], ends[block], " ".join(words[taken:upto])
+            taken = upto
+
+
+# --- Text Generators (one piece per cue/segment; nothing is built for the whole session) ---
+def iter_srt(transcript: Transcript, by_blocks: bool = True) -> Iterator[str]:
+    number = 0
+    for index in range(len(transcript)):
+        for start_ms, end_ms, text in segment_cues(transcript, index, by_blocks):
+            number += 1
+            yield f"{number}\n{_srt_time(start_ms)} --> {_srt_time(end_ms)}\n{text}\n\n"
+
+
+def iter_vtt(transcript: Transcript, by_blocks: bool = True) -> Iterator[str]:
+    yield "WEBVTT\n\n"
+    for index in range(len(transcript)):
+        for start_ms, end_ms, text in segment_cues(transcript, index, by_blocks):
+            yield f"{_vtt_time(start_ms)} --> {_vtt_time(end_ms)}\n{text}\n\n"
+
+
+def iter_text(transcript: Transcript, highlighted: set[int], timestamped: bool = False) -> Iterator[str]:
+    # Segments separated by blank lines; highlighted ones carry HIGHLIGHT_MARKER (plain text only)
+    for segment in transcript:
+        text = clean_final_text(segment.text)
+        if timestamped:
+            piece = f"[{segment.start} --> {segment.end}]\n{text}"
+        else:
+            piece = f"{HIGHLIGHT_MARKER}{text}" if segment.index in highlighted else text
+        yield piece if segment.index == 0 else f"\n\n{piece}"
+    yield "\n"
+
+
+def iter_json(transcript: Transcript, session_id: str, highlighted: set[int]) -> Iterator[str]:
+    yield f'{{"session_id": {json.dumps(session_id)}, "segments": ['
+    for segment in transcript:
+        entry = segment.to_dict()
+        entry["index"] = segment.index
+        entry["highlighted"] = segment.index in highlighted
+        yield json.dumps(entry) if segment.index == 0 else ", " + json.dumps(entry)
+    yield "]}\n"
+
+
+def iter_export(transcript: Transcript, export_format: str, session_id: str, highlighted: set[int],
+                by_blocks: bool = True) -> Iterator[str]:
+    if export_format == "srt":
+        pieces = iter_srt(transcript, by_blocks)
+    elif export_format == "vtt":
+        pieces = iter_vtt(transcript, by_blocks)
+    elif export_format in ("txt", "timestamped"):
+        pieces = iter_text(transcript, highlighted, timestamped=export_format == "timestamped")
+    elif export_format == "json":
+        pieces = iter_json(transcript, session_id, highlighted)
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return _chunked(pieces)
+
+
+def _chunked(pieces: Iterable[str], size: int = EXPORT_CHUNK_CHARS) -> Iterator[str]:
+    # Per-cue strings are tiny; batching them keeps the number of response writes low
+    buffer, buffered = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield "".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+# --- Zip Bundle (transcript + stitched audio) ---
+class _ZipChunkWriter(io.RawIOBase):
+    """Write-only, unseekable sink: ZipFile then streams entries with data descriptors."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(transcript_name: str, transcript_chunks: Iterable[str], audio_name: str | None,
+             audio_path: Path | None) -> Iterator[bytes]:
+    """Streams a zip of the generated transcript and (optionally) an audio file, without buffering either whole."""
+    sink = _ZipChunkWriter()
+    with zipfile.ZipFile(sink, "w") as bundle:
+        info = zipfile.ZipInfo(transcript_name)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with bundle.open(info, "w", force_zip64=True) as entry:
+            for chunk in transcript_chunks:
+                entry.write(chunk.encode("utf-8"))
+                yield sink.drain()
+        if audio_path is not None:
+            # Already compressed (or PCM that barely shrinks): stored as-is
+            info = zipfile.ZipInfo(audio_name)
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = audio_path.stat().st_size
+            with bundle.open(info, "w") as entry, open(audio_path, "rb") as audio_file:
+                while data := audio_file.read(ZIP_COPY_BYTES):
+                    entry.write(data)
+                    yield sink.drain()
+    yield sink.drain()
+
+
+# --- Stitched Audio ---
+def render_stitched_audio(pcm_path: str, ranges: list[tuple[int, int]], out_base: str) -> tuple[str, str]:
+    """Concatenates the given ms ranges of a PCM WAV into one file (MP3, WAV fallback). Runs in a worker.
+
+    Only the ranges' frames are read from disk, as for segment clips. A range
+    starting within EXPORT_AUDIO_GAP_MS of the previous one's end continues
+    from it, pause included. Ranges further apart are separated by
+    EXPORT_AUDIO_GAP_MS of silence.
+    """
+    with file_lock(out_base):
+        found = find_encoded(out_base)
+        if found:
+            return found
+        with PcmWavReader(pcm_path) as wav:
+            frame_rate, frame_count = wav.getframerate(), wav.getnframes()
+            duration_ms = frame_count * 1000 // frame_rate
+            gap = b"\x00" * (int(frame_rate * EXPORT_AUDIO_GAP_MS / 1000) * wav.getsampwidth() * wav.getnchannels())
+            pieces = []
+            previous_end = None
+            for start_ms, end_ms in ranges:
+                start_ms, end_ms = max(0, start_ms), min(end_ms, duration_ms)
+                if previous_end is not None:
+                    if start_ms - previous_end <= EXPORT_AUDIO_GAP_MS:
+                        start_ms = previous_end
+                    elif start_ms < end_ms:
+                        pieces.append(gap)
+                if start_ms >= end_ms:
+                    continue
+                first = start_ms * frame_rate // 1000
+                wav.setpos(first)
+                pieces.append(wav.readframes(end_ms * frame_rate // 1000 - first))
+                previous_end = end_ms
+            stitched = AudioSegment(data=b"".join(pieces), sample_width=wav.getsampwidth(),
+                                    frame_rate=frame_rate, channels=wav.getnchannels())
+        del pieces
+
+        last_error = None
+        for export_format, content_type in CLIP_FORMATS:
+            final_path = f"{out_base}.{export_format}"
+            tmp_path = f"{final_path}.tmp-{os.getpid()}"
+            try:
+                stitched.export(tmp_path, format=export_format)
+                os.replace(tmp_path, final_path)
+                return final_path, content_type
+            except Exception as e:
+                last_error = e
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        raise RuntimeError(f"Failed to export stitched audio: {last_error}")
+
+
+class ExportAudioStore:
+    """Stitched audio for exports, cached in the session's clip directory by the set of ranges."""
+
+    def __init__(self, clip_store: ClipStore):
+        self.clip_store = clip_store
+        self._pending: dict[Path, asyncio.Task] = {}
+
+    def _base(self, session_id: str, ranges: list[tuple[int, int]]) -> Path:
+        digest = hashlib.sha256(json.dumps(ranges).encode()).hexdigest()[:16]
+        return self.clip_store.session_dir(session_id) / f"export-{digest}"
+
+    async def ensure(self, session_id: str, load_pcm, ranges: list[tuple[int, int]]) -> tuple[Path, str]:
+        """Returns the stitched file; `load_pcm` is an async callable returning the decoded audio."""
+        base = self._base(session_id, ranges)
+        for export_format, content_type in CLIP_FORMATS:
+            path = base.with_name(f"{base.name}.{export_format}")
+            if path.exists():
+                return path, content_type
+        task = self._pending.get(base)
+        if task is None:
+            task = asyncio.create_task(self._render(session_id, load_pcm, ranges, base))
+            self._pending[base] = task
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _render(self, session_id: str, load_pcm, ranges: list[tuple[int, int]], base: Path) -> tuple[Path, str]:
+        try:
+            pcm_path = await load_pcm()
+            base.parent.mkdir(parents=True, exist_ok=True)
+            path, content_type = await audio_scheduler.run(
+                session_id, "export_audio", render_stitched_audio, pcm_path, ranges, str(base))
+            logger.info(f"[{session_id}] Rendered export audio {path} ({len(ranges)} segments)")
+            return Path(path), content_type
+        finally:
+            self._pending.pop(base, None)
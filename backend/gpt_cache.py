@@ -0,0 +1,131 @@
+# backend/gpt_cache.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+GPT_CACHE_PATH = os.getenv("GPT_CACHE_PATH", str(Path(__file__).resolve().parent / "gpt_cache.sqlite3"))
+GPT_CACHE_MAX_BYTES = int(os.getenv("GPT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+GPT_CACHE_MAX_AGE_SECONDS = int(os.getenv("GPT_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+GPT_CACHE_ENABLED = os.getenv("GPT_CACHE_ENABLED", "1") not in ("0", "false", "False")
+EVICT_EVERY_N_PUTS = 200
+
+
+def make_cache_key(model: str, prompt_template: str, temperature: float, text: str) -> str:
+    # Any change to model, prompt wording or temperature yields a different key
+    payload = json.dumps([model, prompt_template, temperature, text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    """Hit/miss counts for one processing request, reported back in the API response."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+# --- Persistent GPT Reply Cache ---
+class GPTCache:
+    """Content-addressed SQLite cache of GPT replies with age and size eviction.
+
+    Safe to share between threads (one connection guarded by a lock) and between
+    uvicorn workers (SQLite WAL mode on the same file).
+    """
+
+    def __init__(self, path: str = GPT_CACHE_PATH, max_bytes: int = GPT_CACHE_MAX_BYTES,
+                 max_age_seconds: int = GPT_CACHE_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+        self._puts_since_evict = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS gpt_cache ("
+                " key TEXT PRIMARY KEY, reply TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS gpt_cache_accessed ON gpt_cache (accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                row = conn.execute("SELECT reply, created_at FROM gpt_cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                reply, created_at = row
+                if now - created_at > self.max_age_seconds:
+                    conn.execute("DELETE FROM gpt_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                conn.execute("UPDATE gpt_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                conn.commit()
+                return reply
+        except sqlite3.Error as e:
+            # A broken cache must never break processing
+            logger.error(f"GPT cache read failed: {e}")
+            return None
+
+    def put(self, key: str, reply: str):
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO gpt_cache (key, reply, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, reply, len(reply.encode("utf-8")), now, now))
+                conn.commit()
+                self._puts_since_evict += 1
+                if self._puts_since_evict >= EVICT_EVERY_N_PUTS:
+                    self._puts_since_evict = 0
+                    self._evict_locked(conn, now)
+        except sqlite3.Error as e:
+            logger.error(f"GPT cache write failed: {e}")
+
+    def evict(self):
+        try:
+            with self._lock:
+                self._evict_locked(self._connect(), time.time())
+        except sqlite3.Error as e:
+            logger.error(f"GPT cache eviction failed: {e}")
+
+    def _evict_locked(self, conn: sqlite3.Connection, now: float):
+        expired = conn.execute("DELETE FROM gpt_cache WHERE created_at < ?", (now - self.max_age_seconds,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM gpt_cache").fetchone()[0]
+        removed = 0
+        if total > self.max_bytes:
+            # Drop least recently used entries until we're back under budget
+            excess = total - self.max_bytes
+            for key, size in conn.execute("SELECT key, size FROM gpt_cache ORDER BY accessed_at").fetchall():
+                if excess <= 0:
+                    break
+                conn.execute("DELETE FROM gpt_cache WHERE key = ?", (key,))
+                excess -= size
+                removed += 1
+        conn.commit()
+        if expired or removed:
+            logger.info(f"GPT cache eviction: {expired} expired, {removed} over size budget.")
+
+
+gpt_cache = GPTCache() if GPT_CACHE_ENABLED else None
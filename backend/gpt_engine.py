@@ -0,0 +1,370 @@
+# backend/gpt_engine.py
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Iterable
+
+import openai
+
+import core_logic
+from core_logic import (
+    GPT_MODEL,
+    FIX_TEMPERATURE,
+    TRANSLATE_TEMPERATURE,
+    BATCH_FIX_PROMPT_INSTRUCTIONS,
+    BATCH_TRANSLATE_PROMPT_INSTRUCTIONS,
+    build_fix_prompt,
+    build_translation_prompt,
+    build_batch_prompt,
+    parse_batch_reply,
+    fix_cache_key,
+    translation_cache_key,
+    batch_fix_cache_key,
+    batch_translation_cache_key,
+)
+from gpt_cache import CacheStats, gpt_cache
+from metrics import STAGE_SECONDS, GPT_REQUEST_SECONDS, GPT_TOKENS, GPT_RETRIES, GPT_CACHE_LOOKUPS
+from segments import Segment
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+GPT_MAX_CONCURRENCY = int(os.getenv("GPT_MAX_CONCURRENCY", "8"))
+GPT_REQUESTS_PER_MINUTE = int(os.getenv("GPT_REQUESTS_PER_MINUTE", "500"))  # 0 disables the limit
+GPT_TOKENS_PER_MINUTE = int(os.getenv("GPT_TOKENS_PER_MINUTE", "30000"))    # 0 disables the limit
+GPT_MAX_RETRIES = int(os.getenv("GPT_MAX_RETRIES", "5"))
+# Approximate segment-text tokens packed into one batched request; 0 sends one request per segment
+GPT_BATCH_TOKENS = int(os.getenv("GPT_BATCH_TOKENS", "1500"))
+GPT_BACKOFF_BASE_SECONDS = 1.0
+GPT_BACKOFF_MAX_SECONDS = 30.0
+
+# Errors worth retrying: 429 (RateLimitError), 5xx (InternalServerError) and transport failures
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,  # Includes APITimeoutError
+)
+
+
+def estimate_tokens(prompt: str, text_segment: str) -> int:
+    # Rough 4-chars-per-token estimate: prompt in, roughly the segment's size back out
+    return (len(prompt) + len(text_segment)) // 4 + 16
+
+
+def split_into_batches(segments: list[Segment], batch_tokens: int) -> list[list[Segment]]:
+    """Packs consecutive segments into batches of at most ~batch_tokens text tokens (at least one segment each)."""
+    batches, current, current_tokens = [], [], 0
+    for seg in segments:
+        tokens = len(seg.text) // 4 + 1
+        if current and current_tokens + tokens > batch_tokens:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(seg)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+# --- Rate Limiting ---
+class TokenBucket:
+    """Async token bucket refilled continuously at `per_minute` units per minute."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: int = 1):
+        if self.capacity <= 0:
+            return  # Unlimited
+        amount = min(amount, self.capacity)  # A single oversized request must still be able to run
+        # Holding the lock while sleeping keeps waiters FIFO
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+# --- GPT Engine ---
+class GPTEngine:
+    """Runs correction and translation calls concurrently without blocking the event loop.
+
+    Calls share one AsyncOpenAI client, are bounded by a semaphore, throttled by
+    request and token buckets, and retried with exponential backoff on 429/5xx.
+    Failures never raise: like the sync helpers in core_logic, each stage returns
+    the input text plus an error message for the segment's `gpt_error` field.
+    Replies are looked up in / written to the persistent GPT cache first.
+
+    With `batch_tokens` > 0, consecutive segments are packed into one JSON-mode
+    request per stage; a reply whose segment count doesn't match falls back to
+    one request per segment.
+    """
+
+    def __init__(self, max_concurrency: int = GPT_MAX_CONCURRENCY,
+                 requests_per_minute: int = GPT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = GPT_TOKENS_PER_MINUTE,
+                 max_retries: int = GPT_MAX_RETRIES,
+                 batch_tokens: int = GPT_BATCH_TOKENS):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.batch_tokens = batch_tokens
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+        self._client = None
+
+    def _get_client(self) -> openai.AsyncOpenAI:
+        if self._client is None:
+            # Retries are handled here so they go through the rate limiters
+            self._client = openai.AsyncOpenAI(api_key=core_logic.OPENAI_API_KEY, max_retries=0)
+        return self._client
+
+    async def _complete(self, prompt: str, temperature: float, estimated_tokens: int, json_mode: bool = False) -> str:
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        mode = "batch" if json_mode else "single"
+        attempt = 0
+        while True:
+            await self._request_bucket.acquire(1)
+            await self._token_bucket.acquire(estimated_tokens)
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    try:
+                        response = await self._get_client().chat.completions.create(
+                            model=GPT_MODEL, messages=[{"role": "user", "content": prompt}], temperature=temperature,
+                            **extra)
+                    except Exception:
+                        GPT_REQUEST_SECONDS.observe(time.perf_counter() - started, mode=mode, outcome="error")
+                        raise
+                    GPT_REQUEST_SECONDS.observe(time.perf_counter() - started, mode=mode, outcome="ok")
+                usage = getattr(response, "usage", None)
+                if usage is not None:
+                    GPT_TOKENS.inc(usage.prompt_tokens or 0, kind="prompt")
+                    GPT_TOKENS.inc(usage.completion_tokens or 0, kind="completion")
+                return (response.choices[0].message.content or "").strip()
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+                GPT_RETRIES.inc(error=type(e).__name__)
+                logger.warning(f"Retryable OpenAI error ({type(e).__name__}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), GPT_BACKOFF_MAX_SECONDS)
+            except ValueError:
+                pass
+        backoff = min(GPT_BACKOFF_BASE_SECONDS * (2 ** attempt), GPT_BACKOFF_MAX_SECONDS)
+        return backoff * (0.5 + random.random() / 2)  # Jitter so parallel retries spread out
+
+    @staticmethod
+    async def _cache_get(cache_key: str, cache_stats: CacheStats | None, *other_keys: str) -> str | None:
+        # Counted as one lookup however many keys are tried; the first key holding a reply wins
+        if gpt_cache is None:
+            return None
+        cached = None
+        for key in (cache_key, *other_keys):
+            cached = await asyncio.to_thread(gpt_cache.get, key)
+            if cached is not None:
+                break
+        GPT_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+        if cache_stats is not None:
+            if cached is None:
+                cache_stats.misses += 1
+            else:
+                cache_stats.hits += 1
+        return cached
+
+    @staticmethod
+    async def _cache_put(cache_key: str, reply: str):
+        if gpt_cache is not None:
+            await asyncio.to_thread(gpt_cache.put, cache_key, reply)
+
+    async def fix_segment(self, text_segment: str, cache_stats: CacheStats | None = None):
+        cache_key = fix_cache_key(text_segment)
+        cached = await self._cache_get(cache_key, cache_stats)
+        if cached is not None:
+            return cached, None
+        if not core_logic.OPENAI_API_KEY:
+            logger.error("GPTEngine.fix_segment called without API Key.")
+            return text_segment, "OpenAI API Key missing"
+        prompt = build_fix_prompt(text_segment)
+        try:
+            reply = await self._complete(prompt, FIX_TEMPERATURE, estimate_tokens(prompt, text_segment))
+            if not reply:
+                logger.warning(f"GPT empty reply for: '{text_segment[:50]}...'.")
+                return text_segment, "GPT returned empty reply"
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"GPT corrected: '{text_segment[:50]}...' -> '{reply[:50]}...'")
+            await self._cache_put(cache_key, reply)
+            return reply, None
+        except openai.AuthenticationError as e:
+            logger.error(f"OpenAI Auth Error: {e}.")
+            return text_segment, "OpenAI Authentication Error"
+        except Exception as e:
+            logger.error(f"OpenAI API Error: {e}.")
+            return text_segment, f"OpenAI API Error: {e}"
+
+    async def translate_segment(self, text_segment: str, cache_stats: CacheStats | None = None):
+        if not text_segment or text_segment.isspace():
+            return text_segment, None
+        cache_key = translation_cache_key(text_segment)
+        cached = await self._cache_get(cache_key, cache_stats)
+        if cached is not None:
+            return cached, None
+        if not core_logic.OPENAI_API_KEY:
+            logger.error("GPTEngine.translate_segment called without API Key.")
+            return text_segment, "OpenAI API Key missing"
+        prompt = build_translation_prompt(text_segment)
+        try:
+            reply = await self._complete(prompt, TRANSLATE_TEMPERATURE, estimate_tokens(prompt, text_segment))
+            if not reply:
+                logger.warning(f"GPT empty reply for translation of: '{text_segment[:50]}...'.")
+                return text_segment, "GPT returned empty reply for translation"
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"GPT translated: '{text_segment[:50]}...' -> '{reply[:50]}...'")
+            await self._cache_put(cache_key, reply)
+            return reply, None
+        except openai.AuthenticationError as e:
+            logger.error(f"OpenAI Auth Error during translation: {e}.")
+            return text_segment, "OpenAI Authentication Error during translation"
+        except Exception as e:
+            logger.error(f"OpenAI API Error during translation: {e}.")
+            return text_segment, f"OpenAI API Error during translation: {e}"
+
+    async def fix_batch(self, text_segments: list[str], cache_stats: CacheStats | None = None):
+        """Batched `fix_segment`: returns one (text, error) per input, in order."""
+        return await self._run_batch(text_segments, BATCH_FIX_PROMPT_INSTRUCTIONS, FIX_TEMPERATURE,
+                                     batch_fix_cache_key, fix_cache_key, self.fix_segment, "correction", cache_stats)
+
+    async def translate_batch(self, text_segments: list[str], cache_stats: CacheStats | None = None):
+        """Batched `translate_segment`: returns one (text, error) per input, in order."""
+        return await self._run_batch(text_segments, BATCH_TRANSLATE_PROMPT_INSTRUCTIONS, TRANSLATE_TEMPERATURE,
+                                     batch_translation_cache_key, translation_cache_key, self.translate_segment,
+                                     "translation", cache_stats)
+
+    async def _run_batch(self, text_segments: list[str], instructions: str, temperature: float,
+                         cache_key_fn, single_cache_key_fn, single_call, stage: str, cache_stats: CacheStats | None):
+        results: list[tuple[str, str | None] | None] = [None] * len(text_segments)
+        uncached = []
+        for i, text in enumerate(text_segments):
+            if not text or text.isspace():
+                results[i] = (text, None)
+                continue
+            # A reply cached by the one-by-one path is as good as a batched one
+            cached = await self._cache_get(cache_key_fn(text), cache_stats, single_cache_key_fn(text))
+            if cached is not None:
+                results[i] = (cached, None)
+            else:
+                uncached.append(i)
+
+        if len(uncached) > 1 and core_logic.OPENAI_API_KEY:
+            texts = [text_segments[i] for i in uncached]
+            prompt = build_batch_prompt(instructions, texts)
+            try:
+                reply = await self._complete(prompt, temperature, estimate_tokens(prompt, "".join(texts)), json_mode=True)
+                replies = parse_batch_reply(reply, len(texts))
+                if replies is None:
+                    logger.warning(f"Batched {stage} reply didn't match the {len(texts)} segments sent; retrying them one by one.")
+            except Exception as e:
+                logger.warning(f"Batched {stage} request failed ({e}); retrying its {len(texts)} segments one by one.")
+                replies = None
+            if replies is not None:
+                for i, reply in zip(uncached, replies):
+                    results[i] = (reply, None)
+                    await self._cache_put(cache_key_fn(text_segments[i]), reply)
+                return results
+
+        # One request per segment: a lone uncached segment, a rejected batch, or no API key.
+        # Their lookups were counted above, so the single calls don't count them again.
+        singles = await asyncio.gather(*(single_call(text_segments[i]) for i in uncached))
+        for i, result in zip(uncached, singles):
+            results[i] = result
+        return results
+
+    @staticmethod
+    def _apply_fix(seg: Segment, corrected_text: str, gpt_error: str | None, label: str):
+        seg.text = corrected_text
+        seg.gpt_error = gpt_error
+        if gpt_error:
+            logger.warning(f"{label}GPT error: {gpt_error}")
+
+    @staticmethod
+    def _apply_translation(seg: Segment, translated_text: str, translate_error: str | None, label: str):
+        seg.text = translated_text
+        if translate_error:
+            new_error_msg = f"TranslateError: {translate_error}"
+            seg.gpt_error = f"{seg.gpt_error}; {new_error_msg}" if seg.gpt_error else new_error_msg
+            logger.warning(f"{label}Translation error: {translate_error}")
+
+    async def process_segment(self, seg: Segment, fix_typos: bool, translate_norwegian: bool, label: str = "",
+                              cache_stats: CacheStats | None = None):
+        # Correction feeds straight into translation for this segment, independent of the others
+        if fix_typos:
+            self._apply_fix(seg, *await self.fix_segment(seg.text, cache_stats), label)
+        if translate_norwegian:
+            self._apply_translation(seg, *await self.translate_segment(seg.text, cache_stats), label)
+
+    async def process_batch(self, segs: list[Segment], fix_typos: bool, translate_norwegian: bool,
+                            session_id: str = "", cache_stats: CacheStats | None = None):
+        # Same stages as process_segment, one request per stage for the whole batch
+        if fix_typos:
+            results = await self.fix_batch([seg.text for seg in segs], cache_stats)
+            for seg, result in zip(segs, results):
+                self._apply_fix(seg, *result, f"[{session_id}] seg {seg.index}: ")
+        if translate_norwegian:
+            results = await self.translate_batch([seg.text for seg in segs], cache_stats)
+            for seg, result in zip(segs, results):
+                self._apply_translation(seg, *result, f"[{session_id}] seg {seg.index}: ")
+
+    async def process_segments(self, segments: Iterable[Segment], fix_typos: bool, translate_norwegian: bool,
+                               session_id: str = "", on_segment_done=None,
+                               cache_stats: CacheStats | None = None) -> CacheStats:
+        """Runs the enabled GPT stages over the given segments concurrently, updating them in place.
+
+        `on_segment_done(index)` is called as each segment finishes all of its stages.
+        Returns the cache hit/miss counts for this run.
+        """
+        cache_stats = cache_stats if cache_stats is not None else CacheStats()
+        segments = list(segments)
+        if self.batch_tokens > 0 and len(segments) > 1:
+            batches = split_into_batches(segments, self.batch_tokens)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"[{session_id}] {len(segments)} segments packed into {len(batches)} GPT batches.")
+        else:
+            batches = [[seg] for seg in segments]
+        # Only as many batches in flight as there are call slots, so early ones move on to
+        # translation while later ones are still waiting for correction
+        window = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(batch: list[Segment]):
+            async with window:
+                if len(batch) == 1:
+                    await self.process_segment(batch[0], fix_typos, translate_norwegian,
+                                               label=f"[{session_id}] seg {batch[0].index}: ", cache_stats=cache_stats)
+                else:
+                    await self.process_batch(batch, fix_typos, translate_norwegian,
+                                             session_id=session_id, cache_stats=cache_stats)
+            if on_segment_done is not None:
+                for seg in batch:
+                    on_segment_done(seg.index)
+
+        with STAGE_SECONDS.time(stage="gpt"):
+            await asyncio.gather(*(run(batch) for batch in batches))
+        return cache_stats
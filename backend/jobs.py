@@ -0,0 +1,243 @@
+# backend/jobs.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from gpt_cache import CacheStats
+from segments import Transcript
+from session_store import SESSION_DB_PATH, SESSION_STORE
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "0.5"))  # Event streams of other workers' jobs
+# Finished segments are written to the shared job store in batches, at most this often
+JOB_PUBLISH_INTERVAL_SECONDS = float(os.getenv("JOB_PUBLISH_INTERVAL_SECONDS", "0.25"))
+# A job whose state hasn't changed for this long is reported failed (its worker probably exited)
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "600"))
+
+
+# --- Background Processing Job ---
+class ProcessingJob:
+    """Tracks the background GPT stages of one session started via /api/jobs.
+
+    Segments are updated in place in the session's Transcript by the GPT
+    engine; finished indices are recorded in completion order so any number of
+    event-stream clients can follow along (and late clients replay what
+    already finished).
+    """
+
+    def __init__(self, session_id: str, segments: Transcript, editor_status: str, on_finish=None,
+                 job_store: "SQLiteJobStore | None" = None):
+        self.session_id = session_id
+        self.segments = segments
+        self.editor_status = editor_status
+        self.status = "pending"  # pending -> running -> done | failed
+        self.error: str | None = None
+        self.cache_stats = CacheStats()
+        self._completed: list[int] = []
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._on_finish = on_finish
+        self._job_store = job_store
+        self._unpublished: list[tuple[int, int, dict]] = []  # (seq, index, segment) not yet in the job store
+        self._publish_pending = False
+        self._publisher: asyncio.Task | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def start(self, gpt_engine, fix_typos: bool, translate_norwegian: bool):
+        self.status = "running"
+        if self._job_store is not None:
+            # Written right away, so the job is visible to other workers by the time the response arrives
+            try:
+                self._job_store.publish(self.snapshot())
+            except Exception as e:
+                logger.error(f"[{self.session_id}] Failed to publish job state: {e}")
+        if not (fix_typos or translate_norwegian):
+            # Nothing to run: every segment is final already
+            for i in range(len(self.segments)):
+                self._mark_done(i)
+            self._finish("done")
+            return
+        # Keep a reference so the task isn't garbage-collected mid-run
+        self._task = asyncio.create_task(self._run(gpt_engine, fix_typos, translate_norwegian))
+
+    async def _run(self, gpt_engine, fix_typos: bool, translate_norwegian: bool):
+        logger.info(f"[{self.session_id}] Job started for {len(self.segments)} segments.")
+        try:
+            await gpt_engine.process_segments(self.segments, fix_typos, translate_norwegian,
+                                              session_id=self.session_id, on_segment_done=self._mark_done,
+                                              cache_stats=self.cache_stats)
+            self._finish("done")
+            logger.info(f"[{self.session_id}] Job finished.")
+        except asyncio.CancelledError:
+            # Cancelled when the session is evicted: end the event streams, but don't save the session back
+            logger.info(f"[{self.session_id}] Job cancelled.")
+            self.error = "Job was cancelled."
+            self._finish("failed", run_hook=False)
+            raise
+        except Exception as e:
+            logger.error(f"[{self.session_id}] Job failed: {e}", exc_info=True)
+            self.error = str(e)
+            self._finish("failed")
+
+    def _mark_done(self, index: int):
+        self._completed.append(index)
+        self._publish(index)
+        self._notify()
+
+    def _finish(self, status: str, run_hook: bool = True):
+        self.status = status
+        if run_hook and self._on_finish is not None:
+            try:
+                self._on_finish()
+            except Exception as e:
+                logger.error(f"[{self.session_id}] Job completion hook failed: {e}")
+        # Published after the hook saved the session, so other workers never see "done" before the results
+        self._publish()
+        self._notify()
+
+    def _publish(self, index: int | None = None):
+        # Mirrors progress into the shared store for the other uvicorn workers. Writes happen
+        # off the event loop, batched by a single publisher task per job.
+        if self._job_store is None:
+            return
+        if index is not None:
+            self._unpublished.append((len(self._completed), index, self.segments[index].to_dict()))
+        self._publish_pending = True
+        if self._publisher is None or self._publisher.done():
+            self._publisher = asyncio.create_task(self._run_publisher())
+
+    async def _run_publisher(self):
+        while self._publish_pending and self._job_store is not None:
+            self._publish_pending = False
+            events, self._unpublished = self._unpublished, []
+            try:
+                await asyncio.to_thread(self._job_store.publish, self.snapshot(), events)
+            except Exception as e:
+                logger.error(f"[{self.session_id}] Failed to publish job state: {e}")
+            if not self.finished:
+                await asyncio.sleep(JOB_PUBLISH_INTERVAL_SECONDS)
+
+    def _notify(self):
+        # Wake every waiter, then arm a fresh event for the next change
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    async def iter_completed(self):
+        """Yields segment indices as they finish, starting with those already done."""
+        cursor = 0
+        while True:
+            while cursor < len(self._completed):
+                yield self._completed[cursor]
+                cursor += 1
+            if self.finished:
+                return
+            await self._changed.wait()
+
+    def snapshot(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "status": self.status,
+            "error": self.error,
+            "editor_status": self.editor_status,
+            "completed": len(self._completed),
+            "total": len(self.segments),
+            "gpt_cache": self.cache_stats.as_dict(),
+        }
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._job_store = None  # The session (and its job rows) are being deleted
+
+
+# --- Shared Job State (SQLite, for several uvicorn workers on one host) ---
+class SQLiteJobStore:
+    """Job snapshots and finished-segment events in the session database.
+
+    The worker running a job publishes every change, so status and event
+    requests that land on any other worker are answered from here (events
+    by polling), and edits there can tell the session is still processing.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, stale_seconds: int = JOB_STALE_SECONDS):
+        self.path = path
+        self.stale_seconds = stale_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (session_id TEXT PRIMARY KEY, snapshot TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " session_id TEXT NOT NULL, seq INTEGER NOT NULL, segment_index INTEGER NOT NULL, segment TEXT NOT NULL,"
+            " PRIMARY KEY (session_id, seq))")
+        self._conn.commit()
+
+    def publish(self, snapshot: dict, events: list[tuple[int, int, dict]] = ()):
+        """Stores the job's snapshot and finished-segment events as (seq, index, segment), in one transaction."""
+        session_id = snapshot["session_id"]
+        with self._lock:
+            if events:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO job_events (session_id, seq, segment_index, segment) VALUES (?, ?, ?, ?)",
+                    [(session_id, seq, index, json.dumps(segment)) for seq, index, segment in events])
+            self._conn.execute("INSERT OR REPLACE INTO jobs (session_id, snapshot, updated_at) VALUES (?, ?, ?)",
+                               (session_id, json.dumps(snapshot), time.time()))
+            self._conn.commit()
+
+    def snapshot(self, session_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT snapshot, updated_at FROM jobs WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        snapshot = json.loads(row[0])
+        if snapshot["status"] not in ("done", "failed") and time.time() - row[1] > self.stale_seconds:
+            snapshot["status"] = "failed"
+            snapshot["error"] = "Job stopped reporting progress."
+        return snapshot
+
+    def is_running(self, session_id: str) -> bool:
+        snapshot = self.snapshot(session_id)
+        return snapshot is not None and snapshot["status"] not in ("done", "failed")
+
+    def events(self, session_id: str, after: int = 0) -> list[tuple[int, int, dict]]:
+        """Finished segments as (seq, index, segment), in completion order, after event `after`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, segment_index, segment FROM job_events WHERE session_id = ? AND seq > ? ORDER BY seq",
+                (session_id, after)).fetchall()
+        return [(seq, index, json.loads(segment)) for seq, index, segment in rows]
+
+    async def iter_events(self, session_id: str):
+        """Yields (index, segment) until the job is finished, polling for new events."""
+        cursor = 0
+        while True:
+            # Snapshot first: events published before it finished are all read below
+            snapshot = self.snapshot(session_id)
+            for cursor, index, segment in self.events(session_id, cursor):
+                yield index, segment
+            if snapshot is None or snapshot["status"] in ("done", "failed"):
+                return
+            await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM job_events WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM jobs WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+
+def create_job_store() -> SQLiteJobStore | None:
+    # In-memory sessions live in one worker, so its local jobs are all there is to know
+    return SQLiteJobStore() if SESSION_STORE == "sqlite" else None
@@ -1,41 +1,186 @@
 # backend/main.py
 import os
+import json
+import codecs
+import hashlib
+import time
+import shutil
+import asyncio
 import uuid
 import logging
-from io import BytesIO
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Literal
 
 import aiofiles
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks, Response, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Response, Request, Query
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydub import AudioSegment
+from pydantic import BaseModel, Field, ValidationError
+from audio_cache import DecodedAudioCache
+from gpt_engine import GPTEngine
+from jobs import ProcessingJob, create_job_store
+from gpt_cache import CacheStats
+from clip_store import ClipStore
+from peaks import PeaksStore
+from session_stream import SessionStreamStore
+from export import EXPORT_FORMATS, ExportAudioStore, iter_export, iter_zip
+from segments import Transcript, TranscriptBuilder
+from segmentation import DEFAULT_SEGMENTATION, SEGMENTATION_STRATEGIES, SilenceStore, uses_silences
+from workers import AudioBusyError, WEB_CONCURRENCY, shutdown_process_pool
+from multipart_stream import FormPart, MultipartError, MultipartStream
+from metrics import REGISTRY, STAGE_SECONDS, CLIP_LOOKUPS, CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware
+from session_store import (create_session_store, SessionConflictError, SESSION_STORE, SESSION_SWEEP_INTERVAL_SECONDS,
+                           SESSION_TTL_SECONDS)
 
 # Import functions from core_logic
 from core_logic import (
-    parse_timestamped_transcript,
+    TranscriptStreamParser,
+    sniff_audio_format,
     get_audio_format_from_upload,
-    group_blocks_by_word_count,
-    fix_segment_with_gpt,
-    translate_segment_to_norwegian_with_gpt,
-    get_audio_segment,
-    time_to_millis, # Needed for audio slicing
-    HIGHLIGHT_MARKER, # Might be needed if backend adds markers later
-    clean_final_text, # Might be needed for preview/final generation later
-    DEFAULT_TARGET_WORD_COUNT # <---- UNCOMMENT THIS LINE
+    DEFAULT_TARGET_WORD_COUNT
 )
 
 # --- Setup Logging & Temp Directory ---
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# DEBUG also logs per-segment GPT replies and clip renders
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 TEMP_DIR = Path("./temp_audio")
 TEMP_DIR.mkdir(exist_ok=True)
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+MAX_TRANSCRIPT_UPLOAD_BYTES = int(os.getenv("MAX_TRANSCRIPT_UPLOAD_BYTES", str(64 * 1024 * 1024)))
+MAX_FORM_FIELD_BYTES = 64 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# After upload, sessions whose client plays per-segment clips (the upload's `playback` field) get
+# their clips pre-rendered, and stream sessions their session stream; either is still rendered on
+# demand otherwise. PRERENDER_CLIPS=0 turns pre-rendering off for every session.
+PRERENDER_CLIPS = os.getenv("PRERENDER_CLIPS", "1") not in ("0", "false", "False")
 
-# --- In-Memory Storage (Replace with DB/Redis for production) ---
-# Stores session data: { session_id: {"audio_path": str, "audio_format": str, "segments": list[dict]} }
-session_data = {}
+# Decoded PCM per recording as TEMP_DIR/<audio_sha256>.pcm.wav, shared by all uvicorn workers
+audio_cache = DecodedAudioCache(TEMP_DIR)
+
+# Shared async GPT engine; its concurrency and rate limits apply across all sessions
+gpt_engine = GPTEngine()
+
+# Pre-encoded segment clips, one directory per session under TEMP_DIR/clips
+clip_store = ClipStore(TEMP_DIR / "clips")
+
+# Whole-session encoded stream (plus segment manifest), kept in the session's clip directory
+session_streams = SessionStreamStore(clip_store)
+
+# Stitched audio of selected segments for export bundles, also kept in the session's clip directory
+export_audio = ExportAudioStore(clip_store)
+
+# Waveform peaks index per recording as TEMP_DIR/<audio_sha256>.peaks, built from the decoded PCM
+peaks_store = PeaksStore(TEMP_DIR)
+
+# Silence runs for pause-aware segmentation, scanned on demand into TEMP_DIR/<session_id>.silences
+silence_store = SilenceStore(TEMP_DIR)
+
+# Background GPT jobs started via /api/jobs in this worker, keyed by session_id
+jobs: dict[str, ProcessingJob] = {}
+
+# With SESSION_STORE=sqlite, job progress is mirrored to the session database for the other workers
+job_store = create_job_store()
+
+# Edit requests on one session run one at a time in this worker: session_id -> [lock, users]
+session_locks: dict[str, list] = {}
+
+
+# --- Session Cleanup (TTL / LRU eviction and orphaned files) ---
+def remove_session_files(session_id: str, audio_path: str | None):
+    if audio_path:
+        remove_temp_file(Path(audio_path))
+    silence_store.remove_session(session_id)
+    clip_store.remove_session(session_id)
+
+
+def cleanup_session(session_id: str, session: dict):
+    """Drops everything derived from an evicted session: job, decoded audio, upload, peaks and clips."""
+    job = jobs.pop(session_id, None)
+    if job:
+        job.cancel()
+    if job_store is not None:
+        job_store.delete(session_id)
+    audio_cache.evict(audio_cache_key(session_id, session))
+    session_streams.forget(session_id)
+    try:
+        # File deletion can be slow for big clip directories; keep it off the event loop
+        asyncio.get_running_loop().run_in_executor(None, remove_session_files, session_id, session.get("audio_path"))
+    except RuntimeError:
+        remove_session_files(session_id, session.get("audio_path"))
+
+
+def sweep_orphaned_files(live_session_ids: set[str], max_age_seconds: float):
+    """Deletes uploads and clip directories in TEMP_DIR that no live session owns (e.g. left over from a restart).
+
+    Decoded PCM and peaks files are named by content hash, not session, so they go once
+    unused for `max_age_seconds` (the audio cache touches them on every use).
+    `live_session_ids` must hold every worker's sessions: with in-memory
+    sessions and several workers, each would delete the others' uploads, so
+    the sweeper doesn't call this then (see ORPHAN_SWEEP_ENABLED).
+    """
+    cutoff = time.time() - max_age_seconds
+    candidates = list(TEMP_DIR.iterdir()) + (list(clip_store.root.iterdir()) if clip_store.root.exists() else [])
+    for path in candidates:
+        if path == clip_store.root:
+            continue
+        session_id = path.name.split(".", 1)[0]
+        try:
+            if session_id in live_session_ids or path.stat().st_mtime > cutoff:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink()
+            logging.info(f"Removed orphaned temp file: {path}")
+        except FileNotFoundError:
+            pass  # Another worker got there first
+        except Exception as e:
+            logging.error(f"Error removing orphaned temp file {path}: {e}")
+
+
+# The orphan sweep needs to see every live session; in-memory stores only know their own worker's
+ORPHAN_SWEEP_ENABLED = SESSION_STORE != "memory" or WEB_CONCURRENCY == 1
+
+
+async def session_sweeper():
+    if not ORPHAN_SWEEP_ENABLED:
+        logging.warning("In-memory sessions with several workers: orphaned temp files won't be swept. "
+                        "Use SESSION_STORE=sqlite for multi-worker deployments.")
+    while True:
+        try:
+            dropped = session_store.sweep()
+            if dropped:
+                logging.info(f"Session sweep removed {dropped} expired sessions ({len(session_store)} active).")
+            if ORPHAN_SWEEP_ENABLED:
+                await asyncio.to_thread(sweep_orphaned_files, session_store.session_ids(), SESSION_TTL_SECONDS)
+        except Exception as e:
+            logging.error(f"Session sweep failed: {e}", exc_info=True)
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_SECONDS)
+
+
+# Sessions: { session_id: {"audio_path": str, "audio_format": str, "audio_sha256": str, "transcript": Transcript,
+#                            "target_words": int, "segmentation": str, "created_at": float} }
+# In-memory by default; SESSION_STORE=sqlite shares sessions between uvicorn workers.
+session_store = create_session_store(on_evict=cleanup_session)
+
+# --- Metrics (gauges are read at scrape time) ---
+REGISTRY.gauge("editor_audio_cache_bytes", "Decoded PCM files kept by the audio cache.", lambda: audio_cache.current_bytes)
+REGISTRY.gauge("editor_active_sessions", "Sessions held by this worker's session store.", lambda: len(session_store))
+REGISTRY.gauge("editor_active_jobs", "Background GPT jobs still running.",
+               lambda: sum(1 for job in jobs.values() if not job.finished))
 
 # --- FastAPI App ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(session_sweeper())
+    yield
+    sweeper.cancel()
+    shutdown_process_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # --- CORS Middleware (Allow Frontend Requests) ---
 # Adjust origins as needed for deployment
@@ -57,7 +202,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],  # Read by the frontend when audio workers are busy
 )
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(AudioBusyError)
+async def audio_busy_handler(request: Request, exc: AudioBusyError):
+    # Backpressure from the audio scheduler: the client should come back later, not fail
+    logging.info(f"Audio workers busy, rejecting {request.method} {request.url.path} (retry in {exc.retry_after}s)")
+    return JSONResponse(status_code=503, content={"detail": "Audio processing is busy, please retry."},
+                        headers={"Retry-After": str(exc.retry_after)})
 
 # --- Helper: Cleanup Task ---
 def remove_temp_file(file_path: Path):
@@ -68,234 +223,718 @@ def remove_temp_file(file_path: Path):
     except Exception as e:
         logging.error(f"Error removing temp file {file_path}: {e}")
 
-# --- API Endpoints ---
-
-@app.post("/api/process")
-async def process_files(
-    request: Request,
-    background_tasks: BackgroundTasks,
-    transcript_file: UploadFile = File(...),
-    audio_file: UploadFile = File(...),
-    target_words: int = Form(DEFAULT_TARGET_WORD_COUNT),
-    fix_typos: bool = Form(False),
-    translate_norwegian: bool = Form(False)
-):
-    logging.info(f"--- ENTERING /api/process ---")
-    logging.info(f"Request Headers: {dict(request.headers)}")
-    session_id = str(uuid.uuid4())
-    logging.info(f"Processing request for session {session_id}")
-    audio_path = None # Define audio_path before try block
-
+# --- Helper: Streaming Upload Ingestion (shared by /api/process and /api/jobs) ---
+async def save_audio_upload(audio_file: FormPart, session_id: str, declared_format: str | None):
+    """Streams the audio upload to TEMP_DIR in chunks, hashing as it goes.
+
+    Rejects unrecognised content from its first bytes and aborts once
+    MAX_AUDIO_UPLOAD_BYTES is exceeded. Returns (audio_path, audio_format, sha256_hex).
+    """
+    first_chunk = await audio_file.read(64)  # Enough to sniff, so bad content is refused before more is received
+    sniffed_format = sniff_audio_format(first_chunk)
+    if not sniffed_format:
+        raise HTTPException(status_code=415, detail="Unsupported or unrecognised audio file.")
+    audio_format = declared_format or sniffed_format
+    if declared_format and declared_format != sniffed_format:
+        logging.warning(f"Audio declared as {declared_format} but looks like {sniffed_format}; using {sniffed_format}.")
+        audio_format = sniffed_format
+
+    audio_path = TEMP_DIR / f"{session_id}.{audio_format}"
+    digest = hashlib.sha256()
+    size = 0
     try:
-        # 1. Read Transcript
-        transcript_content = await transcript_file.read()
-        transcript_text = transcript_content.decode("utf-8")
-        logging.info(f"Read transcript file: {transcript_file.filename}")
-
-        # 2. Save Audio Temporarily
-        audio_format = get_audio_format_from_upload(audio_file)
-        if not audio_format:
-            raise HTTPException(status_code=400, detail="Could not determine audio format.")
-
-        audio_filename = f"{session_id}.{audio_format}"
-        audio_path = TEMP_DIR / audio_filename
         async with aiofiles.open(audio_path, 'wb') as out_file:
-            content = await audio_file.read()
-            await out_file.write(content)
-        logging.info(f"Saved temporary audio: {audio_path}")
-
-        # 3. Parse Transcript
-        blocks = parse_timestamped_transcript(transcript_text)
-        if not blocks:
+            chunk = first_chunk
+            while chunk:
+                size += len(chunk)
+                if size > MAX_AUDIO_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Audio file exceeds the {MAX_AUDIO_UPLOAD_BYTES} byte upload limit.")
+                digest.update(chunk)
+                await out_file.write(chunk)
+                chunk = await audio_file.read(UPLOAD_CHUNK_BYTES)
+    except BaseException:
+        remove_temp_file(audio_path)
+        raise
+    logging.info(f"Saved temporary audio: {audio_path} ({size} bytes)")
+    return audio_path, audio_format, digest.hexdigest()
+
+
+async def parse_transcript_upload(transcript_file: FormPart) -> Transcript:
+    """Decodes the transcript upload chunk by chunk and feeds it to the parser incrementally."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = TranscriptStreamParser()
+    blocks = TranscriptBuilder()
+    size = 0
+    with STAGE_SECONDS.time(stage="parse"):
+        try:
+            while chunk := await transcript_file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > MAX_TRANSCRIPT_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Transcript file exceeds the {MAX_TRANSCRIPT_UPLOAD_BYTES} byte upload limit.")
+                blocks.extend(parser.feed(decoder.decode(chunk)))
+            blocks.extend(parser.feed(decoder.decode(b"", final=True)))
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="Transcript file must be UTF-8 text.")
+        blocks.extend(parser.close())
+    logging.info(f"Read transcript file: {transcript_file.filename} ({len(blocks)} non-empty blocks)")
+    return blocks.build()
+
+
+def check_segmentation(segmentation: str):
+    if segmentation not in SEGMENTATION_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Unknown segmentation '{segmentation}' "
+                                                    f"(expected one of: {', '.join(SEGMENTATION_STRATEGIES)}).")
+
+
+async def load_silences(session_id: str, audio_path: str, audio_format: str | None):
+    """Silence runs for pause-aware grouping; None (timestamps and punctuation only) if the scan fails."""
+    try:
+        return await silence_store.get(session_id, audio_path, audio_format)
+    except Exception as e:
+        logging.warning(f"[{session_id}] Silence scan failed, grouping without it: {e}")
+        return None
+
+
+class UploadForm(BaseModel):
+    """The non-file fields of an /api/process or /api/jobs upload."""
+    target_words: int = Field(DEFAULT_TARGET_WORD_COUNT, gt=0)
+    fix_typos: bool = False
+    translate_norwegian: bool = False
+    segmentation: str = DEFAULT_SEGMENTATION
+    audio_pauses: bool = False
+    playback: Literal["clips", "stream"] = "clips"  # How the client plays segments: per-segment clips or the session stream
+
+
+# Documents the body the upload endpoints parse themselves (FastAPI only sees a Request)
+UPLOAD_FORM_OPENAPI = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "required": ["transcript_file", "audio_file"],
+    "properties": {
+        "transcript_file": {"type": "string", "format": "binary"},
+        "audio_file": {"type": "string", "format": "binary"},
+        **UploadForm.model_json_schema()["properties"],
+    },
+}}}}}
+
+
+async def receive_upload(request: Request, session_id: str):
+    """Reads the multipart body straight from the request stream, part by part.
+
+    The audio part goes to disk as it arrives (so the 415 and 413 checks fire
+    early) and the transcript part into the parser; nothing is spooled first.
+    Returns (audio_path, audio_format, audio_sha256, transcript, form); the
+    audio file is deleted again if the body turns out to be invalid.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and \
+            int(content_length) > MAX_AUDIO_UPLOAD_BYTES + MAX_TRANSCRIPT_UPLOAD_BYTES + UPLOAD_CHUNK_BYTES:
+        raise HTTPException(status_code=413, detail="Upload exceeds the audio and transcript size limits.")
+    audio = transcript = None
+    fields: dict[str, str] = {}
+    try:
+        async for part in MultipartStream(request).parts():
+            if part.name == "audio_file" and audio is None:
+                audio = await save_audio_upload(part, session_id, get_audio_format_from_upload(part))
+            elif part.name == "transcript_file" and transcript is None:
+                transcript = await parse_transcript_upload(part)
+            elif part.filename is None:
+                value = await part.read(MAX_FORM_FIELD_BYTES + 1)
+                if len(value) > MAX_FORM_FIELD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Form field '{part.name}' is too large.")
+                fields[part.name] = value.decode("utf-8", "replace")
+            # Any other file part is skipped unread
+        if audio is None or transcript is None:
+            raise HTTPException(status_code=422, detail="Both transcript_file and audio_file are required.")
+        try:
+            form = UploadForm.model_validate(fields)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors(include_url=False))
+        return *audio, transcript, form
+    except MultipartError as e:
+        if audio:
+            remove_temp_file(audio[0])
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        if audio:
+            remove_temp_file(audio[0])
+        raise
+
+
+async def ingest_upload(session_id: str, request: Request):
+    """Saves the audio, parses and groups the transcript.
+
+    Returns (audio_path, audio_format, audio_sha256, transcript, form).
+    """
+    audio_path = None # Define audio_path before try block
+    try:
+        # 1-3. Stream Audio to Disk (format check, size limit, hash) and Parse the Transcript
+        audio_path, audio_format, audio_sha256, transcript, form = await receive_upload(request, session_id)
+        check_segmentation(form.segmentation)
+        if audio_cache.has(audio_sha256):
+            logging.info(f"[{session_id}] Duplicate audio upload ({audio_sha256[:12]}), reusing decoded audio.")
+        if not transcript.block_count:
             raise HTTPException(status_code=400, detail="No valid transcript blocks found.")
 
-        # 4. Group Blocks
-        grouped_segments = group_blocks_by_word_count(blocks, target_count=target_words)
-        if not grouped_segments:
+        # 4. Group Blocks (the silence scan only runs for pause-aware strategies that ask for it)
+        silences = None
+        if form.audio_pauses and uses_silences(form.segmentation):
+            silences = await load_silences(session_id, str(audio_path), audio_format)
+        with STAGE_SECONDS.time(stage="group"):
+            transcript.group(form.target_words, form.segmentation, silences)
+        if not len(transcript):
             raise HTTPException(status_code=400, detail="Failed to group transcript blocks.")
 
-        # 5a. Optional: Fix Typos with GPT
-        gpt_editor_status = "None"
-        if fix_typos:
-            gpt_editor_status = "GPT-4o (Per Segment)"
-            logging.info(f"[{session_id}] Starting GPT correction for {len(grouped_segments)} segments.")
-            for i, seg in enumerate(grouped_segments):
-                corrected_text, gpt_error = fix_segment_with_gpt(seg['text'])
-                seg['text'] = corrected_text
-                seg['gpt_error'] = gpt_error
-                if gpt_error:
-                    logging.warning(f"[{session_id}] GPT error on seg {i}: {gpt_error}")
-            logging.info(f"[{session_id}] GPT correction finished.")
+        return audio_path, audio_format, audio_sha256, transcript, form
+
+    except RequestValidationError:
+        raise # receive_upload already removed the audio; FastAPI answers 422
+    except HTTPException as e:
+         # If an error occurred after saving audio, attempt cleanup
+        if audio_path and audio_path.exists():
+            remove_temp_file(audio_path) # Clean up immediately on error
+        logging.error(f"HTTPException during processing: {e.detail}")
+        raise e # Re-raise the exception
+    except Exception as e:
+        if audio_path and audio_path.exists():
+            remove_temp_file(audio_path) # Clean up immediately on error
+        logging.error(f"Unexpected error during processing: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+
+def audio_cache_key(session_id: str, session: dict) -> str:
+    # Keyed by content hash, so re-uploads of the same recording share one decode
+    return session.get("audio_sha256") or session_id
+
+
+def session_pcm_loader(session_id: str, session: dict, background: bool = False):
+    """Async callable returning the session's decoded PCM file, decoded once per recording."""
+    return lambda: audio_cache.get(audio_cache_key(session_id, session), session_id, session["audio_path"],
+                                   session.get("audio_format"), background=background)
+
+
+def schedule_audio_rendering(session_id: str, session: dict, segment_ranges: list[tuple[int, int]] | None = None):
+    """Starts background rendering of a stored session's playback audio.
+
+    Clip sessions get their segment clips (all of them by default); stream
+    sessions get the session stream, which regrouping doesn't change.
+    """
+    if not PRERENDER_CLIPS:
+        return
+    if session.get("playback", "clips") == "stream":
+        if segment_ranges is None:
+            session_streams.schedule(session_id, session_pcm_loader(session_id, session, background=True))
+        return
+    if segment_ranges is None:
+        segment_ranges = session["transcript"].segment_ranges()
+    clip_store.schedule_session(session_id, segment_ranges, session_pcm_loader(session_id, session, background=True))
+
+
+def get_gpt_editor_status(fix_typos: bool, translate_norwegian: bool) -> str:
+    gpt_editor_status = "None"
+    if fix_typos:
+        gpt_editor_status = "GPT-4o (Per Segment)"
+    if translate_norwegian:
+        if gpt_editor_status == "None": # Update editor status if not already set
+            gpt_editor_status = "GPT-4o (Translation)"
         else:
-             for seg in grouped_segments: seg['gpt_error'] = None
+            gpt_editor_status += " + Translation" # Append if typos were also fixed
+    return gpt_editor_status
 
-        # 5b. Optional: Translate to Norwegian with GPT
-        if translate_norwegian:
-            if gpt_editor_status == "None": # Update editor status if not already set
-                gpt_editor_status = "GPT-4o (Translation)"
-            else:
-                gpt_editor_status += " + Translation" # Append if typos were also fixed
-
-            logging.info(f"[{session_id}] Starting Norwegian translation for {len(grouped_segments)} segments.")
-            for i, seg in enumerate(grouped_segments):
-                # Translate the current text (which might have been typo-corrected)
-                translated_text, translate_error = translate_segment_to_norwegian_with_gpt(seg['text'])
-                seg['text'] = translated_text  # Update text with translated version
-                
-                # Append translation error to existing gpt_error, or create if None
-                if translate_error:
-                    current_error = seg.get('gpt_error')
-                    new_error_msg = f"TranslateError: {translate_error}"
-                    if current_error:
-                        seg['gpt_error'] = f"{current_error}; {new_error_msg}"
-                    else:
-                        seg['gpt_error'] = new_error_msg
-                    logging.warning(f"[{session_id}] Translation error on seg {i}: {translate_error}")
-            logging.info(f"[{session_id}] Norwegian translation finished.")
-
-        # 6. Store Session Data (In-Memory)
-        session_data[session_id] = {
+def get_editable_session(session_id: str) -> tuple[dict, int]:
+    """Looks up a session (and its store version) for an edit request; edits wait until its background job is done."""
+    entry = session_store.get_with_version(session_id)
+    if not entry or not entry[0].get("transcript"):
+        raise HTTPException(status_code=404, detail="Session not found.")
+    job = jobs.get(session_id)
+    if job is not None:
+        processing = not job.finished
+    else:  # The job may be running in another uvicorn worker
+        processing = job_store is not None and job_store.is_running(session_id)
+    if processing:
+        raise HTTPException(status_code=409, detail="Session is still being processed.")
+    return entry
+
+
+@asynccontextmanager
+async def edit_session(session_id: str):
+    """Holds the session's edit lock from load until the edited session is saved.
+
+    Edits keep index-based views of the transcript across GPT awaits, so a
+    second edit of the same session waits for the first one. Saves are
+    compare-and-swap against the loaded version, so an edit through another
+    uvicorn worker in the meantime turns this one into a 409 instead of
+    being overwritten.
+
+    The body edits a copy (stores may hand out the live session), which
+    replaces the stored session only once the body succeeds; if it raises,
+    readers never see a partial edit.
+    """
+    limit = session_locks.get(session_id)
+    if limit is None:
+        limit = session_locks[session_id] = [asyncio.Lock(), 0]
+    limit[1] += 1
+    try:
+        async with limit[0]:
+            stored, version = get_editable_session(session_id)
+            session = {**stored, "transcript": stored["transcript"].snapshot()}
+            yield session
+            try:
+                session_store.save(session_id, session, expected_version=version)
+            except SessionConflictError:
+                raise HTTPException(status_code=409, detail="Session was changed by another request; reload it.")
+    finally:
+        limit[1] -= 1
+        if not limit[1]:
+            session_locks.pop(session_id, None)
+
+
+# --- Request Bodies (segment editing) ---
+class SegmentTextUpdate(BaseModel):
+    text: str
+
+
+class SegmentRerunRequest(BaseModel):
+    indices: list[int]
+    fix_typos: bool = False
+    translate_norwegian: bool = False
+    from_original: bool = True  # Start again from the transcript text rather than the current edit
+
+
+class RegroupRequest(BaseModel):
+    target_words: int = Field(gt=0)
+    segmentation: str | None = None  # Defaults to the session's current strategy
+    audio_pauses: bool = False  # Let pause-aware strategies use the scanned silences
+    fix_typos: bool = False  # Run the GPT stages on segments that changed
+    translate_norwegian: bool = False
+
+def audio_file_response(request: Request, path: Path, content_type: str) -> Response:
+    """Serves an encoded audio file with Range support (FileResponse) and ETag revalidation."""
+    stat_result = path.stat()
+    etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    # Revalidate every time: a regroup can point the same segment index at a different clip
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=content_type, headers=headers, stat_result=stat_result)
+
+
+def get_session_with_audio(session_id: str) -> dict:
+    session = session_store.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found.")
+    audio_path = session.get("audio_path")
+    if not audio_path or not Path(audio_path).exists():
+        raise HTTPException(status_code=404, detail="Audio file not found for this session.")
+    return session
+
+# --- API Endpoints ---
+
+@app.post("/api/process", openapi_extra=UPLOAD_FORM_OPENAPI)
+async def process_files(request: Request):
+    session_id = str(uuid.uuid4())
+    logging.info(f"Processing request for session {session_id}")
+
+    # 1-4. Save audio, parse and group transcript
+    audio_path, audio_format, audio_sha256, transcript, form = await ingest_upload(session_id, request)
+    target_words, segmentation = form.target_words, form.segmentation
+    fix_typos, translate_norwegian = form.fix_typos, form.translate_norwegian
+
+    try:
+        # 5. Optional: Fix Typos and/or Translate to Norwegian with GPT
+        # Segments run concurrently; each one's translation starts as soon as its correction is done.
+        gpt_editor_status = get_gpt_editor_status(fix_typos, translate_norwegian)
+        cache_stats = CacheStats()
+        if fix_typos or translate_norwegian:
+            logging.info(f"[{session_id}] Starting GPT processing for {len(transcript)} segments "
+                         f"(fix_typos={fix_typos}, translate_norwegian={translate_norwegian}).")
+            await gpt_engine.process_segments(transcript, fix_typos, translate_norwegian,
+                                              session_id=session_id, cache_stats=cache_stats)
+            logging.info(f"[{session_id}] GPT processing finished (cache: {cache_stats.hits} hits, {cache_stats.misses} misses).")
+
+        # 6. Store Session Data
+        session = {
             "audio_path": str(audio_path),
             "audio_format": audio_format,
-            "segments": grouped_segments
+            "audio_sha256": audio_sha256,
+            "transcript": transcript,
+            "target_words": target_words,
+            "segmentation": segmentation,
+            "playback": form.playback,
+            "created_at": time.time()
         }
+        session_store.save(session_id, session)
         logging.info(f"Stored data for session {session_id}")
+        schedule_audio_rendering(session_id, session)
+        peaks_store.schedule(audio_cache_key(session_id, session), session_id,
+                             session_pcm_loader(session_id, session, background=True))
 
         # 7. Return Session ID and Initial Segments
         return JSONResponse(content={
             "session_id": session_id,
-            "segments": grouped_segments, # Send initial data to frontend
+            "segments": transcript.to_dicts(), # Send initial data to frontend
             "editor_status": gpt_editor_status,
-            "target_words": target_words
+            "target_words": target_words,
+            "segmentation": segmentation,
+            "audio_sha256": audio_sha256,
+            "gpt_cache": cache_stats.as_dict()
         })
 
-    except HTTPException as e:
-         # If an error occurred after saving audio, attempt cleanup
-        if audio_path and audio_path.exists():
-            remove_temp_file(audio_path) # Clean up immediately on error
-        logging.error(f"HTTPException during processing: {e.detail}")
-        raise e # Re-raise the exception
     except Exception as e:
-        if audio_path and audio_path.exists():
-            remove_temp_file(audio_path) # Clean up immediately on error
+        remove_temp_file(audio_path) # Clean up immediately on error
         logging.error(f"Unexpected error during processing: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
 
+@app.post("/api/jobs", openapi_extra=UPLOAD_FORM_OPENAPI)
+async def start_processing_job(request: Request):
+    """Job variant of /api/process: returns as soon as the transcript is grouped.
+
+    GPT stages run in the background; finished segments are streamed from
+    /api/jobs/{session_id}/events. Segment text and audio are usable right away.
+    """
+    session_id = str(uuid.uuid4())
+    logging.info(f"Starting processing job for session {session_id}")
+
+    audio_path, audio_format, audio_sha256, transcript, form = await ingest_upload(session_id, request)
+    target_words, segmentation = form.target_words, form.segmentation
+    fix_typos, translate_norwegian = form.fix_typos, form.translate_norwegian
+    gpt_editor_status = get_gpt_editor_status(fix_typos, translate_norwegian)
+
+    # Store the session before GPT runs so /api/audio works immediately;
+    # the engine updates this same Transcript in place.
+    session = {
+        "audio_path": str(audio_path),
+        "audio_format": audio_format,
+        "audio_sha256": audio_sha256,
+        "transcript": transcript,
+        "target_words": target_words,
+        "segmentation": segmentation,
+        "playback": form.playback,
+        "created_at": time.time()
+    }
+    session_store.save(session_id, session)
+    schedule_audio_rendering(session_id, session)
+    peaks_store.schedule(audio_cache_key(session_id, session), session_id,
+                         session_pcm_loader(session_id, session, background=True))
+    # Persist the GPT results once the job is done (needed when the store holds copies)
+    job = ProcessingJob(session_id, transcript, gpt_editor_status,
+                        on_finish=lambda: session_store.save(session_id, session), job_store=job_store)
+    jobs[session_id] = job
+    job.start(gpt_engine, fix_typos, translate_norwegian)
+
+    return JSONResponse(content={
+        "session_id": session_id,
+        "segments": transcript.to_dicts(), # Pre-GPT text; edited versions arrive on the event stream
+        "editor_status": gpt_editor_status,
+        "target_words": target_words,
+        "segmentation": segmentation,
+        "audio_sha256": audio_sha256,
+        "status": job.status,
+        "events_url": f"/api/jobs/{session_id}/events"
+    })
+
+
+@app.get("/api/jobs/{session_id}")
+async def get_job_status(session_id: str):
+    job = jobs.get(session_id)
+    if job:
+        return job.snapshot()
+    # Started by another uvicorn worker
+    snapshot = job_store.snapshot(session_id) if job_store is not None else None
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return snapshot
+
+
+@app.get("/api/jobs/{session_id}/events")
+async def stream_job_events(session_id: str):
+    """Streams NDJSON: one {"type": "segment"} line per finished segment, then {"type": "done"}.
+
+    Segments finished before the client connected are replayed first. Jobs
+    running in another uvicorn worker are followed through the shared job store.
+    """
+    job = jobs.get(session_id)
+    if job:
+        async def event_lines():
+            async for index in job.iter_completed():
+                yield json.dumps({"type": "segment", "index": index, "segment": job.segments[index].to_dict()}) + "\n"
+            yield json.dumps({"type": "done", **job.snapshot()}) + "\n"
+    elif job_store is not None and job_store.snapshot(session_id) is not None:
+        async def event_lines():
+            async for index, segment in job_store.iter_events(session_id):
+                yield json.dumps({"type": "segment", "index": index, "segment": segment}) + "\n"
+            yield json.dumps({"type": "done", **(job_store.snapshot(session_id) or {"session_id": session_id})}) + "\n"
+    else:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    return StreamingResponse(event_lines(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.patch("/api/sessions/{session_id}/segments/{segment_index}")
+async def update_segment_text(session_id: str, segment_index: int, update: SegmentTextUpdate):
+    """Replaces one segment's text (e.g. a manual edit); nothing else is recomputed."""
+    async with edit_session(session_id) as session:
+        transcript = session["transcript"]
+        if segment_index < 0 or segment_index >= len(transcript):
+            raise HTTPException(status_code=404, detail="Segment index out of bounds.")
+        segment = transcript[segment_index]
+        segment.text = update.text
+        segment.gpt_error = None
+    return {"index": segment_index, "segment": segment.to_dict()}
+
+
+@app.post("/api/sessions/{session_id}/segments/rerun")
+async def rerun_segments(session_id: str, rerun: SegmentRerunRequest):
+    """Re-runs correction and/or translation for the chosen segments only."""
+    if not (rerun.fix_typos or rerun.translate_norwegian):
+        raise HTTPException(status_code=400, detail="Nothing to run: enable fix_typos and/or translate_norwegian.")
+    async with edit_session(session_id) as session:
+        transcript = session["transcript"]
+        indices = sorted(set(rerun.indices))
+        if not indices or indices[0] < 0 or indices[-1] >= len(transcript):
+            raise HTTPException(status_code=400, detail="Segment indices missing or out of bounds.")
+
+        segments = [transcript[i] for i in indices]
+        if rerun.from_original:
+            for segment in segments:
+                segment.text = segment.original_text
+                segment.gpt_error = None
+        logging.info(f"[{session_id}] Re-running GPT for {len(segments)} segments "
+                     f"(fix_typos={rerun.fix_typos}, translate_norwegian={rerun.translate_norwegian}).")
+        cache_stats = await gpt_engine.process_segments(segments, rerun.fix_typos, rerun.translate_norwegian,
+                                                        session_id=session_id)
+    return {
+        "session_id": session_id,
+        "updated": [{"index": segment.index, "segment": segment.to_dict()} for segment in segments],
+        "editor_status": get_gpt_editor_status(rerun.fix_typos, rerun.translate_norwegian),
+        "gpt_cache": cache_stats.as_dict()
+    }
+
+
+@app.post("/api/sessions/{session_id}/regroup")
+async def regroup_segments(session_id: str, regroup: RegroupRequest):
+    """Regroups the session's stored blocks with a new target word count and/or segmentation strategy.
+
+    Segments covering exactly the same blocks as before keep their text, GPT
+    results and audio clip; only the changed ones are (optionally) sent to GPT
+    and re-rendered, and clips no segment uses any more are deleted.
+    """
+    async with edit_session(session_id) as session:
+        transcript = session["transcript"]
+        segmentation = regroup.segmentation or session.get("segmentation", DEFAULT_SEGMENTATION)
+        check_segmentation(segmentation)
+        silences = None
+        if regroup.audio_pauses and uses_silences(segmentation):
+            audio_path = session.get("audio_path")
+            if audio_path and Path(audio_path).exists():
+                silences = await load_silences(session_id, audio_path, session.get("audio_format"))
+        old_ranges = set(transcript.segment_ranges())
+        with STAGE_SECONDS.time(stage="group"):
+            changed = transcript.regroup(regroup.target_words, segmentation, silences)
+        new_ranges = transcript.segment_ranges()
+        stale_ranges = list(old_ranges.difference(new_ranges))
+        logging.info(f"[{session_id}] Regrouped to ~{regroup.target_words} words ({segmentation}): "
+                     f"{len(new_ranges)} segments, {len(changed)} changed, {len(stale_ranges)} stale clips.")
+
+        cache_stats = CacheStats()
+        if changed and (regroup.fix_typos or regroup.translate_norwegian):
+            await gpt_engine.process_segments([transcript[i] for i in changed], regroup.fix_typos,
+                                              regroup.translate_norwegian, session_id=session_id,
+                                              cache_stats=cache_stats)
+        session["target_words"] = regroup.target_words
+        session["segmentation"] = segmentation
+
+    if stale_ranges:
+        asyncio.get_running_loop().run_in_executor(None, clip_store.remove_clips, session_id, stale_ranges)
+    if changed:
+        schedule_audio_rendering(session_id, session, [new_ranges[i] for i in changed])
+    return {
+        "session_id": session_id,
+        "segments": transcript.to_dicts(),
+        "target_words": regroup.target_words,
+        "segmentation": segmentation,
+        "changed": changed,
+        "gpt_cache": cache_stats.as_dict()
+    }
+
+
+@app.get("/api/peaks/{session_id}/{segment_index}")
+async def get_segment_peaks(session_id: str, segment_index: int, max_peaks: int = Query(800, ge=1, le=10000)):
+    """Waveform min/max peaks for one segment, at the coarsest resolution giving at least `max_peaks` of them."""
+    session = session_store.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found.")
+    audio_path = session.get("audio_path")
+    transcript = session.get("transcript")
+    if not audio_path or not Path(audio_path).exists():
+        raise HTTPException(status_code=404, detail="Audio file not found for this session.")
+    if not transcript or segment_index < 0 or segment_index >= len(transcript):
+        raise HTTPException(status_code=404, detail="Segment index out of bounds.")
+
+    segment = transcript[segment_index]
+    try:
+        return await peaks_store.read(audio_cache_key(session_id, session), session_id,
+                                      session_pcm_loader(session_id, session),
+                                      segment.start_ms, segment.end_ms, max_peaks)
+    except AudioBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Peaks lookup failed for seg {segment_index}, session {session_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to compute waveform peaks.")
+
+
+@app.get("/api/sessions/{session_id}/audio")
+async def get_session_stream(request: Request, session_id: str):
+    """The whole session as one encoded file; clients seek into it with HTTP Range."""
+    session = get_session_with_audio(session_id)
+    try:
+        stream_path, content_type = await session_streams.ensure_stream(
+            session_id, session_pcm_loader(session_id, session))
+    except AudioBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Session stream encode failed for {session_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to encode session audio.")
+    return audio_file_response(request, stream_path, content_type)
+
+
+@app.get("/api/sessions/{session_id}/audio/manifest")
+async def get_session_stream_manifest(session_id: str):
+    """Time and byte offsets of every segment inside the session stream.
+
+    `byte_start`/`byte_end` are inclusive Range bounds; bytes before
+    `header_end` hold the container header (WAV) or encoder info (MP3).
+    """
+    session = get_session_with_audio(session_id)
+    transcript = session.get("transcript")
+    if not transcript:
+        raise HTTPException(status_code=404, detail="Session has no segments.")
+    try:
+        index = await session_streams.get_index(session_id, session_pcm_loader(session_id, session))
+    except AudioBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Session stream encode failed for {session_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to encode session audio.")
+    return {
+        "session_id": session_id,
+        "url": f"/api/sessions/{session_id}/audio",
+        "content_type": index.content_type,
+        "size": index.size,
+        "duration_ms": index.duration_ms,
+        "header_end": index.header_end,
+        "segments": [index.segment_entry(i, start_ms, end_ms)
+                     for i, (start_ms, end_ms) in enumerate(transcript.segment_ranges())],
+    }
+
+
 @app.get("/api/audio/{session_id}/{segment_index}")
 async def get_segment_audio(request: Request, session_id: str, segment_index: int):
-    logging.info(f"Request for audio: session={session_id}, segment={segment_index}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Request for audio: session={session_id}, segment={segment_index}")
     # 1. Retrieve Session Data
-    session = session_data.get(session_id)
+    session = session_store.get(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found.")
 
     audio_path = session.get("audio_path")
     audio_format = session.get("audio_format")
-    segments = session.get("segments")
+    transcript = session.get("transcript")
 
     if not audio_path or not Path(audio_path).exists():
         raise HTTPException(status_code=404, detail="Audio file not found for this session.")
-    if not segments or segment_index < 0 or segment_index >= len(segments):
+    if not transcript or segment_index < 0 or segment_index >= len(transcript):
         raise HTTPException(status_code=404, detail="Segment index out of bounds.")
 
-    # 2. Load Full Audio (Consider caching this if accessed frequently)
-    try:
-        full_audio = AudioSegment.from_file(audio_path, format=audio_format)
-    except Exception as e:
-        logging.error(f"Error loading audio file {audio_path}: {e}")
-        raise HTTPException(status_code=500, detail="Error loading audio.")
-
-    # 3. Get Segment Timestamps
-    segment_info = segments[segment_index]
-    start_ts = segment_info.get("start")
-    end_ts = segment_info.get("end")
-    if not start_ts or not end_ts:
-         raise HTTPException(status_code=404, detail="Segment timestamp data missing.")
-
-    # 4. Slice Audio
-    audio_clip = get_audio_segment(full_audio, start_ts, end_ts)
-    if audio_clip is None or len(audio_clip) == 0:
+    # 2. Get Segment Timestamps (integer ms, straight from the block columns)
+    segment = transcript[segment_index]
+    start_ms, end_ms = segment.start_ms, segment.end_ms
+
+    # 3. Use the pre-rendered clip, or decode (once per recording) and render it now
+    clip = clip_store.find_clip(session_id, start_ms, end_ms)
+    CLIP_LOOKUPS.inc(result="miss" if clip is None else "hit")
+    if clip is None:
+        try:
+            pcm_path = await audio_cache.get(audio_cache_key(session_id, session), session_id, audio_path, audio_format)
+        except AudioBusyError:
+            raise
+        except Exception as e:
+            logging.error(f"Error loading audio file {audio_path}: {e}")
+            raise HTTPException(status_code=500, detail="Error loading audio.")
+        try:
+            clip = await clip_store.ensure_clip(session_id, pcm_path, start_ms, end_ms)
+        except AudioBusyError:
+            raise
+        except Exception as e:
+            logging.error(f"Clip export failed for seg {segment_index}: {e}")
+            raise HTTPException(status_code=500, detail="Failed to export audio segment.")
+    if clip is None:
         # Return empty response or a specific status? Let's return 204 No Content
         logging.warning(f"Empty audio clip generated for seg {segment_index}, session {session_id}")
-        # Return an empty MP3 or WAV? Or just 204? Frontend needs to handle this.
-        # Returning empty content might be cleaner.
         return Response(status_code=204)
 
+    # 4. Serve the file; FileResponse handles Range requests and streams from disk
+    clip_path, content_type = clip
+    return audio_file_response(request, clip_path, content_type)
 
-    # 5. Export Slice to Bytes (Try MP3, fallback to WAV)
-    audio_bytes_io = BytesIO()
-    export_format = "mp3"
-    content_type = "audio/mpeg"
-    try:
-        audio_clip.export(audio_bytes_io, format=export_format)
-        logging.debug(f"Exported seg {segment_index} as MP3")
-    except Exception as export_mp3_err:
-        logging.warning(f"MP3 export failed for seg {segment_index} ({export_mp3_err}), trying WAV...")
-        export_format = "wav"
-        content_type = "audio/wav"
-        audio_bytes_io = BytesIO() # Reset buffer
-        try:
-            audio_clip.export(audio_bytes_io, format=export_format)
-            logging.debug(f"Exported seg {segment_index} as WAV")
-        except Exception as export_wav_err:
-            logging.error(f"WAV export failed for seg {segment_index}: {export_wav_err}")
-            raise HTTPException(status_code=500, detail="Failed to export audio segment.")
 
-    # 6. Handle Range Requests for Seeking
-    audio_bytes = audio_bytes_io.getvalue()
-    total_size = len(audio_bytes)
-    range_header = request.headers.get('range')
-    status_code = 200 # Default to OK
-    headers = {
-        'Content-Type': content_type,
-        'Accept-Ranges': 'bytes', # Signal that we accept range requests
-        'Content-Length': str(total_size)
-    }
-
-    start, end = 0, total_size - 1 # Default: serve the whole file
+@app.get("/api/sessions/{session_id}/export")
+async def export_session(
+    session_id: str,
+    export_format: str = Query("srt", alias="format"),
+    cues: str = Query("blocks"),
+    highlight: list[int] = Query([]),
+    audio: list[int] = Query([]),
+):
+    """Streams the session's current (edited) segments as SRT, WebVTT, plain text or JSON.
+
+    `cues=blocks` times subtitle cues on the original transcript blocks, `cues=segments`
+    emits one cue per segment. `highlight` marks segments in txt/json output. With
+    `audio`, the response is a zip that also holds those segments' audio, stitched
+    in order.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {export_format}")
+    if cues not in ("blocks", "segments"):
+        raise HTTPException(status_code=400, detail="cues must be 'blocks' or 'segments'.")
+    session = session_store.get(session_id)
+    if not session or not session.get("transcript"):
+        raise HTTPException(status_code=404, detail="Session not found.")
+    # Taken now, so a regroup or edit during a long download can't mix two versions
+    transcript = session["transcript"].snapshot()
+    audio_indices = sorted(set(audio))
+    if audio_indices and (audio_indices[0] < 0 or audio_indices[-1] >= len(transcript)):
+        raise HTTPException(status_code=400, detail="Audio segment indices out of bounds.")
+
+    extension, content_type = EXPORT_FORMATS[export_format]
+    base_name = f"transcript_{session_id[:8]}"
+    chunks = iter_export(transcript, export_format, session_id, set(highlight), by_blocks=cues == "blocks")
+    if not audio_indices:
+        return StreamingResponse(chunks, media_type=content_type, headers={
+            "Content-Disposition": f'attachment; filename="{base_name}.{extension}"'})
 
-    if range_header:
-        logging.debug(f"Range header detected: {range_header}")
-        try:
-            # Expected format: "bytes=start-end" or "bytes=start-"
-            range_value = range_header.strip().split('=')[1]
-            start_str, end_str = range_value.split('-')
-            start = int(start_str)
-            if end_str: # If end is specified
-                 end = int(end_str)
-            else: # If only start is specified ("bytes=100-")
-                end = total_size - 1
-            # Clamp values to valid range
-            start = max(0, start)
-            end = min(end, total_size - 1)
-
-            if start >= total_size or start > end:
-                # Requested range is invalid
-                logging.warning(f"Invalid range requested: {range_header}, size: {total_size}")
-                return Response(status_code=416) # Range Not Satisfiable
-
-            status_code = 206 # Partial Content
-            headers['Content-Range'] = f'bytes {start}-{end}/{total_size}'
-            headers['Content-Length'] = str(end - start + 1)
-            logging.debug(f"Serving range: bytes {start}-{end}/{total_size}")
-        except Exception as e:
-            logging.error(f"Error parsing Range header '{range_header}': {e}")
-            # Fallback to sending the whole file if parsing fails
-            status_code = 200
-            start, end = 0, total_size - 1
-            headers['Content-Length'] = str(total_size)
-            if 'Content-Range' in headers: del headers['Content-Range']
+    audio_path = session.get("audio_path")
+    if not audio_path or not Path(audio_path).exists():
+        raise HTTPException(status_code=404, detail="Audio file not found for this session.")
+    ranges = [(transcript[i].start_ms, transcript[i].end_ms) for i in audio_indices]
+    try:
+        stitched_path, _ = await export_audio.ensure(session_id, session_pcm_loader(session_id, session), ranges)
+    except AudioBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Export audio render failed for session {session_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to render export audio.")
+    return StreamingResponse(
+        iter_zip(f"{base_name}.{extension}", chunks, f"{base_name}{stitched_path.suffix}", stitched_path),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{base_name}.zip"'})
 
-    # Create a BytesIO object for the specific chunk
-    chunk_io = BytesIO(audio_bytes[start:end + 1])
 
-    return StreamingResponse(
-        chunk_io,
-        status_code=status_code,
-        headers=headers,
-        media_type=content_type # Redundant if Content-Type in headers, but safe
-    )
+@app.get("/metrics")
+def get_metrics():
+    """Counters and histograms of this worker process, in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
 
 
 # Add a simple root endpoint for testing
@@ -305,4 +944,6 @@ def read_root():
 
 # --- To Run (in backend/ directory) ---
 # uvicorn main:app --reload --port 5001
+# Several workers (uvicorn reads WEB_CONCURRENCY as its --workers default; the audio pool is sized from it too):
+# SESSION_STORE=sqlite WEB_CONCURRENCY=4 uvicorn main:app --port 5001
 # (Run on a different port than the frontend, e.g., 5001)
\ No newline at end of file
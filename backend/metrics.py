@@ -0,0 +1,211 @@
+# backend/metrics.py
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+
+# Seconds; covers sub-millisecond parsing up to multi-minute GPT runs
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+# --- Metric Types ---
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()  # Decode and cache lookups record from worker threads
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Current value, read from `callback` at scrape time (so nothing is updated on the hot path)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name} {_format_value(self.callback())}"]
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], list] = {}  # key -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the `with` block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, [list(series[0]), series[1], series[2]]) for key, series in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# --- Registry ---
+class Registry:
+    """Holds the process's metrics and renders them in the Prometheus text format.
+
+    Values are per process: with several uvicorn workers, each one is scraped
+    (or reports) separately.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, documentation, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Application Metrics ---
+STAGE_SECONDS = REGISTRY.histogram(
+    "editor_stage_seconds",
+    "Time per processing stage: parse, group, gpt and, including the wait for an audio worker, "
+    "decode, export, peaks, stream_encode, export_audio, silence_scan.",
+    ("stage",))
+GPT_REQUEST_SECONDS = REGISTRY.histogram(
+    "editor_gpt_request_seconds", "Latency of each OpenAI request attempt (excluding rate-limit waits).",
+    ("mode", "outcome"))
+GPT_TOKENS = REGISTRY.counter("editor_gpt_tokens_total", "Tokens reported by OpenAI, by kind.", ("kind",))
+GPT_RETRIES = REGISTRY.counter("editor_gpt_retries_total", "OpenAI requests retried, by error type.", ("error",))
+GPT_CACHE_LOOKUPS = REGISTRY.counter("editor_gpt_cache_lookups_total", "GPT reply cache lookups.", ("result",))
+AUDIO_CACHE_LOOKUPS = REGISTRY.counter(
+    "editor_audio_cache_lookups_total", "Decoded audio cache lookups (shared: joined an in-flight decode).",
+    ("result",))
+CLIP_LOOKUPS = REGISTRY.counter("editor_clip_lookups_total", "Segment audio requests, by whether the encoded clip already existed.",
+                                ("result",))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "editor_http_request_seconds", "HTTP request latency until the response starts, by route.",
+    ("method", "route", "status"))
+
+
+# --- HTTP Middleware ---
+class MetricsMiddleware:
+    """Pure ASGI middleware timing each request by its route template (not the raw path, which holds IDs)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # The router has filled in scope["route"] by the time a response starts
+                route = scope.get("route")
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"],
+                                             route=getattr(route, "path", "unmatched"), status=message["status"])
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,158 @@
+# backend/multipart_stream.py
+import logging
+from collections import deque
+from typing import AsyncIterator
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+
+class MultipartError(ValueError):
+    """The request body isn't well-formed multipart/form-data."""
+
+
+# --- Streaming multipart/form-data ---
+class FormPart:
+    """One part of a multipart body, read from the request as it is consumed.
+
+    Quacks like `UploadFile` for the upload helpers (`filename`,
+    `content_type`, `read(size)`), but nothing is spooled: bytes the caller
+    doesn't read are never kept.
+    """
+
+    def __init__(self, form: "MultipartStream", name: str, filename: str | None, content_type: str | None):
+        self._form = form
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self._buffer = b""
+        self._ended = False
+
+    async def read(self, size: int = -1) -> bytes:
+        """Returns up to `size` bytes (all remaining if negative); b"" once the part is exhausted."""
+        chunks, got = [], 0
+        if self._buffer:
+            chunks.append(self._buffer)
+            got = len(self._buffer)
+            self._buffer = b""
+        while not self._ended and (size < 0 or got < size):
+            data = await self._form._next_data()
+            if data is None:
+                self._ended = True
+                break
+            chunks.append(data)
+            got += len(data)
+        data = b"".join(chunks)
+        if 0 <= size < len(data):
+            data, self._buffer = data[:size], data[size:]
+        return data
+
+    async def drain(self):
+        self._buffer = b""
+        while not self._ended:
+            if await self._form._next_data() is None:
+                self._ended = True
+
+
+class MultipartStream:
+    """Parses a multipart/form-data request body incrementally from `request.stream()`.
+
+    Parts are handed out in body order by `parts()`. A part the caller
+    doesn't read to its end is skipped when the next one is requested.
+    """
+
+    def __init__(self, request):
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise MultipartError("Expected a multipart/form-data body.")
+        self._body = request.stream()
+        self._events: deque[tuple[str, object]] = deque()  # ("begin", headers) | ("data", bytes) | ("end", None)
+        self._header_field = self._header_value = b""
+        self._headers: dict[bytes, bytes] = {}
+        self._finished = False
+        self._current: FormPart | None = None
+        self._parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    # Parser callbacks (synchronous; they only queue events for the async readers)
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        self._events.append(("begin", self._headers))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        self._events.append(("data", data[start:end]))
+
+    def _on_part_end(self):
+        self._events.append(("end", None))
+
+    async def _next_event(self) -> tuple[str, object] | None:
+        while not self._events:
+            if self._finished:
+                return None
+            try:
+                chunk = await self._body.__anext__()
+            except StopAsyncIteration:
+                self._parser.finalize()
+                self._finished = True
+                continue
+            if chunk:
+                try:
+                    self._parser.write(chunk)
+                except Exception as e:
+                    raise MultipartError(f"Malformed multipart body: {e}") from e
+        return self._events.popleft()
+
+    async def _next_data(self) -> bytes | None:
+        # Next data of the current part; None at its end
+        event = await self._next_event()
+        if event is None:
+            raise MultipartError("Request body ended inside a form part.")
+        kind, value = event
+        if kind == "end":
+            self._current = None
+            return None
+        if kind != "data":
+            raise MultipartError("Unexpected form part boundary.")
+        return value
+
+    async def parts(self) -> AsyncIterator[FormPart]:
+        while True:
+            if self._current is not None:
+                await self._current.drain()  # The caller skipped the rest of the previous part
+            event = await self._next_event()
+            if event is None:
+                return
+            kind, headers = event
+            if kind != "begin":
+                continue
+            _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+            name = disposition.get(b"name", b"").decode("utf-8", "replace")
+            filename = disposition.get(b"filename")
+            content_type = headers.get(b"content-type")
+            self._current = FormPart(self, name, filename.decode("utf-8", "replace") if filename is not None else None,
+                                     content_type.decode("latin-1") if content_type else None)
+            yield self._current
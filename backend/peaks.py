@@ -0,0 +1,218 @@
+# backend/peaks.py
+import asyncio
+import audioop
+import logging
+import math
+import os
+import struct
+from array import array
+from pathlib import Path
+
+from audio_cache import PcmWavReader
+from workers import audio_scheduler, file_lock
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+PEAKS_BASE_MS = int(os.getenv("PEAKS_BASE_MS", "10"))  # Resolution of the finest level
+PEAKS_LEVEL_FACTOR = 4   # Each level merges this many peaks of the one below
+PEAKS_LEVELS = 5         # 10 ms, 40 ms, 160 ms, 640 ms and 2.56 s per peak by default
+PEAKS_READ_FRAMES = 65536
+
+# File layout: header, one peak count per level, then each level's peaks as
+# interleaved signed 8-bit (min, max) pairs, finest level first
+PEAKS_MAGIC = b"PEAK"
+PEAKS_VERSION = 1
+SAMPLE_TYPECODES = {1: "B", 2: "h", 4: "i"}
+HEADER = struct.Struct("<4sHHIII")  # magic, version, levels, frame_rate, frames_per_peak (finest), level_factor
+
+
+class PeakReducer:
+    """Reduces interleaved PCM fed in arbitrary frame-aligned chunks to 8-bit min/max peaks per bucket."""
+
+    def __init__(self, sample_width: int, channels: int, frames_per_peak: int, unsigned: bool = False):
+        self.sample_width = sample_width
+        self.channels = channels
+        self.unsigned = unsigned  # 8-bit WAV stores unsigned samples
+        self.bucket_bytes = frames_per_peak * sample_width
+        self.shift = 8 * (sample_width - 1)
+        self.mins = array("b")
+        self.maxs = array("b")
+        self._rest = b""
+
+    def feed(self, fragment: bytes):
+        width = self.sample_width
+        if self.unsigned:
+            fragment = audioop.bias(fragment, width, -128)
+        if self.channels == 2:
+            fragment = audioop.tomono(fragment, width, 0.5, 0.5)
+        if self.channels > 2:
+            fragment = self._first_channel(fragment)
+        data = self._rest + fragment if self._rest else fragment
+        bucket_bytes, shift = self.bucket_bytes, self.shift
+        usable = len(data) - len(data) % bucket_bytes
+        mins_append, maxs_append = self.mins.append, self.maxs.append
+        for offset in range(0, usable, bucket_bytes):
+            # audioop reduces each bucket in C; only the per-bucket bookkeeping is Python
+            low, high = audioop.minmax(data[offset:offset + bucket_bytes], width)
+            mins_append(low >> shift)
+            maxs_append(high >> shift)
+        self._rest = data[usable:]
+
+    def _first_channel(self, fragment: bytes) -> bytes:
+        # audioop only downmixes stereo; for more channels the first one stands in for the mix
+        width, channels = self.sample_width, self.channels
+        if width == 3:
+            frame = width * channels
+            return b"".join(fragment[i:i + 3] for i in range(0, len(fragment), frame))
+        return memoryview(fragment).cast(SAMPLE_TYPECODES[width])[::channels].tobytes()
+
+    def close(self) -> tuple[array, array]:
+        if self._rest:
+            low, high = audioop.minmax(self._rest, self.sample_width)
+            self.mins.append(low >> self.shift)
+            self.maxs.append(high >> self.shift)
+            self._rest = b""
+        return self.mins, self.maxs
+
+
+def _reduce_level(mins: array, maxs: array, factor: int) -> tuple[array, array]:
+    coarse_mins, coarse_maxs = array("b"), array("b")
+    for i in range(0, len(mins), factor):
+        coarse_mins.append(min(mins[i:i + factor]))
+        coarse_maxs.append(max(maxs[i:i + factor]))
+    return coarse_mins, coarse_maxs
+
+
+def _reduce_pcm_file(pcm_path: str) -> tuple[int, int, PeakReducer]:
+    # Streams the decoded frames, so memory stays flat regardless of the recording's length
+    with PcmWavReader(pcm_path) as wav:
+        channels, sample_width, frame_rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        frames_per_peak = max(1, round(frame_rate * PEAKS_BASE_MS / 1000))
+        reducer = PeakReducer(sample_width, channels, frames_per_peak, unsigned=sample_width == 1)
+        while fragment := wav.readframes(PEAKS_READ_FRAMES):
+            reducer.feed(fragment)
+    return frame_rate, frames_per_peak, reducer
+
+
+def build_peaks_file(pcm_path: str, out_path: str) -> str:
+    """Computes the multi-resolution peaks index from a decoded PCM WAV. Runs in a worker process."""
+    with file_lock(out_path):
+        if os.path.exists(out_path):
+            return out_path  # Built by another uvicorn worker while this one waited
+        frame_rate, frames_per_peak, reducer = _reduce_pcm_file(pcm_path)
+
+        levels = [reducer.close()]
+        while len(levels) < PEAKS_LEVELS and len(levels[-1][0]) > 1:
+            levels.append(_reduce_level(*levels[-1], PEAKS_LEVEL_FACTOR))
+
+        tmp_path = f"{out_path}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_path, "wb") as out:
+                out.write(HEADER.pack(PEAKS_MAGIC, PEAKS_VERSION, len(levels), frame_rate, frames_per_peak, PEAKS_LEVEL_FACTOR))
+                out.write(struct.pack(f"<{len(levels)}I", *(len(mins) for mins, _ in levels)))
+                for mins, maxs in levels:
+                    pairs = array("b", bytes(2 * len(mins)))
+                    pairs[0::2] = mins
+                    pairs[1::2] = maxs
+                    pairs.tofile(out)
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return out_path
+
+
+def read_peaks(peaks_path: str, start_ms: int, end_ms: int, max_peaks: int) -> dict:
+    """Reads the peaks covering start_ms..end_ms from the coarsest level that still gives `max_peaks` of them.
+
+    Only the requested slice is read from disk.
+    """
+    with open(peaks_path, "rb") as f:
+        magic, version, level_count, frame_rate, frames_per_peak, factor = HEADER.unpack(f.read(HEADER.size))
+        if magic != PEAKS_MAGIC or version != PEAKS_VERSION:
+            raise ValueError(f"Not a peaks file: {peaks_path}")
+        counts = struct.unpack(f"<{level_count}I", f.read(4 * level_count))
+        duration_ms = max(1, end_ms - start_ms)
+        level = 0
+        while level + 1 < level_count and duration_ms / (_ms_per_peak(frame_rate, frames_per_peak, factor, level + 1)) >= max_peaks:
+            level += 1
+        ms_per_peak = _ms_per_peak(frame_rate, frames_per_peak, factor, level)
+        first = min(counts[level], max(0, int(start_ms / ms_per_peak)))
+        stop = min(counts[level], max(first, math.ceil(end_ms / ms_per_peak)))
+        f.seek(HEADER.size + 4 * level_count + 2 * (sum(counts[:level]) + first))
+        pairs = array("b")
+        pairs.frombytes(f.read(2 * (stop - first)))
+    return {
+        "start_ms": start_ms,
+        "end_ms": end_ms,
+        "first_peak_ms": round(first * ms_per_peak, 3),
+        "ms_per_peak": round(ms_per_peak, 3),
+        "peaks": pairs.tolist(),  # Interleaved min, max in -128..127
+    }
+
+
+def _ms_per_peak(frame_rate: int, frames_per_peak: int, factor: int, level: int) -> float:
+    return frames_per_peak * factor ** level * 1000 / frame_rate
+
+
+# --- Peaks Files per Recording ---
+class PeaksStore:
+    """One peaks index per recording, stored as `<audio_sha256>.peaks` so re-uploads share it.
+
+    Built once in the process pool from the decoded PCM (in the background
+    after upload, or on the first request); concurrent requests wait for the
+    same build. Every use refreshes the file's mtime, and the orphan sweep
+    removes it once unused for the session TTL, like the decoded audio.
+    `load_pcm` is an async callable returning the decoded file, only awaited
+    when the index still has to be built.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._pending: dict[str, asyncio.Task] = {}
+        self._background: set[asyncio.Task] = set()
+
+    def peaks_path(self, key: str) -> Path:
+        return self.root / f"{key}.peaks"
+
+    async def ensure(self, key: str, session_id: str, load_pcm, background: bool = False) -> Path:
+        path = self.peaks_path(key)
+        try:
+            os.utime(path)  # Keeps it from the orphan sweep while in use
+            return path
+        except FileNotFoundError:
+            pass
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._build(key, session_id, load_pcm, background))
+            self._pending[key] = task
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _build(self, key: str, session_id: str, load_pcm, background: bool) -> Path:
+        try:
+            pcm_path = await load_pcm()
+            path = await audio_scheduler.run(session_id, "peaks", build_peaks_file, pcm_path,
+                                             str(self.peaks_path(key)), background=background)
+            logger.info(f"[{session_id}] Built peaks index {path}")
+            return Path(path)
+        finally:
+            self._pending.pop(key, None)
+
+    def schedule(self, key: str, session_id: str, load_pcm):
+        """Builds the index in the background right after upload."""
+        async def build():
+            try:
+                await self.ensure(key, session_id, load_pcm, background=True)
+            except Exception as e:
+                logger.error(f"[{session_id}] Peaks index build failed: {e}")
+
+        task = asyncio.create_task(build())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def read(self, key: str, session_id: str, load_pcm, start_ms: int, end_ms: int, max_peaks: int) -> dict:
+        path = await self.ensure(key, session_id, load_pcm)
+        return await asyncio.to_thread(read_peaks, str(path), start_ms, end_ms, max_peaks)
@@ -0,0 +1,311 @@
+# backend/segmentation.py
+import asyncio
+import audioop
+import logging
+import math
+import os
+import subprocess
+import wave
+from array import array
+from pathlib import Path
+from typing import Callable, Iterator
+
+from pydub import AudioSegment
+
+from workers import audio_scheduler, file_lock
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SILENCE_THRESHOLD_DB = float(os.getenv("SILENCE_THRESHOLD_DB", "-40"))  # dBFS below which a window is silent
+SILENCE_MIN_MS = int(os.getenv("SILENCE_MIN_MS", "200"))                # Shorter quiet runs are ignored
+SILENCE_WINDOW_MS = 20
+SILENCE_SCAN_RATE = 16000  # Non-WAV input is decoded to 16-bit mono at this rate for the scan
+SILENCE_READ_BYTES = 1024 * 1024
+
+# Pause strategy: how much each cue contributes to a boundary's break score (max about 1.1)
+SENTENCE_END_SCORE = 0.5   # Block ends with . ! ? or …
+CLAUSE_END_SCORE = 0.2     # Block ends with , ; : or a dash
+GAP_SCORE = 0.3            # Scaled by the timestamp gap, full at PAUSE_FULL_MS
+SILENCE_SCORE = 0.3        # Scaled by the silence found around the boundary, full at PAUSE_FULL_MS
+PAUSE_FULL_MS = 1000
+SILENCE_SLACK_MS = 250     # Cue timestamps are rarely exact; look this far past the block edges
+STRONG_BREAK_SCORE = 0.8   # Cut here right away once the segment has reached its target
+DISTANCE_PENALTY = 0.5     # Score lost per target-length of distance from the target word count
+
+SENTENCE_END_CHARS = ".!?…"
+CLAUSE_END_CHARS = ",;:–—-"
+CLOSING_CHARS = "\"'”’»)]"
+
+
+# --- Strategies ---
+# A strategy maps the block columns to segment bounds (array "q": 0, ..., block_count).
+# All of them run in one pass over the blocks, plus a bounded look-back after each cut.
+def _check_target(target_count: int):
+    if target_count <= 0:
+        raise ValueError(f"Target word count must be positive, got {target_count}")
+
+
+def word_count_bounds(transcript, target_count: int, silences: array | None = None) -> array:
+    """Closes a segment once it holds `target_count` words, or before a block would push it past 1.5x."""
+    _check_target(target_count)
+    word_counts = transcript.word_counts
+    bounds = array("q", [0])
+    current_count = 0
+    for i in range(len(word_counts)):
+        wc = word_counts[i]
+        if current_count > 0 and (current_count >= target_count or current_count + wc > target_count * 1.5):
+            bounds.append(i)
+            current_count = 0
+        current_count += wc
+    if current_count > 0:
+        bounds.append(len(word_counts))
+    return bounds
+
+
+def break_scores(transcript, silences: array | None = None) -> array:
+    """Scores every block boundary (index i: between blocks i-1 and i) by how natural a cut there is.
+
+    Combines the punctuation ending block i-1, the gap between the two blocks'
+    timestamps and, when given, the silence measured in the audio around it.
+    """
+    starts, ends = transcript.starts, transcript.ends
+    text, offsets = transcript.text_buffer, transcript.text_offsets
+    count = len(starts)
+    scores = array("d", bytes(8 * (count + 1)))
+    silence_index, silence_count = 0, len(silences) // 2 if silences else 0
+    for i in range(1, count):
+        # Last character of block i-1, skipping closing quotes/brackets
+        pos = offsets[i] - 2
+        while pos > offsets[i - 1] and text[pos] in CLOSING_CHARS:
+            pos -= 1
+        last = text[pos]
+        score = SENTENCE_END_SCORE if last in SENTENCE_END_CHARS else CLAUSE_END_SCORE if last in CLAUSE_END_CHARS else 0.0
+
+        gap = starts[i] - ends[i - 1]
+        if gap > 0:
+            score += GAP_SCORE * min(gap / PAUSE_FULL_MS, 1.0)
+
+        if silence_count:
+            # Boundaries come in time order, so the silence runs are walked once overall
+            window_start, window_end = ends[i - 1] - SILENCE_SLACK_MS, starts[i] + SILENCE_SLACK_MS
+            while silence_index < silence_count and silences[2 * silence_index + 1] <= window_start:
+                silence_index += 1
+            silent_ms, j = 0, silence_index
+            while j < silence_count and silences[2 * j] < window_end:
+                silent_ms = max(silent_ms, min(silences[2 * j + 1], window_end) - max(silences[2 * j], window_start))
+                j += 1
+            score += SILENCE_SCORE * min(silent_ms / PAUSE_FULL_MS, 1.0)
+        scores[i] = score
+    return scores
+
+
+def pause_bounds(transcript, target_count: int, silences: array | None = None) -> array:
+    """Cuts at the most natural boundary near the target size instead of exactly at it.
+
+    Once a segment holds half the target, each boundary is a candidate, valued by
+    its break score minus a penalty for its distance from the target. The segment
+    is cut at a strong break as soon as the target is reached, or otherwise at the
+    best candidate seen when the next block would push it past 1.5x the target.
+    Everything after that candidate is scanned again for the next segment, which
+    is never more than 1.5x the target of words, so the pass stays linear.
+    """
+    _check_target(target_count)
+    word_counts = transcript.word_counts
+    scores = break_scores(transcript, silences)
+    count = len(word_counts)
+    low, high = target_count * 0.5, target_count * 1.5
+    bounds = array("q", [0])
+    i = current_count = 0
+    best, best_value = 0, -math.inf
+    while i < count:
+        current_count += word_counts[i]
+        i += 1
+        if i == count:
+            break
+        cut = None
+        if current_count >= low:
+            value = scores[i] - DISTANCE_PENALTY * abs(current_count - target_count) / target_count
+            if value > best_value:
+                best, best_value = i, value
+            if current_count >= target_count and scores[i] >= STRONG_BREAK_SCORE:
+                cut = i
+        if cut is None and (current_count >= high or current_count + word_counts[i] > high):
+            cut = best if best_value > -math.inf else i
+        if cut is not None:
+            bounds.append(cut)
+            i, current_count = cut, 0
+            best, best_value = 0, -math.inf
+    if count:
+        bounds.append(count)
+    return bounds
+
+
+# name -> (bounds function, whether it can use measured silences)
+SEGMENTATION_STRATEGIES: dict[str, tuple[Callable[..., array], bool]] = {
+    "word_count": (word_count_bounds, False),
+    "pause": (pause_bounds, True),
+}
+DEFAULT_SEGMENTATION = "word_count"
+
+
+def get_strategy(name: str) -> Callable[..., array]:
+    try:
+        return SEGMENTATION_STRATEGIES[name][0]
+    except KeyError:
+        raise ValueError(f"Unknown segmentation strategy '{name}' (known: {', '.join(SEGMENTATION_STRATEGIES)})")
+
+
+def uses_silences(name: str) -> bool:
+    return name in SEGMENTATION_STRATEGIES and SEGMENTATION_STRATEGIES[name][1]
+
+
+# --- Silence Scan (chunked; runs in a worker process) ---
+def _iter_wave_pcm(audio_path: str) -> Iterator[tuple[bytes, int, int]]:
+    with wave.open(audio_path, "rb") as wav:
+        channels, sample_width, frame_rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        if channels > 2:
+            raise wave.Error(f"{channels} channels")
+        frames = max(1, SILENCE_READ_BYTES // (channels * sample_width))
+        while fragment := wav.readframes(frames):
+            if sample_width == 1:
+                fragment = audioop.bias(fragment, 1, -128)
+            if channels == 2:
+                fragment = audioop.tomono(fragment, sample_width, 0.5, 0.5)
+            yield fragment, sample_width, frame_rate
+
+
+def _iter_ffmpeg_pcm(audio_path: str, audio_format: str | None) -> Iterator[tuple[bytes, int, int]]:
+    # ffmpeg decodes to a pipe, so only one chunk of PCM exists at a time
+    command = [AudioSegment.converter, "-v", "error"]
+    if audio_format:
+        command += ["-f", audio_format]
+    command += ["-i", audio_path, "-f", "s16le", "-ac", "1", "-ar", str(SILENCE_SCAN_RATE), "-"]
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        while data := process.stdout.read(SILENCE_READ_BYTES):
+            yield data[:len(data) - len(data) % 2], 2, SILENCE_SCAN_RATE
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with {process.returncode}")
+
+
+def _iter_decoded_pcm(audio_path: str, audio_format: str | None) -> Iterator[tuple[bytes, int, int]]:
+    # Last resort (no ffmpeg binary to pipe from): pydub decodes the whole file
+    audio = AudioSegment.from_file(audio_path, format=audio_format).set_channels(1)
+    raw = memoryview(audio.raw_data)
+    for offset in range(0, len(raw), SILENCE_READ_BYTES):
+        yield bytes(raw[offset:offset + SILENCE_READ_BYTES]), audio.sample_width, audio.frame_rate
+
+
+def _pcm_source(audio_path: str, audio_format: str | None) -> Iterator[tuple[bytes, int, int]]:
+    # A reader may only be swapped for the next one before it has produced any audio
+    produced = False
+    if audio_format == "wav":
+        try:
+            for chunk in _iter_wave_pcm(audio_path):
+                produced = True
+                yield chunk
+            return
+        except (wave.Error, EOFError) as e:
+            if produced:
+                raise
+            logger.info(f"Streaming WAV read failed for {audio_path} ({e}), decoding instead.")
+    try:
+        for chunk in _iter_ffmpeg_pcm(audio_path, audio_format):
+            produced = True
+            yield chunk
+    except (OSError, RuntimeError) as e:
+        if produced:
+            raise
+        logger.info(f"ffmpeg pipe unavailable for {audio_path} ({e}), decoding with pydub instead.")
+        yield from _iter_decoded_pcm(audio_path, audio_format)
+
+
+def scan_silences(audio_path: str, audio_format: str | None) -> array:
+    """Finds quiet runs of at least SILENCE_MIN_MS; returns interleaved (start_ms, end_ms) pairs.
+
+    The audio is read in chunks and reduced to one RMS value per
+    SILENCE_WINDOW_MS window (audioop, in C), so memory stays flat for any length.
+    """
+    silences = array("q")
+    run_start = None
+    window_index = 0
+    rest = b""
+    window_bytes = threshold = None
+    for fragment, sample_width, frame_rate in _pcm_source(audio_path, audio_format):
+        if window_bytes is None:
+            window_bytes = max(1, frame_rate * SILENCE_WINDOW_MS // 1000) * sample_width
+            threshold = (2 ** (8 * sample_width - 1)) * 10 ** (SILENCE_THRESHOLD_DB / 20)
+        data = rest + fragment if rest else fragment
+        usable = len(data) - len(data) % window_bytes
+        for offset in range(0, usable, window_bytes):
+            quiet = audioop.rms(data[offset:offset + window_bytes], sample_width) < threshold
+            if quiet and run_start is None:
+                run_start = window_index
+            elif not quiet and run_start is not None:
+                if (window_index - run_start) * SILENCE_WINDOW_MS >= SILENCE_MIN_MS:
+                    silences.extend((run_start * SILENCE_WINDOW_MS, window_index * SILENCE_WINDOW_MS))
+                run_start = None
+            window_index += 1
+        rest = data[usable:]
+    if run_start is not None and (window_index - run_start) * SILENCE_WINDOW_MS >= SILENCE_MIN_MS:
+        silences.extend((run_start * SILENCE_WINDOW_MS, window_index * SILENCE_WINDOW_MS))
+    return silences
+
+
+def build_silences_file(audio_path: str, audio_format: str | None, out_path: str) -> str:
+    with file_lock(out_path):
+        if os.path.exists(out_path):
+            return out_path
+        silences = scan_silences(audio_path, audio_format)
+        tmp_path = f"{out_path}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_path, "wb") as out:
+                silences.tofile(out)
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return out_path
+
+
+# --- Per-Session Silence Index ---
+class SilenceStore:
+    """Silence runs per uploaded file, stored next to the audio as `<session_id>.silences`.
+
+    Scanned once in the process pool when a pause-aware grouping first needs
+    it; regroups of the same session reuse the file.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._pending: dict[str, asyncio.Task] = {}
+
+    def silences_path(self, session_id: str) -> Path:
+        return self.root / f"{session_id}.silences"
+
+    async def get(self, session_id: str, audio_path: str, audio_format: str | None) -> array:
+        path = self.silences_path(session_id)
+        if not path.exists():
+            task = self._pending.get(session_id)
+            if task is None:
+                task = asyncio.create_task(self._scan(session_id, audio_path, audio_format))
+                self._pending[session_id] = task
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            await asyncio.shield(task)
+        silences = array("q")
+        silences.frombytes(await asyncio.to_thread(path.read_bytes))
+        return silences
+
+    async def _scan(self, session_id: str, audio_path: str, audio_format: str | None):
+        try:
+            await audio_scheduler.run(session_id, "silence_scan", build_silences_file,
+                                      audio_path, audio_format, str(self.silences_path(session_id)))
+            logger.info(f"[{session_id}] Scanned audio for silences")
+        finally:
+            self._pending.pop(session_id, None)
+
+    def remove_session(self, session_id: str):
+        path = self.silences_path(session_id)
+        path.unlink(missing_ok=True)
+        path.with_name(f"{path.name}.lock").unlink(missing_ok=True)
@@ -0,0 +1,240 @@
+# backend/segments.py
+import logging
+from array import array
+from typing import Iterable, Iterator
+
+from segmentation import DEFAULT_SEGMENTATION, get_strategy
+from transcript_parser import ms_to_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+# --- Columnar Transcript Model ---
+class Transcript:
+    """A session's cue blocks and the segments grouped from them, stored column-wise.
+
+    Blocks are parallel int arrays (start/end ms, word count) plus one shared
+    text buffer: block texts joined by single spaces, with `text_offsets[i]`
+    marking where block i starts. The text of any run of consecutive blocks is
+    therefore a single slice of the buffer.
+
+    Segments are contiguous block ranges (segment i covers blocks
+    `bounds[i]:bounds[i + 1]`) with two sparse columns on top: the edited text
+    (None while it still equals the original) and the GPT error. `transcript[i]`
+    returns a lightweight `Segment` view; dicts are only built by `to_dicts()`
+    for API responses.
+    """
+
+    __slots__ = ("starts", "ends", "word_counts", "text_offsets", "text_buffer",
+                 "bounds", "edited_texts", "gpt_errors")
+
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+        self.word_counts = array("l")
+        self.text_offsets = array("q", [0])  # One entry per block plus the end sentinel
+        self.text_buffer = ""
+        self.bounds = array("q", [0])  # One entry per segment plus the end sentinel
+        self.edited_texts: list[str | None] = []
+        self.gpt_errors: list[str | None] = []
+
+    @classmethod
+    def from_blocks(cls, blocks: Iterable[dict]) -> "Transcript":
+        """Builds the block columns from parser blocks (any iterable, consumed once)."""
+        builder = TranscriptBuilder()
+        builder.extend(blocks)
+        return builder.build()
+
+    # --- Blocks ---
+    @property
+    def block_count(self) -> int:
+        return len(self.starts)
+
+    def block_text(self, first: int, stop: int) -> str:
+        """Space-joined text of blocks first..stop-1."""
+        return self.text_buffer[self.text_offsets[first]:self.text_offsets[stop] - 1]
+
+    # --- Grouping ---
+    def group(self, target_count: int = 60, strategy: str = DEFAULT_SEGMENTATION,
+              silences: array | None = None) -> "Transcript":
+        """Regroups all blocks into segments of roughly `target_count` words, discarding edits.
+
+        `strategy` names an entry of segmentation.SEGMENTATION_STRATEGIES;
+        `silences` (interleaved start/end ms) is used by strategies that look at the audio.
+        """
+        bounds = get_strategy(strategy)(self, target_count, silences)
+        self.bounds = bounds
+        self.edited_texts = [None] * (len(bounds) - 1)
+        self.gpt_errors = [None] * (len(bounds) - 1)
+        logger.info(f"Grouped into {len(self)} segments (~{target_count} words, {strategy}).")
+        return self
+
+    def group_by_word_count(self, target_count: int = 60) -> "Transcript":
+        """Groups on word count alone: see segmentation.word_count_bounds."""
+        return self.group(target_count, "word_count")
+
+    def regroup(self, target_count: int, strategy: str = DEFAULT_SEGMENTATION,
+                silences: array | None = None) -> list[int]:
+        """Regroups with a new target or strategy, keeping the edits of segments whose block range is unchanged.
+
+        Returns the indices of new segments with no identical counterpart in the
+        old grouping; only those need GPT or audio work again.
+        """
+        old_bounds, old_texts, old_errors = self.bounds, self.edited_texts, self.gpt_errors
+        previous = {(old_bounds[i], old_bounds[i + 1]): i for i in range(len(old_texts))}
+        self.group(target_count, strategy, silences)
+        bounds = self.bounds
+        changed = []
+        for i in range(len(self)):
+            old_index = previous.get((bounds[i], bounds[i + 1]))
+            if old_index is None:
+                changed.append(i)
+            else:
+                self.edited_texts[i] = old_texts[old_index]
+                self.gpt_errors[i] = old_errors[old_index]
+        return changed
+
+    # --- Segments ---
+    def __len__(self) -> int:
+        return len(self.bounds) - 1
+
+    def __getitem__(self, index: int) -> "Segment":
+        if not 0 <= index < len(self):
+            raise IndexError("segment index out of range")
+        return Segment(self, index)
+
+    def __iter__(self) -> Iterator["Segment"]:
+        for index in range(len(self)):
+            yield Segment(self, index)
+
+    def segment_ranges(self) -> list[tuple[int, int]]:
+        """(start_ms, end_ms) of every segment, in order."""
+        bounds, starts, ends = self.bounds, self.starts, self.ends
+        return [(starts[bounds[i]], ends[bounds[i + 1] - 1]) for i in range(len(self))]
+
+    def to_dicts(self) -> list[dict]:
+        return [segment.to_dict() for segment in self]
+
+    def snapshot(self) -> "Transcript":
+        """A copy of the current grouping and edits that later regroups or edits don't affect.
+
+        Block columns are never modified after parsing, and regrouping replaces
+        `bounds` instead of changing it, so only the two sparse lists are copied.
+        """
+        snapshot = Transcript()
+        snapshot.starts, snapshot.ends, snapshot.word_counts = self.starts, self.ends, self.word_counts
+        snapshot.text_offsets, snapshot.text_buffer = self.text_offsets, self.text_buffer
+        snapshot.bounds = self.bounds
+        snapshot.edited_texts = list(self.edited_texts)
+        snapshot.gpt_errors = list(self.gpt_errors)
+        return snapshot
+
+    # --- Serialisation (persistent session stores) ---
+    def to_state(self) -> dict:
+        return {
+            "starts": self.starts.tolist(),
+            "ends": self.ends.tolist(),
+            "word_counts": self.word_counts.tolist(),
+            "text_offsets": self.text_offsets.tolist(),
+            "text_buffer": self.text_buffer,
+            "bounds": self.bounds.tolist(),
+            "edited_texts": self.edited_texts,
+            "gpt_errors": self.gpt_errors,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Transcript":
+        transcript = cls()
+        transcript.starts = array("q", state["starts"])
+        transcript.ends = array("q", state["ends"])
+        transcript.word_counts = array("l", state["word_counts"])
+        transcript.text_offsets = array("q", state["text_offsets"])
+        transcript.text_buffer = state["text_buffer"]
+        transcript.bounds = array("q", state["bounds"])
+        transcript.edited_texts = list(state["edited_texts"])
+        transcript.gpt_errors = list(state["gpt_errors"])
+        return transcript
+
+
+class TranscriptBuilder:
+    """Accumulates parser blocks into block columns; the text buffer is joined once in `build()`."""
+
+    def __init__(self):
+        self._transcript = Transcript()
+        self._texts: list[str] = []
+        self._offset = 0
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def extend(self, blocks: Iterable[dict]):
+        t = self._transcript
+        for block in blocks:
+            text = block["text"]
+            t.starts.append(block["start_ms"])
+            t.ends.append(block["end_ms"])
+            t.word_counts.append(len(text.split()))
+            self._offset += len(text) + 1  # Plus the joining space
+            t.text_offsets.append(self._offset)
+            self._texts.append(text)
+
+    def build(self) -> Transcript:
+        transcript = self._transcript
+        transcript.text_buffer = " ".join(self._texts)
+        self._texts = []
+        return transcript
+
+
+class Segment:
+    """View of one segment of a `Transcript`; reads and writes go straight to its columns."""
+
+    __slots__ = ("transcript", "index")
+
+    def __init__(self, transcript: Transcript, index: int):
+        self.transcript = transcript
+        self.index = index
+
+    @property
+    def start_ms(self) -> int:
+        return self.transcript.starts[self.transcript.bounds[self.index]]
+
+    @property
+    def end_ms(self) -> int:
+        return self.transcript.ends[self.transcript.bounds[self.index + 1] - 1]
+
+    @property
+    def start(self) -> str:
+        return ms_to_timestamp(self.start_ms)
+
+    @property
+    def end(self) -> str:
+        return ms_to_timestamp(self.end_ms)
+
+    @property
+    def original_text(self) -> str:
+        bounds = self.transcript.bounds
+        return self.transcript.block_text(bounds[self.index], bounds[self.index + 1])
+
+    @property
+    def text(self) -> str:
+        edited = self.transcript.edited_texts[self.index]
+        return self.original_text if edited is None else edited
+
+    @text.setter
+    def text(self, value: str):
+        # Unchanged text isn't stored twice
+        self.transcript.edited_texts[self.index] = None if value == self.original_text else value
+
+    @property
+    def gpt_error(self) -> str | None:
+        return self.transcript.gpt_errors[self.index]
+
+    @gpt_error.setter
+    def gpt_error(self, value: str | None):
+        self.transcript.gpt_errors[self.index] = value
+
+    def to_dict(self) -> dict:
+        original_text = self.original_text
+        edited = self.transcript.edited_texts[self.index]
+        return {"text": original_text if edited is None else edited, "original_text": original_text,
+                "start": self.start, "end": self.end, "gpt_error": self.gpt_error}
@@ -0,0 +1,300 @@
+# backend/session_store.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+from segments import Transcript
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # "memory" or "sqlite"
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", str(Path(__file__).resolve().parent / "sessions.sqlite3"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(6 * 3600)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "500"))
+SESSION_SWEEP_INTERVAL_SECONDS = int(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "300"))
+SESSION_CACHE_ENTRIES = int(os.getenv("SESSION_CACHE_ENTRIES", "32"))  # Decoded sessions kept per worker (SQLite)
+
+# Called with (session_id, session) whenever a session is dropped by TTL or the LRU cap,
+# so its audio and derived caches can be deleted with it.
+EvictCallback = Callable[[str, dict], None]
+
+
+class SessionConflictError(Exception):
+    """A versioned save found the session changed (or gone) since it was loaded."""
+
+
+def _encode_value(value):
+    # json.dumps hook: a session's Transcript is stored as its column state
+    if isinstance(value, Transcript):
+        return {"__transcript__": value.to_state()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_object(obj: dict):
+    if "__transcript__" in obj:
+        return Transcript.from_state(obj["__transcript__"])
+    return obj
+
+
+def dump_session(session: dict) -> str:
+    return json.dumps(session, default=_encode_value)
+
+
+def load_session(data: str) -> dict:
+    return json.loads(data, object_hook=_decode_object)
+
+
+# --- Session Store Interface ---
+class SessionStore:
+    """Key/value store for session dicts with sliding TTL and an LRU size cap.
+
+    Sessions are dicts of JSON-serialisable values plus the session's
+    `Transcript`, which persistent backends store as its column state. Backends
+    may hand out copies, so callers must `save()` a session again after changing it.
+    """
+
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS, max_entries: int = SESSION_MAX_ENTRIES,
+                 on_evict: EvictCallback | None = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+
+    def get(self, session_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def get_with_version(self, session_id: str) -> tuple[dict, int] | None:
+        """Like `get`, plus the version to pass back as `save(..., expected_version=)`.
+
+        Versions only matter for stores shared between processes; backends
+        that hand every caller the same object return 0 and never conflict.
+        """
+        session = self.get(session_id)
+        return None if session is None else (session, 0)
+
+    def save(self, session_id: str, session: dict, expected_version: int | None = None):
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def session_ids(self) -> set[str]:
+        raise NotImplementedError
+
+    def sweep(self) -> int:
+        """Drops expired sessions (the LRU cap is enforced on save). Returns how many were dropped."""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return len(self.session_ids())
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def _evicted(self, session_id: str, session: dict, reason: str):
+        logger.info(f"Evicting session {session_id} ({reason})")
+        if self.on_evict is not None:
+            try:
+                self.on_evict(session_id, session)
+            except Exception as e:
+                logger.error(f"Cleanup failed for evicted session {session_id}: {e}")
+
+
+# --- In-Memory Backend (single worker) ---
+class MemorySessionStore(SessionStore):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            session, accessed_at = entry
+            now = time.time()
+            if now - accessed_at > self.ttl_seconds:
+                return None  # Expired; the sweeper cleans it up
+            self._entries[session_id] = (session, now)
+            self._entries.move_to_end(session_id)
+            return session
+
+    def save(self, session_id: str, session: dict, expected_version: int | None = None):
+        overflow = []
+        with self._lock:
+            self._entries[session_id] = (session, time.time())
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                old_id, (old_session, _) = self._entries.popitem(last=False)
+                overflow.append((old_id, old_session))
+        for old_id, old_session in overflow:
+            self._evicted(old_id, old_session, "LRU cap")
+
+    def delete(self, session_id: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        return entry[0] if entry else None
+
+    def session_ids(self) -> set[str]:
+        with self._lock:
+            return set(self._entries)
+
+    def sweep(self) -> int:
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [(sid, session) for sid, (session, accessed_at) in self._entries.items() if accessed_at < cutoff]
+            for sid, _ in expired:
+                del self._entries[sid]
+        for sid, session in expired:
+            self._evicted(sid, session, "expired")
+        return len(expired)
+
+
+# --- SQLite Backend (shared by several uvicorn workers on one host) ---
+class SQLiteSessionStore(SessionStore):
+    """Sessions as JSON rows, with a per-row version bumped on every save.
+
+    Decoded sessions are cached per worker by that version, so the audio and
+    peaks endpoints, which only read a session, cost one small indexed query
+    instead of decoding the whole transcript on every request.
+    """
+
+    # Skip rewriting accessed_at on every read; TTLs are hours, not seconds
+    TOUCH_INTERVAL_SECONDS = 60
+
+    def __init__(self, path: str = SESSION_DB_PATH, cache_entries: int = SESSION_CACHE_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.cache_entries = cache_entries
+        self._cache: OrderedDict[str, tuple[int, dict]] = OrderedDict()  # session_id -> (version, session)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, data TEXT NOT NULL, accessed_at REAL NOT NULL,"
+            " version INTEGER NOT NULL DEFAULT 0)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "version" not in columns:
+            # Databases created before row versions
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed_at)")
+        self._conn.commit()
+
+    def get(self, session_id: str) -> dict | None:
+        entry = self.get_with_version(session_id)
+        return entry[0] if entry else None
+
+    def get_with_version(self, session_id: str) -> tuple[dict, int] | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, accessed_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            version, accessed_at = row
+            if now - accessed_at > self.ttl_seconds:
+                return None
+            if now - accessed_at > self.TOUCH_INTERVAL_SECONDS:
+                self._conn.execute("UPDATE sessions SET accessed_at = ? WHERE session_id = ?", (now, session_id))
+                self._conn.commit()
+            cached = self._cache.get(session_id)
+            if cached is not None and cached[0] == version:
+                self._cache.move_to_end(session_id)
+                return cached[1], version
+            row = self._conn.execute(
+                "SELECT data, version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        session = load_session(row[0])
+        self._remember(session_id, row[1], session)
+        return session, row[1]
+
+    def save(self, session_id: str, session: dict, expected_version: int | None = None):
+        data = dump_session(session)
+        with self._lock:
+            # One transaction: the version read back is the one this save wrote, even with other workers saving
+            if expected_version is None:
+                updated = self._conn.execute(
+                    "UPDATE sessions SET data = ?, accessed_at = ?, version = version + 1 WHERE session_id = ?",
+                    (data, time.time(), session_id)).rowcount
+            else:
+                # Compare-and-swap: another worker's save since the load makes this one fail
+                updated = self._conn.execute(
+                    "UPDATE sessions SET data = ?, accessed_at = ?, version = version + 1"
+                    " WHERE session_id = ? AND version = ?",
+                    (data, time.time(), session_id, expected_version)).rowcount
+                if not updated:
+                    self._conn.rollback()
+                    self._cache.pop(session_id, None)  # It may hold this request's unsaved changes
+                    raise SessionConflictError(f"Session {session_id} changed since version {expected_version}")
+            if not updated:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, data, accessed_at, version) VALUES (?, ?, ?, 1)",
+                    (session_id, data, time.time()))
+            version = self._conn.execute(
+                "SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()[0]
+            self._conn.commit()
+            count = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        self._remember(session_id, version, session)
+        if count > self.max_entries:
+            self._drop(self._select(
+                "SELECT session_id, data FROM sessions ORDER BY accessed_at LIMIT ?", (count - self.max_entries,)), "LRU cap")
+
+    def _remember(self, session_id: str, version: int, session: dict):
+        with self._lock:
+            self._cache[session_id] = (version, session)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def delete(self, session_id: str) -> dict | None:
+        with self._lock:
+            self._cache.pop(session_id, None)
+            row = self._conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+        return load_session(row[0]) if row else None
+
+    def session_ids(self) -> set[str]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT session_id FROM sessions")}
+
+    def sweep(self) -> int:
+        expired = self._select("SELECT session_id, data FROM sessions WHERE accessed_at < ?",
+                               (time.time() - self.ttl_seconds,))
+        return self._drop(expired, "expired")
+
+    def _select(self, query: str, params: tuple) -> list[tuple[str, str]]:
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def _drop(self, rows: list[tuple[str, str]], reason: str) -> int:
+        dropped = 0
+        for session_id, data in rows:
+            with self._lock:
+                # Only the worker whose DELETE succeeds runs the cleanup
+                deleted = self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+                self._conn.commit()
+                self._cache.pop(session_id, None)
+            if deleted:
+                dropped += 1
+                self._evicted(session_id, load_session(data), reason)
+        return dropped
+
+
+def create_session_store(on_evict: EvictCallback | None = None) -> SessionStore:
+    if SESSION_STORE == "sqlite":
+        logger.info(f"Using SQLite session store at {SESSION_DB_PATH}")
+        return SQLiteSessionStore(on_evict=on_evict)
+    if SESSION_STORE != "memory":
+        logger.warning(f"Unknown SESSION_STORE '{SESSION_STORE}', falling back to in-memory sessions.")
+    return MemorySessionStore(on_evict=on_evict)
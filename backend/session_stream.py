@@ -0,0 +1,269 @@
+# backend/session_stream.py
+import asyncio
+import logging
+import math
+import mmap
+import os
+import struct
+import subprocess
+import wave
+from array import array
+from pathlib import Path
+
+from pydub import AudioSegment
+
+from audio_cache import PcmWavReader
+from clip_store import ClipStore
+from workers import audio_scheduler, file_lock
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Constant bitrate keeps byte offsets proportional to time, which is what makes
+# Range requests by segment cheap for the browser
+STREAM_BITRATE = os.getenv("STREAM_BITRATE", "128k")
+STREAM_NAME = "session"  # <clips root>/<session_id>/session.mp3 (or .wav)
+STREAM_COPY_FRAMES = 65536
+
+# MPEG audio layer III header tables
+MP3_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),   # MPEG 1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),       # MPEG 2
+    0: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),       # MPEG 2.5
+}
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+STREAM_FORMATS = (("mp3", "audio/mpeg"), ("wav", "audio/wav"))
+
+
+def _id3v2_size(data) -> int:
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def scan_mp3_frames(path: str) -> tuple[array, int, int, int]:
+    """Walks the MP3 frame headers of a file.
+
+    Returns (frame byte offsets, samples per frame, sample rate, header end);
+    bytes before `header end` (ID3 tag, Xing/Info frame) carry no audio.
+    """
+    offsets = array("q")
+    samples_per_frame, sample_rate = 1152, 44100
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        pos = header_end = _id3v2_size(data)
+        while pos + 4 <= size:
+            b1, b2 = data[pos + 1], data[pos + 2]
+            version, layer = (b1 >> 3) & 3, (b1 >> 1) & 3
+            bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+            if (data[pos] != 0xFF or (b1 & 0xE0) != 0xE0 or version == 1 or layer != 1
+                    or bitrate_index in (0, 15) or rate_index == 3):
+                # Not a frame header (tag, junk or lost sync): resume at the next sync byte
+                pos = data.find(b"\xff", pos + 1)
+                if pos < 0:
+                    break
+                continue
+            sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+            bitrate = MP3_BITRATES[version][bitrate_index] * 1000
+            samples_per_frame = 1152 if version == 3 else 576
+            frame_length = (samples_per_frame // 8) * bitrate // sample_rate + ((b2 >> 1) & 1)
+            if not offsets and (data.find(b"Xing", pos, pos + frame_length) >= 0
+                                or data.find(b"Info", pos, pos + frame_length) >= 0):
+                header_end = pos + frame_length  # Encoder info frame: decoders skip it
+            else:
+                offsets.append(pos)
+            pos += frame_length
+    return offsets, samples_per_frame, sample_rate, header_end
+
+
+def wav_layout(path: str) -> tuple[int, int, int, int]:
+    """Returns (data offset, data size, frame rate, block align) of a PCM WAV file."""
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise ValueError(f"Not a WAV file: {path}")
+        frame_rate = block_align = None
+        while chunk := f.read(8):
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size + (chunk_size & 1))
+                frame_rate = struct.unpack_from("<I", fmt, 4)[0]
+                block_align = struct.unpack_from("<H", fmt, 12)[0]
+            elif chunk_id == b"data":
+                if frame_rate is None:
+                    raise ValueError(f"WAV data before fmt chunk: {path}")
+                return f.tell(), chunk_size, frame_rate, block_align
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    raise ValueError(f"WAV file has no data chunk: {path}")
+
+
+def _find_stream(out_base: str) -> tuple[str, str] | None:
+    for export_format, content_type in STREAM_FORMATS:
+        path = f"{out_base}.{export_format}"
+        if os.path.exists(path):
+            return path, content_type
+    return None
+
+
+def _encode_mp3(pcm_path: str, out_path: str):
+    # ffmpeg reads the decoded file and writes the MP3 itself, so no audio is held in memory
+    command = [AudioSegment.converter, "-nostdin", "-v", "error", "-y", "-i", pcm_path, "-vn",
+               "-c:a", "libmp3lame", "-b:a", STREAM_BITRATE, "-f", "mp3", out_path]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.decode(errors='replace')[-500:]}")
+
+
+def _copy_wav(pcm_path: str, out_path: str):
+    # Rewritten as a plain RIFF WAV (the decode may be RF64), a block of frames at a time
+    with PcmWavReader(pcm_path) as source, wave.open(out_path, "wb") as out:
+        out.setnchannels(source.getnchannels())
+        out.setsampwidth(source.getsampwidth())
+        out.setframerate(source.getframerate())
+        while frames := source.readframes(STREAM_COPY_FRAMES):
+            out.writeframes(frames)
+
+
+def render_session_stream(pcm_path: str, out_base: str) -> tuple[str, str]:
+    """Encodes the decoded upload to one CBR MP3 (WAV if ffmpeg can't), plus its frame index. Runs in a worker."""
+    with file_lock(out_base):
+        found = _find_stream(out_base)
+        if found:
+            return found  # Encoded by another uvicorn worker while this one waited
+        last_error = None
+        for export_format, content_type in STREAM_FORMATS:
+            final_path = f"{out_base}.{export_format}"
+            tmp_path = f"{final_path}.tmp-{os.getpid()}"
+            try:
+                if export_format == "mp3":
+                    _encode_mp3(pcm_path, tmp_path)
+                    offsets, samples_per_frame, sample_rate, header_end = scan_mp3_frames(tmp_path)
+                    if not offsets:
+                        raise RuntimeError("encoder produced no MP3 frames")
+                    with open(f"{final_path}.frames", "wb") as index_file:
+                        index_file.write(struct.pack("<III", samples_per_frame, sample_rate, header_end))
+                        offsets.tofile(index_file)
+                else:
+                    _copy_wav(pcm_path, tmp_path)
+                os.replace(tmp_path, final_path)
+                return final_path, content_type
+            except Exception as e:
+                last_error = e
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        raise RuntimeError(f"Failed to encode session audio: {last_error}")
+
+
+class StreamIndex:
+    """Maps times to byte offsets in a session stream file."""
+
+    def __init__(self, path: Path, content_type: str):
+        self.path = path
+        self.content_type = content_type
+        self.size = path.stat().st_size
+        if content_type == "audio/mpeg":
+            with open(f"{path}.frames", "rb") as index_file:
+                samples_per_frame, sample_rate, self.header_end = struct.unpack("<III", index_file.read(12))
+                self._frame_offsets = array("q")
+                self._frame_offsets.frombytes(index_file.read())
+            self._frame_ms = samples_per_frame * 1000 / sample_rate
+            self.duration_ms = round(len(self._frame_offsets) * self._frame_ms)
+        else:
+            data_offset, data_size, self._frame_rate, self._block_align = wav_layout(str(path))
+            self.header_end = data_offset
+            self.size = min(self.size, data_offset + data_size)
+            self.duration_ms = data_size // self._block_align * 1000 // self._frame_rate
+
+    def byte_offset(self, ms: int, round_up: bool = False) -> int:
+        ms = min(max(ms, 0), self.duration_ms)
+        if self.content_type == "audio/mpeg":
+            position = ms / self._frame_ms
+            frame = math.ceil(position) if round_up else math.floor(position)
+            return self._frame_offsets[frame] if frame < len(self._frame_offsets) else self.size
+        frames = ms * self._frame_rate / 1000
+        frames = math.ceil(frames) if round_up else math.floor(frames)
+        return min(self.header_end + frames * self._block_align, self.size)
+
+    def segment_entry(self, index: int, start_ms: int, end_ms: int) -> dict:
+        # byte_end is inclusive, like an HTTP Range header; both are None when the segment has no audio
+        byte_start = self.byte_offset(start_ms)
+        byte_end = self.byte_offset(end_ms, round_up=True) - 1
+        if start_ms >= self.duration_ms or byte_end < byte_start:
+            byte_start = byte_end = None
+        return {"index": index, "start_ms": start_ms, "end_ms": end_ms, "byte_start": byte_start, "byte_end": byte_end}
+
+
+# --- Whole-Session Stream ---
+class SessionStreamStore:
+    """One encoded stream of the full upload per session, kept in the session's clip directory.
+
+    Lets a client play every segment from a single resource with HTTP Range
+    (or media fragments) instead of one request per segment clip. Encoded
+    from the decoded PCM; `load_pcm` is an async callable returning that
+    file, only awaited when the stream still has to be encoded.
+    """
+
+    def __init__(self, clip_store: ClipStore):
+        self.clip_store = clip_store
+        self._pending: dict[str, asyncio.Task] = {}
+        self._indexes: dict[str, StreamIndex] = {}
+        self._background: set[asyncio.Task] = set()
+
+    def find_stream(self, session_id: str) -> tuple[Path, str] | None:
+        base = self.clip_store.session_dir(session_id) / STREAM_NAME
+        for export_format, content_type in STREAM_FORMATS:
+            path = base.with_name(f"{STREAM_NAME}.{export_format}")
+            if path.exists():
+                return path, content_type
+        return None
+
+    async def ensure_stream(self, session_id: str, load_pcm, background: bool = False) -> tuple[Path, str]:
+        found = self.find_stream(session_id)
+        if found:
+            return found
+        task = self._pending.get(session_id)
+        if task is None:
+            task = asyncio.create_task(self._render(session_id, load_pcm, background))
+            self._pending[session_id] = task
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _render(self, session_id: str, load_pcm, background: bool) -> tuple[Path, str]:
+        try:
+            pcm_path = await load_pcm()
+            session_dir = self.clip_store.session_dir(session_id)
+            session_dir.mkdir(parents=True, exist_ok=True)
+            path, content_type = await audio_scheduler.run(
+                session_id, "stream_encode", render_session_stream, pcm_path,
+                str(session_dir / STREAM_NAME), background=background)
+            logger.info(f"[{session_id}] Encoded session stream {path}")
+            return Path(path), content_type
+        finally:
+            self._pending.pop(session_id, None)
+
+    def schedule(self, session_id: str, load_pcm):
+        """Encodes the stream in the background right after upload."""
+        async def encode():
+            try:
+                await self.ensure_stream(session_id, load_pcm, background=True)
+            except Exception as e:
+                logger.error(f"[{session_id}] Session stream encode failed: {e}")
+
+        task = asyncio.create_task(encode())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def get_index(self, session_id: str, load_pcm) -> StreamIndex:
+        path, content_type = await self.ensure_stream(session_id, load_pcm)
+        index = self._indexes.get(session_id)
+        if index is None or index.path != path:
+            index = await asyncio.to_thread(StreamIndex, path, content_type)
+            self._indexes[session_id] = index
+        return index
+
+    def forget(self, session_id: str):
+        # Files go with the session's clip directory; only the in-memory index is ours
+        self._indexes.pop(session_id, None)
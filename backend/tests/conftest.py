@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+import sys
+from pathlib import Path
+
+# The backend modules import each other as top-level modules (uvicorn runs from backend/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
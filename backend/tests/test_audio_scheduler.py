@@ -0,0 +1,82 @@
+# backend/tests/test_audio_scheduler.py
+import asyncio
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import workers
+from workers import AudioBusyError, AudioScheduler
+
+
+class FakePool(Executor):
+    """Runs jobs inline, or fails them like a pool whose worker process died."""
+
+    def __init__(self, broken: bool = False):
+        self.broken = broken
+        self.is_shut_down = False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        if self.broken:
+            future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+        else:
+            future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.is_shut_down = True
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    created = []
+
+    def use_pools(*broken):
+        queue = [FakePool(b) for b in broken]
+        created.extend(queue)
+        monkeypatch.setattr(workers, "ProcessPoolExecutor", lambda **kwargs: queue.pop(0))
+        return created
+
+    monkeypatch.setattr(workers, "_process_pool", None)
+    return use_pools
+
+
+def test_broken_pool_is_replaced_and_the_job_retried(pools):
+    created = pools(True, False)
+    result = asyncio.run(AudioScheduler(workers=1).run("s", "test", pow, 2, 10))
+    assert result == 1024
+    assert created[0].is_shut_down
+    assert workers._process_pool is created[1]
+
+
+def test_pool_breaking_again_is_a_busy_error(pools):
+    created = pools(True, True)
+    with pytest.raises(AudioBusyError):
+        asyncio.run(AudioScheduler(workers=1).run("s", "test", pow, 2, 10))
+    assert all(pool.is_shut_down for pool in created)
+    assert workers._process_pool is None  # The next job starts a fresh pool
+
+
+def test_replaced_pool_is_not_shut_down_by_late_failures(pools):
+    created = pools(False)
+    current = workers.get_process_pool()
+    workers.shutdown_process_pool(FakePool(broken=True))  # A job still holding the old pool
+    assert workers._process_pool is current and not created[0].is_shut_down
+
+
+def run_burst(jobs: int, **limits) -> list:
+    scheduler = AudioScheduler(workers=1, max_queue=2, session_concurrency=2, **limits)
+
+    async def burst():
+        return await asyncio.gather(*(scheduler.run("s", "test", pow, 2, i) for i in range(jobs)),
+                                    return_exceptions=True)
+    return asyncio.run(burst())
+
+
+def test_session_backlog_has_its_own_cap(pools):
+    pools(False)
+    # A page of segments from one session queues behind its own limit, past the global queue size
+    assert run_burst(11, session_max_queue=16) == [2 ** i for i in range(11)]
+    results = run_burst(11, session_max_queue=4)
+    assert sum(isinstance(r, AudioBusyError) for r in results) == 11 - 2 - 4
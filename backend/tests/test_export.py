@@ -0,0 +1,30 @@
+# backend/tests/test_export.py
+import wave
+from array import array
+
+import export
+from export import render_stitched_audio
+
+FRAME_RATE = 1000  # One frame per ms keeps the expected bytes readable
+
+
+def test_stitched_audio_reads_only_the_selected_ranges(tmp_path, monkeypatch):
+    monkeypatch.setattr(export.AudioSegment, "converter", str(tmp_path / "no-ffmpeg"))
+    monkeypatch.setattr(export, "EXPORT_AUDIO_GAP_MS", 50)
+    samples = array("h", range(1, 1001))  # 1 s, sample i at i ms (plus one)
+    pcm_path = str(tmp_path / "decoded.wav")
+    with wave.open(pcm_path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(FRAME_RATE)
+        wav.writeframes(samples.tobytes())
+
+    # The second range starts within the gap of the first's end, so it continues from there;
+    # the third is further away and gets silence. The last runs past the end of the audio.
+    ranges = [(100, 200), (230, 300), (500, 600), (950, 2000)]
+    path, content_type = render_stitched_audio(pcm_path, ranges, str(tmp_path / "export"))
+    assert content_type == "audio/wav"
+    with wave.open(path, "rb") as wav:
+        stitched = array("h", wav.readframes(wav.getnframes()))
+    silence = array("h", [0] * 50)
+    assert stitched == samples[100:300] + silence + samples[500:600] + silence + samples[950:1000]
@@ -0,0 +1,115 @@
+# backend/tests/test_gpt_batching.py
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import core_logic
+import gpt_engine
+from core_logic import batch_fix_cache_key, fix_cache_key, parse_batch_reply
+from gpt_cache import CacheStats, GPTCache
+from gpt_engine import GPTEngine
+
+
+# --- parse_batch_reply ---
+def test_parse_batch_reply_accepts_one_text_per_segment():
+    assert parse_batch_reply('{"segments": [" a ", "b"]}', 2) == ["a", "b"]
+
+
+@pytest.mark.parametrize("reply", [
+    '{"segments": ["a"]}',  # Wrong segment count
+    '{"segments": ["a", "b", "c"]}',
+    '{"segments": ["a", ""]}',  # Empty text
+    '{"segments": ["a", "  "]}',
+    '{"segments": ["a", 2]}',
+    '{"segments": "a, b"}',
+    '{"texts": ["a", "b"]}',
+    '["a", "b"]',  # Valid JSON, wrong shape
+    'Here you go: a, b',  # Not JSON
+    '',
+])
+def test_parse_batch_reply_rejects(reply):
+    assert parse_batch_reply(reply, 2) is None
+
+
+# --- Engine with a stub client ---
+class StubCompletions:
+    """Answers batched (JSON mode) requests with `batch_reply(texts)` and single ones with "single"."""
+
+    def __init__(self, batch_reply=None, batch_error: Exception | None = None):
+        self.batch_reply = batch_reply or (lambda texts: json.dumps({"segments": [text.upper() for text in texts]}))
+        self.batch_error = batch_error
+        self.calls = []
+
+    async def create(self, model, messages, temperature, response_format=None):
+        prompt = messages[0]["content"]
+        if response_format is not None:
+            texts = json.loads(prompt[prompt.rindex('{"segments"'):])["segments"]
+            self.calls.append(("batch", texts))
+            if self.batch_error is not None:
+                raise self.batch_error
+            content = self.batch_reply(texts)
+        else:
+            self.calls.append(("single", prompt))
+            content = "single"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = GPTCache(path=str(tmp_path / "gpt_cache.sqlite3"))
+    monkeypatch.setattr(gpt_engine, "gpt_cache", cache)
+    monkeypatch.setattr(core_logic, "OPENAI_API_KEY", "test-key")
+    return cache
+
+
+def make_engine(completions: StubCompletions) -> GPTEngine:
+    engine = GPTEngine(requests_per_minute=0, tokens_per_minute=0, max_retries=0)
+    engine._client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return engine
+
+
+TEXTS = [f"segment {i}" for i in range(6)]
+
+
+def test_batch_reply_is_used_and_cached(cache):
+    completions = StubCompletions()
+    stats = CacheStats()
+    results = asyncio.run(make_engine(completions).fix_batch(TEXTS, stats))
+    assert results == [(text.upper(), None) for text in TEXTS]
+    assert [kind for kind, _ in completions.calls] == ["batch"]
+    assert stats.as_dict() == {"hits": 0, "misses": 6}
+    assert cache.get(batch_fix_cache_key(TEXTS[0])) == TEXTS[0].upper()
+
+
+@pytest.mark.parametrize("completions", [
+    StubCompletions(batch_reply=lambda texts: json.dumps({"segments": texts[:-1]})),  # Wrong count
+    StubCompletions(batch_reply=lambda texts: json.dumps({"segments": [""] * len(texts)})),  # Empty texts
+    StubCompletions(batch_reply=lambda texts: "not json"),
+    StubCompletions(batch_error=RuntimeError("connection reset")),  # Failed request
+], ids=["wrong-count", "empty", "not-json", "request-failed"])
+def test_rejected_batch_falls_back_to_single_calls(cache, completions):
+    stats = CacheStats()
+    results = asyncio.run(make_engine(completions).fix_batch(TEXTS, stats))
+    assert results == [("single", None)] * len(TEXTS)
+    assert [kind for kind, _ in completions.calls] == ["batch"] + ["single"] * len(TEXTS)
+    assert stats.as_dict() == {"hits": 0, "misses": 6}  # One lookup per segment, not one per path tried
+
+
+def test_either_cache_key_counts_as_one_hit(cache):
+    cache.put(fix_cache_key(TEXTS[0]), "from single")
+    cache.put(batch_fix_cache_key(TEXTS[1]), "from batch")
+    completions = StubCompletions()
+    stats = CacheStats()
+    results = asyncio.run(make_engine(completions).fix_batch(TEXTS, stats))
+    assert results[:2] == [("from single", None), ("from batch", None)]
+    assert completions.calls == [("batch", TEXTS[2:])]
+    assert stats.as_dict() == {"hits": 2, "misses": 4}
+
+
+def test_lone_uncached_segment_skips_the_batch(cache):
+    completions = StubCompletions()
+    results = asyncio.run(make_engine(completions).fix_batch(["only one", "  "]))
+    assert results == [("single", None), ("  ", None)]
+    assert [kind for kind, _ in completions.calls] == ["single"]
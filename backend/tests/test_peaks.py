@@ -0,0 +1,73 @@
+# backend/tests/test_peaks.py
+import asyncio
+import wave
+from array import array
+
+import peaks
+from peaks import PEAKS_BASE_MS, PeaksStore, build_peaks_file, read_peaks
+
+FRAME_RATE = 8000
+FRAMES_PER_PEAK = FRAME_RATE * PEAKS_BASE_MS // 1000
+
+
+def write_wav(path, channels: int, frames: int) -> str:
+    # Channel 0 ramps up, the others stay silent, so each peak is predictable
+    samples = array("h")
+    for i in range(frames):
+        samples.append(i * 8)
+        samples.extend([0] * (channels - 1))
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(FRAME_RATE)
+        wav.writeframes(samples.tobytes())
+    return str(path)
+
+
+def test_peaks_follow_the_first_channel_of_multichannel_audio(tmp_path):
+    pcm_path = write_wav(tmp_path / "four.wav", channels=4, frames=FRAMES_PER_PEAK * 3)
+    out_path = build_peaks_file(pcm_path, str(tmp_path / "four.peaks"))
+    result = read_peaks(out_path, 0, 3 * PEAKS_BASE_MS, max_peaks=10)
+    assert result["ms_per_peak"] == PEAKS_BASE_MS
+    expected = []
+    for bucket in range(3):
+        expected += [(bucket * FRAMES_PER_PEAK * 8) >> 8, ((bucket + 1) * FRAMES_PER_PEAK - 1) * 8 >> 8]
+    assert result["peaks"] == expected
+
+
+def test_stereo_is_downmixed(tmp_path):
+    pcm_path = write_wav(tmp_path / "stereo.wav", channels=2, frames=FRAMES_PER_PEAK)
+    out_path = build_peaks_file(pcm_path, str(tmp_path / "stereo.peaks"))
+    assert read_peaks(out_path, 0, PEAKS_BASE_MS, max_peaks=10)["peaks"] == [0, ((FRAMES_PER_PEAK - 1) * 4) >> 8]
+
+
+class InlineScheduler:
+    def __init__(self):
+        self.jobs = []
+
+    async def run(self, session_id, stage, fn, *args, background=False):
+        self.jobs.append((session_id, stage))
+        return fn(*args)
+
+
+def test_re_uploads_share_one_peaks_file(tmp_path, monkeypatch):
+    scheduler = InlineScheduler()
+    monkeypatch.setattr(peaks, "audio_scheduler", scheduler)
+    pcm_path = write_wav(tmp_path / "audio.wav", channels=1, frames=FRAMES_PER_PEAK * 10)
+    loads = []
+
+    async def load_pcm():
+        loads.append(1)
+        return pcm_path
+
+    async def read_twice():
+        store = PeaksStore(tmp_path)
+        first = await store.read("sha", "session-a", load_pcm, 0, 10 * PEAKS_BASE_MS, max_peaks=5)
+        second = await store.read("sha", "session-b", load_pcm, 0, 10 * PEAKS_BASE_MS, max_peaks=5)
+        return first, second
+
+    first, second = asyncio.run(read_twice())
+    assert first == second
+    assert (tmp_path / "sha.peaks").exists()
+    assert scheduler.jobs == [("session-a", "peaks")]
+    assert len(loads) == 1  # The decoded audio isn't needed once the index exists
@@ -0,0 +1,31 @@
+# backend/tests/test_segmentation.py
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from segmentation import pause_bounds, word_count_bounds
+from segments import Transcript
+
+TRANSCRIPT = Transcript.from_blocks([{"start_ms": 0, "end_ms": 900, "text": "one two. three"}])
+
+
+@pytest.mark.parametrize("bounds", [word_count_bounds, pause_bounds])
+@pytest.mark.parametrize("target_count", [0, -5])
+def test_bounds_reject_non_positive_targets(bounds, target_count):
+    with pytest.raises(ValueError):
+        bounds(TRANSCRIPT, target_count)
+
+
+def test_upload_rejects_non_positive_target_words():
+    files = {"transcript_file": ("t.srt", b"1\n00:00:00,000 --> 00:00:01,000\nHello\n", "text/plain"),
+             "audio_file": ("a.wav", b"RIFF\x00\x00\x00\x00WAVEfmt ", "audio/wav")}
+
+    async def send():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/process", data={"target_words": "0", "segmentation": "pause"}, files=files)
+
+    response = asyncio.run(send())
+    assert response.status_code == 422
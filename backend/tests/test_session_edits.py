@@ -0,0 +1,94 @@
+# backend/tests/test_session_edits.py
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from gpt_cache import CacheStats
+from segments import Transcript
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+TEXTS = ["one two three four", "five", "six", "seven", "eight"]
+
+
+def make_session(target_words: int = 2) -> dict:
+    blocks = [{"start_ms": i * 1000, "end_ms": i * 1000 + 900, "text": text} for i, text in enumerate(TEXTS)]
+    return {"audio_path": None, "audio_format": None, "audio_sha256": "0" * 64, "playback": "stream",
+            "transcript": Transcript.from_blocks(blocks).group(target_words, "word_count"),
+            "target_words": target_words, "segmentation": "word_count"}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemorySessionStore()
+    monkeypatch.setattr(main, "session_store", store)
+    return store
+
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    async def send():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+    return asyncio.run(send())
+
+
+def stub_gpt(monkeypatch, before_return=None, error: Exception | None = None):
+    async def process_segments(segments, fix_typos, translate_norwegian, session_id="", cache_stats=None, **kwargs):
+        segments = list(segments)
+        for segment in segments:
+            segment.text = "GPT " + segment.text
+        if before_return is not None:
+            before_return()
+        if error is not None:
+            raise error
+        return cache_stats or CacheStats()
+    monkeypatch.setattr(main.gpt_engine, "process_segments", process_segments)
+
+
+def test_regroup_keeps_unchanged_segments(store, monkeypatch):
+    stub_gpt(monkeypatch)
+    store.save("s", make_session())  # Blocks grouped as [0], [1, 2], [3, 4]
+    assert request("PATCH", "/api/sessions/s/segments/0", json={"text": "kept edit"}).status_code == 200
+
+    response = request("POST", "/api/sessions/s/regroup", json={"target_words": 3, "fix_typos": True})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["changed"] == [1, 2]  # Now [0], [1, 2, 3], [4]
+    assert body["segments"][0]["text"] == "kept edit"
+    assert body["segments"][1]["text"] == "GPT five six seven"
+    assert store.get("s")["transcript"].to_dicts() == body["segments"]
+
+
+def test_failed_edit_leaves_session_untouched(store, monkeypatch):
+    stub_gpt(monkeypatch, error=RuntimeError("boom"))
+    store.save("s", make_session())
+    store.get("s")["transcript"][1].text = "manual"
+    with pytest.raises(RuntimeError):
+        request("POST", "/api/sessions/s/segments/rerun", json={"indices": [1], "fix_typos": True})
+    assert store.get("s")["transcript"][1].text == "manual"  # Neither reset nor half-processed
+
+
+def test_concurrent_save_from_another_worker_is_a_conflict(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "sessions.sqlite3")
+    store = SQLiteSessionStore(path=db_path)
+    other_worker = SQLiteSessionStore(path=db_path)
+    monkeypatch.setattr(main, "session_store", store)
+    store.save("s", make_session())
+
+    def save_elsewhere():
+        session = other_worker.get("s")
+        session["transcript"][0].text = "other worker"
+        other_worker.save("s", session)
+
+    stub_gpt(monkeypatch, before_return=save_elsewhere)
+    response = request("POST", "/api/sessions/s/segments/rerun", json={"indices": [1], "fix_typos": True})
+    assert response.status_code == 409
+    transcript = store.get("s")["transcript"]
+    assert transcript[0].text == "other worker"
+    assert transcript[1].text == "five six"
+
+    stub_gpt(monkeypatch)
+    assert request("POST", "/api/sessions/s/segments/rerun", json={"indices": [1], "fix_typos": True}).status_code == 200
+    assert store.get("s")["transcript"][1].text == "GPT five six"
@@ -0,0 +1,162 @@
+# backend/tests/test_session_store.py
+import os
+import sqlite3
+import time
+
+import pytest
+
+import session_store as session_store_module
+from segments import Transcript
+from session_store import MemorySessionStore, SessionConflictError, SQLiteSessionStore
+
+
+def make_session(text: str = "one two three four five six") -> dict:
+    words = text.split()
+    blocks = [{"start_ms": i * 1000, "end_ms": i * 1000 + 900, "text": word} for i, word in enumerate(words)]
+    transcript = Transcript.from_blocks(blocks).group(2, "word_count")
+    return {"audio_path": None, "transcript": transcript, "target_words": 2}
+
+
+class Recorder:
+    def __init__(self):
+        self.evicted = []
+
+    def __call__(self, session_id, session):
+        self.evicted.append(session_id)
+
+
+# --- In-memory store ---
+def test_memory_ttl_expires_on_get_and_sweep():
+    evicted = Recorder()
+    store = MemorySessionStore(ttl_seconds=60, max_entries=10, on_evict=evicted)
+    store.save("a", make_session())
+    store.save("b", make_session())
+    session, _ = store._entries["a"]
+    store._entries["a"] = (session, time.time() - 120)  # Last used two minutes ago
+    assert store.get("a") is None
+    assert store.get("b") is not None
+    assert store.sweep() == 1
+    assert evicted.evicted == ["a"]
+    assert store.session_ids() == {"b"}
+
+
+def test_memory_lru_cap_evicts_least_recently_used():
+    evicted = Recorder()
+    store = MemorySessionStore(ttl_seconds=60, max_entries=2, on_evict=evicted)
+    store.save("a", make_session())
+    store.save("b", make_session())
+    store.get("a")  # "b" is now the least recently used
+    store.save("c", make_session())
+    assert evicted.evicted == ["b"]
+    assert store.session_ids() == {"a", "c"}
+
+
+# --- SQLite store ---
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "sessions.sqlite3")
+
+
+def test_sqlite_round_trip_keeps_transcript(db_path):
+    store = SQLiteSessionStore(path=db_path)
+    session = make_session()
+    session["transcript"][0].text = "edited"
+    store.save("a", session)
+    loaded = SQLiteSessionStore(path=db_path).get("a")
+    assert loaded["transcript"].to_dicts() == session["transcript"].to_dicts()
+
+
+def test_sqlite_cache_is_keyed_by_row_version(db_path, monkeypatch):
+    first, second = SQLiteSessionStore(path=db_path), SQLiteSessionStore(path=db_path)
+    first.save("a", make_session())
+    decodes = []
+    real_load = session_store_module.load_session
+    monkeypatch.setattr(session_store_module, "load_session", lambda data: decodes.append(1) or real_load(data))
+
+    cached = second.get("a")
+    assert second.get("a") is cached  # Unchanged row: served from the per-worker cache
+    assert len(decodes) == 1
+
+    changed = first.get("a")
+    changed["target_words"] = 7
+    first.save("a", changed)  # Bumps the row version
+    reloaded = second.get("a")
+    assert reloaded is not cached
+    assert reloaded["target_words"] == 7
+    assert len(decodes) == 2
+
+
+def test_sqlite_versioned_save_conflicts(db_path):
+    first, second = SQLiteSessionStore(path=db_path), SQLiteSessionStore(path=db_path)
+    first.save("a", make_session())
+    session, version = second.get_with_version("a")
+    other, _ = first.get_with_version("a")
+    other["target_words"] = 9
+    first.save("a", other)
+    session["target_words"] = 3
+    with pytest.raises(SessionConflictError):
+        second.save("a", session, expected_version=version)
+    assert second.get("a")["target_words"] == 9  # The conflicting edit wasn't kept, not even in the cache
+
+    session, version = second.get_with_version("a")
+    second.save("a", session, expected_version=version)
+    assert second.get_with_version("a")[1] == version + 1
+
+
+def test_sqlite_ttl_sweep_and_lru_cap(db_path):
+    evicted = Recorder()
+    store = SQLiteSessionStore(path=db_path, ttl_seconds=60, max_entries=2, on_evict=evicted)
+    store.save("a", make_session())
+    store.save("b", make_session())
+    store._conn.execute("UPDATE sessions SET accessed_at = ? WHERE session_id = 'a'", (time.time() - 120,))
+    store._conn.commit()
+    assert store.get("a") is None
+    assert store.sweep() == 1
+    store.save("c", make_session())
+    store.save("d", make_session())  # Over the cap of 2: the oldest goes
+    assert evicted.evicted == ["a", "b"]
+    assert store.session_ids() == {"c", "d"}
+
+
+def test_sqlite_migrates_tables_without_versions(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE sessions (session_id TEXT PRIMARY KEY, data TEXT NOT NULL, accessed_at REAL NOT NULL)")
+    conn.execute("INSERT INTO sessions VALUES ('a', ?, ?)",
+                 (session_store_module.dump_session(make_session()), time.time()))
+    conn.commit()
+    conn.close()
+    store = SQLiteSessionStore(path=db_path)
+    session, version = store.get_with_version("a")
+    assert version == 0
+    store.save("a", session, expected_version=0)
+
+
+# --- Orphaned temp files ---
+def test_sweep_orphaned_files_keeps_live_and_recent_files(tmp_path, monkeypatch):
+    import main
+
+    clips = tmp_path / "clips"
+    monkeypatch.setattr(main, "TEMP_DIR", tmp_path)
+    monkeypatch.setattr(main.clip_store, "root", clips)
+    old = time.time() - 3600
+    paths = {
+        "live_upload": tmp_path / "live.wav",
+        "orphan_upload": tmp_path / "orphan.wav",
+        "orphan_peaks": tmp_path / "orphan.peaks",
+        "recent_orphan": tmp_path / "recent.wav",
+        "orphan_clips": clips / "orphan",
+        "live_clips": clips / "live",
+    }
+    for name, path in paths.items():
+        if name.endswith("clips"):
+            path.mkdir(parents=True)
+            (path / "0-1000.mp3").write_bytes(b"x")
+        else:
+            path.write_bytes(b"x")
+        if name != "recent_orphan":
+            os.utime(path, (old, old))
+
+    main.sweep_orphaned_files({"live"}, max_age_seconds=600)
+    remaining = {name for name, path in paths.items() if path.exists()}
+    assert remaining == {"live_upload", "recent_orphan", "live_clips"}
+    assert clips.exists()
@@ -0,0 +1,24 @@
+# backend/tests/test_session_stream.py
+import wave
+
+import session_stream
+from session_stream import StreamIndex, render_session_stream
+
+
+def test_stream_falls_back_to_wav_copied_from_the_decoded_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_stream.AudioSegment, "converter", str(tmp_path / "no-ffmpeg"))
+    monkeypatch.setattr(session_stream, "STREAM_COPY_FRAMES", 1000)  # Several blocks
+    pcm_path = str(tmp_path / "decoded.wav")
+    frames = bytes(range(256)) * 100
+    with wave.open(pcm_path, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(8000)
+        wav.writeframes(frames)
+
+    path, content_type = render_session_stream(pcm_path, str(tmp_path / "session"))
+    assert (path, content_type) == (str(tmp_path / "session.wav"), "audio/wav")
+    with wave.open(path, "rb") as wav:
+        assert (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()) == (2, 2, 8000)
+        assert wav.readframes(wav.getnframes()) == frames
+    assert StreamIndex(tmp_path / "session.wav", content_type).duration_ms == 800
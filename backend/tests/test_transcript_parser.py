@@ -0,0 +1,64 @@
+# backend/tests/test_transcript_parser.py
+import pytest
+
+from transcript_parser import TranscriptStreamParser
+
+SRT = """1
+00:00:00,000 --> 00:00:02,500
+Hello there.
+
+2
+00:00:02,500 --> 00:00:05,000
+General Kenobi.
+
+3
+00:00:05,000 --> 00:00:07,250
+You are a bold one.
+"""
+
+VTT_CUE_SETTINGS = """WEBVTT
+
+NOTE a comment block
+
+intro
+00:00:00.000 --> 00:00:04.000 position:10%,line-left align:left size:35%
+Where did he go?
+
+00:00:04.000 --> 00:00:06.500 position:90% align:right size:35% line:0
+I think he went down this lane.
+
+01:02.345 --> 01:04.000 region:fred align:left
+Short timestamps too.
+"""
+
+CRLF_SRT = SRT.replace("\n", "\r\n")
+
+
+def parse(chunks: list[str]) -> list[dict]:
+    parser = TranscriptStreamParser()
+    blocks = []
+    for chunk in chunks:
+        blocks.extend(parser.feed(chunk))
+    blocks.extend(parser.close())
+    return blocks
+
+
+@pytest.mark.parametrize("text", [SRT, VTT_CUE_SETTINGS, CRLF_SRT], ids=["srt", "vtt-cue-settings", "crlf"])
+def test_every_split_point_matches_single_chunk(text):
+    expected = parse([text])
+    assert len(expected) == 3
+    for split in range(1, len(text)):
+        assert parse([text[:split], text[split:]]) == expected, f"split at {split}"
+
+
+def test_vtt_cue_settings_are_not_part_of_the_text():
+    blocks = parse([VTT_CUE_SETTINGS])
+    assert [b["text"] for b in blocks] == [
+        "Where did he go?", "I think he went down this lane.", "Short timestamps too."]
+    assert blocks[2]["start"] == "00:01:02.345"
+    assert blocks[2]["end_ms"] == 64000
+
+
+def test_one_character_chunks():
+    for text in (SRT, VTT_CUE_SETTINGS, CRLF_SRT):
+        assert parse(list(text)) == parse([text])
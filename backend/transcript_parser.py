@@ -0,0 +1,109 @@
+# backend/transcript_parser.py
+import logging
+import re
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# A cue timing line: "00:01:02,345 --> 00:01:04.000", optionally followed by WebVTT cue
+# settings. WebVTT may omit the hours ("01:02.345").
+TIMING_LINE_RE = re.compile(
+    r"^(?:(\d+):)?(\d{2}):(\d{2})[.,](\d{3})[ \t]*-->[ \t]*(?:(\d+):)?(\d{2}):(\d{2})[.,](\d{3})(?:[ \t][^\n]*)?\r?$",
+    re.MULTILINE)
+# WebVTT cue text can't contain blank lines, so anything after one (NOTE/STYLE/REGION
+# blocks, the next cue's identifier) isn't part of the cue
+BLANK_LINE_RE = re.compile(r"\n[ \t\r]*\n")
+
+def ms_to_timestamp(ms: int) -> str:
+    # Integer milliseconds to the HH:MM:SS.mmm form the rest of the app uses
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{ms:03d}"
+
+
+def clean_cue_text(content: str) -> str:
+    # Collapse whitespace and drop bare numbers (SRT index lines end up here), in one pass
+    return " ".join([token for token in content.split() if not token.isdecimal()])
+
+
+# --- Single-Pass Cue Parser ---
+class TranscriptStreamParser:
+    """Linear-time SRT/WebVTT parser that accepts text in arbitrary chunks.
+
+    Timing lines are located with one forward regex scan; the text between two
+    timing lines is the earlier cue's content. Only the current, unfinished cue
+    is buffered, and each cue is returned from `feed` as soon as the next timing
+    line (or `close`) proves it complete. Blocks are dicts with `start`/`end`
+    ("HH:MM:SS.mmm"), `start_ms`/`end_ms` (int) and cleaned `text`; cues whose
+    text is empty after cleaning are skipped.
+    """
+
+    def __init__(self):
+        self.block_count = 0
+        self._buffer = ""
+        self._scan_from = 0
+        self._is_vtt: bool | None = None  # Decided once the first few characters arrive
+        self._timing: tuple | None = None  # Regex groups of the current cue's timing line
+
+    def feed(self, text_chunk: str) -> list[dict]:
+        if not text_chunk:
+            return []
+        buffer = self._buffer + text_chunk
+        if self._is_vtt is None:
+            buffer = buffer.lstrip("\ufeff")
+            if len(buffer) < len("WEBVTT"):
+                self._buffer = buffer  # Too short to tell the format yet
+                return []
+            self._is_vtt = buffer.startswith("WEBVTT")
+        blocks = []
+        content_start = 0
+        # Re-scan from the start of the last unfinished line, so a timing line split
+        # across chunks (cue settings make them arbitrarily long) is still found whole
+        for match in TIMING_LINE_RE.finditer(buffer, buffer.rfind("\n", 0, self._scan_from) + 1):
+            if match.end() == len(buffer):
+                break  # The line may continue in the next chunk
+            block = self._emit(buffer[content_start:match.start()])
+            if block is not None:
+                blocks.append(block)
+            self._timing = match.groups()
+            content_start = match.end() + 1
+        self._buffer = buffer[content_start:]
+        self._scan_from = len(self._buffer)
+        return blocks
+
+    def close(self) -> list[dict]:
+        # A timing line left unterminated at the very end has no text, so nothing is lost
+        block = self._emit(self._buffer)
+        self._buffer = ""
+        self._scan_from = 0
+        return [block] if block is not None else []
+
+    def _emit(self, content: str) -> dict | None:
+        if self._timing is None:
+            return None  # Header or other text before the first cue
+        h1, m1, s1, ms1, h2, m2, s2, ms2 = self._timing
+        self._timing = None
+        if self._is_vtt:
+            blank = BLANK_LINE_RE.search(content)
+            if blank:
+                content = content[:blank.start()]
+        text = clean_cue_text(content)
+        if not text:
+            return None
+        self.block_count += 1
+        # Timestamps are converted from the regex groups directly; no re-parsing of strings
+        h1, h2 = h1 or "00", h2 or "00"
+        return {"start": f"{h1.zfill(2)}:{m1}:{s1}.{ms1}", "end": f"{h2.zfill(2)}:{m2}:{s2}.{ms2}",
+                "start_ms": ((int(h1) * 60 + int(m1)) * 60 + int(s1)) * 1000 + int(ms1),
+                "end_ms": ((int(h2) * 60 + int(m2)) * 60 + int(s2)) * 1000 + int(ms2),
+                "text": text}
+
+
+def iter_transcript_blocks(source: str | Iterable[str]) -> Iterator[dict]:
+    """Lazily yields cue blocks from transcript text or an iterable of text chunks (e.g. an open text file)."""
+    parser = TranscriptStreamParser()
+    chunks = (source,) if isinstance(source, str) else source
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
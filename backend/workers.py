@@ -0,0 +1,223 @@
+# backend/workers.py
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locks; workers may then duplicate some work
+    fcntl = None
+
+from metrics import REGISTRY, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# uvicorn --workers N (WEB_CONCURRENCY) runs N copies of this pool; split the cores between them
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", str(max(1, ((os.cpu_count() or 2) - 1) // WEB_CONCURRENCY))))
+AUDIO_MAX_QUEUE = int(os.getenv("AUDIO_MAX_QUEUE", str(AUDIO_WORKERS * 8)))  # Waiting interactive jobs before requests get 503
+AUDIO_RESERVED_WORKERS = int(os.getenv("AUDIO_RESERVED_WORKERS", "1"))  # Pool workers background jobs leave free
+AUDIO_SESSION_CONCURRENCY = int(os.getenv("AUDIO_SESSION_CONCURRENCY", "2"))  # Pool jobs one session may run at once
+# Interactive jobs one session may have waiting for its own slots before its requests get 503; enough
+# for a client fetching a page of segment clips at once
+AUDIO_SESSION_MAX_QUEUE = int(os.getenv("AUDIO_SESSION_MAX_QUEUE", str(AUDIO_SESSION_CONCURRENCY * 16)))
+RETRY_AFTER_MAX_SECONDS = 60
+
+_process_pool: ProcessPoolExecutor | None = None
+
+
+# --- Shared Process Pool for CPU-bound audio work (ffmpeg encodes etc.) ---
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn: forking a process that already runs the event loop and thread pools isn't safe
+        _process_pool = ProcessPoolExecutor(max_workers=AUDIO_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"Started audio process pool with {AUDIO_WORKERS} workers")
+    return _process_pool
+
+
+def shutdown_process_pool(pool: ProcessPoolExecutor | None = None):
+    """Shuts the pool down; with `pool`, only if that is still the current one (not yet replaced)."""
+    global _process_pool
+    if _process_pool is not None and (pool is None or pool is _process_pool):
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive lock on `<path>.lock`, shared by every process on the host (all uvicorn workers and their pools).
+
+    Worker functions hold it while producing a derived file, after checking
+    that no other process has produced it already.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# --- Audio Job Scheduler ---
+class AudioBusyError(Exception):
+    """Raised for an interactive job while the pool's queue is full; maps to 503 with Retry-After."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Audio workers busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AudioScheduler:
+    """Admits audio jobs to the process pool by priority, with a per-session limit and queue-depth backpressure.
+
+    Every decode, clip render, encode and scan goes through `run`, so the event
+    loop only ever awaits futures. Jobs wait here for a pool worker rather than
+    in the executor's queue: interactive jobs (a request is waiting on them)
+    go first, and background jobs (pre-rendering, peaks) never take the last
+    `reserved_workers` workers. A session runs at most `session_concurrency`
+    jobs of each kind at a time, so one long recording can't take every
+    worker. Interactive jobs are refused with `AudioBusyError` once `max_queue`
+    of them wait for a worker, or `session_max_queue` of their session's wait
+    for its limit; background jobs don't count towards either and always wait
+    their turn.
+    """
+
+    def __init__(self, workers: int = AUDIO_WORKERS, max_queue: int = AUDIO_MAX_QUEUE,
+                 session_concurrency: int = AUDIO_SESSION_CONCURRENCY, reserved_workers: int = AUDIO_RESERVED_WORKERS,
+                 session_max_queue: int = AUDIO_SESSION_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.session_concurrency = session_concurrency
+        self.session_max_queue = session_max_queue
+        self.background_workers = max(1, workers - reserved_workers)
+        self.depth = 0  # Admitted jobs not finished yet (waiting for their session, a worker, or running)
+        self.running = 0  # Jobs holding a pool worker
+        self.queued = 0  # Interactive jobs waiting for a pool worker (past their session's limit)
+        self.background_queued = 0
+        self._waiters = {False: deque(), True: deque()}  # background -> futures waiting for a worker
+        # session_id -> [interactive semaphore, background semaphore, users, interactive jobs waiting for the session]
+        self._session_limits: dict[str, list] = {}
+        self._average_seconds = 1.0  # Moving average job duration, for Retry-After
+
+    def retry_after(self) -> int:
+        estimate = self._average_seconds * (self.queued + 1) / self.workers
+        return min(RETRY_AFTER_MAX_SECONDS, max(1, math.ceil(estimate)))
+
+    async def run(self, session_id: str, stage: str, fn, *args, background: bool = False):
+        """Runs `fn(*args)` in the pool and returns its result; `stage` labels the timing metric."""
+        limit = self._session_limits.get(session_id)
+        if not background and (self.queued >= self.max_queue or (limit and limit[3] >= self.session_max_queue)):
+            raise AudioBusyError(self.retry_after())
+        if limit is None:
+            limit = self._session_limits[session_id] = [
+                asyncio.Semaphore(self.session_concurrency), asyncio.Semaphore(self.session_concurrency), 0, 0]
+        limit[2] += 1
+        self.depth += 1
+        started = time.perf_counter()
+        try:
+            if not background:
+                limit[3] += 1
+            try:
+                await limit[background].acquire()
+            finally:
+                if not background:
+                    limit[3] -= 1
+            try:
+                await self._acquire_worker(background)
+                try:
+                    job_started = time.perf_counter()
+                    result = await self._execute(fn, args)
+                    self._average_seconds = 0.8 * self._average_seconds + 0.2 * (time.perf_counter() - job_started)
+                finally:
+                    self._release_worker()
+            finally:
+                limit[background].release()
+            return result
+        finally:
+            # Includes the wait for the session slot and a free worker: what the caller sees
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+            self.depth -= 1
+            limit[2] -= 1
+            if not limit[2]:
+                self._session_limits.pop(session_id, None)
+
+    async def _execute(self, fn, args: tuple):
+        loop = asyncio.get_running_loop()
+        pool = get_process_pool()
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool as e:
+            # A pool worker died (OOM kill, crash in a decoder): the pool fails every job from then
+            # on, so replace it and run this job once more before giving up with a 503
+            logger.warning(f"Audio process pool broke ({e}), restarting it.")
+            shutdown_process_pool(pool)
+        pool = get_process_pool()
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool as e:
+            logger.error(f"Audio process pool broke again on retry ({e}).")
+            shutdown_process_pool(pool)
+            raise AudioBusyError(self.retry_after())
+
+    def _has_free_worker(self, background: bool) -> bool:
+        if background:
+            return self.running < self.background_workers and not self._waiters[False]
+        return self.running < self.workers
+
+    async def _acquire_worker(self, background: bool):
+        waiters = self._waiters[background]
+        if not waiters and self._has_free_worker(background):
+            self.running += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        self._count_queued(background, 1)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_worker()  # Handed a worker just as the caller went away
+            elif waiter in waiters:
+                waiters.remove(waiter)
+            raise
+        finally:
+            self._count_queued(background, -1)
+
+    def _count_queued(self, background: bool, delta: int):
+        if background:
+            self.background_queued += delta
+        else:
+            self.queued += delta
+
+    def _release_worker(self):
+        self.running -= 1
+        # Interactive waiters first; background ones only while no interactive job waits
+        for background in (False, True):
+            waiters = self._waiters[background]
+            while waiters and self._has_free_worker(background):
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self.running += 1
+                    waiter.set_result(None)
+
+
+audio_scheduler = AudioScheduler()
+
+REGISTRY.gauge("editor_audio_jobs", "Audio jobs admitted to this worker's pool and not finished.",
+               lambda: audio_scheduler.depth)
+REGISTRY.gauge("editor_audio_jobs_queued", "Interactive audio jobs waiting for a pool worker.",
+               lambda: audio_scheduler.queued)
+REGISTRY.gauge("editor_audio_background_jobs_queued", "Background audio jobs waiting for a pool worker.",
+               lambda: audio_scheduler.background_queued)
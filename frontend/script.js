@@ -5,6 +5,10 @@ const PIXELS_PER_LINE = 22; // Adjusted for line height
 const BASE_TEXT_AREA_HEIGHT = 10; // Padding adjustment
 const MIN_TEXT_AREA_HEIGHT = 60;
 const MAX_TEXT_AREA_HEIGHT = 400;
+const WAVEFORM_HEIGHT = 48; // CSS pixels
+const WAVEFORM_FETCH_CONCURRENCY = 6; // Roughly the browser's per-host connection limit
+const BUSY_RETRY_LIMIT = 3; // Retries of a request the server answered 503 (audio workers busy)
+const USE_SESSION_STREAM = true; // Play segments from one whole-session stream (HTTP Range) instead of per-segment clips
 
 // --- DOM Elements ---
 const transcriptFileInput = document.getElementById('transcript-file');
@@ -12,6 +16,7 @@ const audioFileInput = document.getElementById('audio-file');
 const transcriptFileInfo = document.getElementById('transcript-file-info');
 const audioFileInfo = document.getElementById('audio-file-info');
 const targetWordsInput = document.getElementById('target-words');
+const segmentationSelect = document.getElementById('segmentation');
 const fixTyposCheckbox = document.getElementById('fix-typos');
 const translateNorwegianCheckbox = document.getElementById('translate-norwegian');
 const processButton = document.getElementById('process-button');
@@ -27,6 +32,7 @@ const segmentsContainer = document.getElementById('segments-container');
 const exportFormatSelect = document.getElementById('export-format');
 const exportButton = document.getElementById('export-button'); // Renamed from downloadButton
 const exportFilename = document.getElementById('export-filename'); // Renamed from downloadFilename
+const exportAudioCheckbox = document.getElementById('export-audio');
 const comparisonExpander = document.getElementById('comparison-expander');
 const originalTextPreview = document.getElementById('original-text-preview');
 const editedTextPreview = document.getElementById('edited-text-preview');
@@ -34,7 +40,7 @@ const editedTextPreview = document.getElementById('edited-text-preview');
 
 // --- State ---
 let currentSessionId = null;
-let segmentData = []; // Array to hold { index, start, end, original_text, current_text, gpt_error, is_highlighted, blobUrl: null }
+let segmentData = []; // Array to hold { index, start, end, original_text, current_text, gpt_error, is_highlighted, peaks: null, audioUrl: null }
 let currentEditorStatus = "None";
 let currentTargetWords = 60;
 let activeSegmentIndex = -1; // Index of the currently selected/playing segment
@@ -204,13 +210,23 @@ async function handleProcess() {
     formData.append('audio_file', audioFile);
     currentTargetWords = targetWordsInput.value;
     formData.append('target_words', currentTargetWords);
+    if (segmentationSelect) {
+        // "pause_audio" is the pause strategy with the server-side silence scan switched on
+        const audioPauses = segmentationSelect.value === 'pause_audio';
+        formData.append('segmentation', audioPauses ? 'pause' : segmentationSelect.value);
+        formData.append('audio_pauses', audioPauses);
+    }
     formData.append('fix_typos', fixTyposCheckbox.checked);
     formData.append('translate_norwegian', translateNorwegianCheckbox.checked);
+    // Lets the server skip pre-rendering per-segment clips this client won't request
+    formData.append('playback', USE_SESSION_STREAM ? 'stream' : 'clips');
 
     showLoading(true, "Uploading & Processing...");
 
     try {
-        const response = await fetch(`${API_BASE_URL}/api/process`, {
+        // Job mode: the server returns as soon as the transcript is grouped;
+        // AI edits are streamed in per segment afterwards.
+        const response = await fetch(`${API_BASE_URL}/api/jobs`, {
             method: 'POST',
             body: formData,
         });
@@ -235,18 +251,29 @@ async function handleProcess() {
             original_text: seg.text, // Keep original for comparison
             current_text: seg.text, // Start with current = original
             is_highlighted: false, // Initialize highlight state
-            blobUrl: null // Initialize blobUrl
+            user_edited: false, // Set once the user types, so streamed AI edits don't overwrite it
+            needs_sync: false, // Typed text not yet saved on the server (sent before exporting)
+            peaks: null, // Waveform peaks from the server; audio itself is only fetched on play
+            audioUrl: null // Set to a media fragment of the session stream when that mode is on
         }));
 
-        // ---- NEW: Preload audio before rendering ----
-        showLoading(true, `Processing complete. Preloading ${segmentData.length} audio segments...`);
-        // Pass segmentData so it can be updated with blobUrls
-        await preloadAllAudio(segmentData, currentSessionId);
-        // ---- END NEW ----
+        // Segments are usable right away; waveforms and AI edits fill in as they arrive
+        renderSegments();
+        showLoading(false);
+        const sessionId = currentSessionId;
+        const pendingAiEdits = result.status !== 'done';
+        setStatus(pendingAiEdits
+            ? `${segmentData.length} segments ready. Loading waveforms and applying AI edits...`
+            : `${segmentData.length} segments ready. Loading waveforms...`, "info");
+
+        await Promise.all([
+            loadAllWaveforms(segmentData, sessionId),
+            USE_SESSION_STREAM ? useSessionStream(sessionId) : Promise.resolve(),
+            pendingAiEdits ? streamJobEvents(sessionId) : Promise.resolve(),
+        ]);
+        if (sessionId !== currentSessionId) return; // A newer upload replaced this one
 
         setStatus(`Processing complete! ${segmentData.length} segments generated.`, "success");
-        renderSegments(); // Render only after preloading is done
-        showLoading(false);
 
     } catch (error) {
         setError(`Processing failed: ${error.message}`);
@@ -255,120 +282,210 @@ async function handleProcess() {
     }
 }
 
-// ---- MODIFIED FUNCTION: Preload all audio segments using fetch ----
-async function preloadAllAudio(segments, sessionId) {
-    console.log(`Starting preload for ${segments.length} segments in session ${sessionId} using fetch`);
-    const preloadPromises = segments.map((seg, index) => {
-        return new Promise(async (resolve, reject) => { // Make inner function async
-            const audioUrl = `${API_BASE_URL}/api/audio/${sessionId}/${index}`;
+// Reads the NDJSON job event stream and applies each finished segment as it arrives
+async function streamJobEvents(sessionId) {
+    const response = await fetch(`${API_BASE_URL}/api/jobs/${sessionId}/events`);
+    if (!response.ok || !response.body) {
+        throw new Error(`Could not follow processing job (Status: ${response.status})`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let completed = 0;
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        if (sessionId !== currentSessionId) { reader.cancel(); return; }
+        buffer += decoder.decode(value, { stream: true });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (!line) continue;
+            const event = JSON.parse(line);
+            if (event.type === 'segment') {
+                applySegmentUpdate(event.index, event.segment);
+                completed++;
+                setStatus(`AI edits: ${completed}/${segmentData.length} segments done...`, "info");
+            } else if (event.type === 'done' && event.status === 'failed') {
+                throw new Error(event.error || 'AI processing failed');
+            }
+        }
+    }
+}
+
+function applySegmentUpdate(index, segment) {
+    const seg = segmentData[index];
+    if (!seg) return;
+    seg.gpt_error = segment.gpt_error;
+    if (!seg.user_edited) {
+        seg.original_text = segment.text;
+        seg.current_text = segment.text;
+        const textArea = document.getElementById(`text-${index}`);
+        if (textArea) {
+            textArea.value = segment.text;
+            adjustTextAreaHeight(textArea);
+        }
+    }
+    if (segment.gpt_error) {
+        const segmentElement = document.getElementById(`segment-${index}`);
+        const textArea = document.getElementById(`text-${index}`);
+        if (segmentElement && textArea && !segmentElement.querySelector('.segment-gpt-error')) {
+            const errorSpan = document.createElement('span');
+            errorSpan.className = 'segment-gpt-error';
+            errorSpan.textContent = `⚠️ AI Edit Error: ${segment.gpt_error}`;
+            segmentElement.insertBefore(errorSpan, textArea);
+        }
+    }
+    updateComparisonPreview();
+}
+
+// fetch() that waits out 503 responses (audio workers busy) for the server's Retry-After
+async function fetchWhenReady(url, options) {
+    for (let attempt = 0; ; attempt++) {
+        const response = await fetch(url, options);
+        if (response.status !== 503 || attempt >= BUSY_RETRY_LIMIT) return response;
+        const seconds = parseInt(response.headers.get('Retry-After'), 10) || 1;
+        await new Promise(resolve => setTimeout(resolve, seconds * 1000));
+    }
+}
+
+// Fetches each segment's waveform peaks (a few KB each) instead of its audio
+async function loadAllWaveforms(segments, sessionId) {
+    let next = 0;
+    let failures = 0;
+    const worker = async () => {
+        while (next < segments.length) {
+            const index = next++;
+            if (sessionId !== currentSessionId) return; // A newer upload replaced this one
+            const canvas = document.getElementById(`waveform-${index}`);
+            const maxPeaks = Math.max(100, Math.round((canvas?.clientWidth || 800) * (window.devicePixelRatio || 1)));
             try {
-                const response = await fetch(audioUrl);
+                const response = await fetchWhenReady(`${API_BASE_URL}/api/peaks/${sessionId}/${index}?max_peaks=${maxPeaks}`);
                 if (!response.ok) {
                     throw new Error(`HTTP error! status: ${response.status} for segment ${index}`);
                 }
-                const blob = await response.blob();
-                const blobUrl = URL.createObjectURL(blob);
-
-                // Store the Blob URL directly in the segment data
-                if (segments[index]) {
-                     segments[index].blobUrl = blobUrl;
-                     // console.log(`Segment ${index} fetched and Blob URL created: ${blobUrl}`);
-                     resolve({ index, status: 'loaded', blobUrl: blobUrl });
-                } else {
-                     // Should not happen if called correctly, but safety check
-                     console.error(`Segment data missing for index ${index} during preload`);
-                     reject(new Error(`Segment data missing for index ${index}`));
-                }
-
+                segments[index].peaks = await response.json();
+                drawWaveform(index);
             } catch (error) {
-                console.error(`Error fetching or creating blob for segment ${index}:`, error);
-                // Resolve with error status to avoid blocking Promise.all,
-                // but mark the segment so we know it failed.
-                 if (segments[index]) { segments[index].blobUrl = 'error'; } // Mark as error
-                 resolve({ index, status: 'error', error: error });
+                console.error(`Error fetching waveform for segment ${index}:`, error);
+                failures++;
             }
-        });
-    });
+        }
+    };
+    await Promise.all(Array.from({ length: WAVEFORM_FETCH_CONCURRENCY }, worker));
+    if (failures > 0) {
+        console.warn(`Finished loading waveforms with ${failures} fetch errors.`);
+    }
+}
 
+// Points every segment's player at one shared session stream, using media fragments (#t=start,end)
+// so the browser plays just that range over HTTP Range requests on a single resource
+async function useSessionStream(sessionId) {
     try {
-        const results = await Promise.all(preloadPromises);
-        const errors = results.filter(r => r.status === 'error');
-        if (errors.length > 0) {
-            console.warn(`Finished preloading with ${errors.length} fetch errors.`);
-            // Maybe show a warning to the user?
-            // setError(`Warning: Failed to preload ${errors.length} audio segments. They might not play correctly.`, 'warning'); // Example message
-        } else {
-            console.log("All audio segments fetched and preloaded successfully via Blobs.");
+        const response = await fetchWhenReady(`${API_BASE_URL}/api/sessions/${sessionId}/audio/manifest`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
         }
-        // --- Important: Revoke old blob URLs if reprocessing ---
-        // (Need to handle this carefully - maybe revoke URLs in resetResults?)
-
+        const manifest = await response.json();
+        if (sessionId !== currentSessionId) return;
+        manifest.segments.forEach(entry => {
+            const seg = segmentData[entry.index];
+            if (!seg || entry.byte_start === null) return; // No audio there; keep the per-segment URL
+            seg.audioUrl = `${API_BASE_URL}${manifest.url}#t=${entry.start_ms / 1000},${entry.end_ms / 1000}`;
+            const audioElement = document.getElementById(`audio-${entry.index}`);
+            if (audioElement && audioElement.paused) audioElement.src = seg.audioUrl;
+        });
     } catch (error) {
-        console.error("An unexpected error occurred during audio fetch preloading:", error);
-        throw new Error("Audio preloading failed."); // Re-throw to be caught by handleProcess
+        // Per-segment clips keep working, so this is not fatal
+        console.warn("Session stream unavailable, using per-segment audio:", error);
     }
 }
-// ---- END MODIFIED FUNCTION ----
 
-function handleExport() {
+function drawWaveform(index) {
+    const canvas = document.getElementById(`waveform-${index}`);
+    const data = segmentData[index]?.peaks;
+    if (!canvas || !data) return;
+
+    const ratio = window.devicePixelRatio || 1;
+    canvas.width = Math.max(1, Math.round(canvas.clientWidth * ratio));
+    canvas.height = Math.round(WAVEFORM_HEIGHT * ratio);
+    const ctx = canvas.getContext('2d');
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.fillStyle = getComputedStyle(canvas).color;
+
+    const peaks = data.peaks; // Interleaved min, max in -128..127
+    const peakCount = peaks.length / 2;
+    const duration = Math.max(1, data.end_ms - data.start_ms);
+    const middle = canvas.height / 2;
+    const scale = middle / 128;
+    for (let i = 0; i < peakCount; i++) {
+        // Place each peak by its time, so the first/last partial buckets line up with the segment
+        const peakStart = data.first_peak_ms + i * data.ms_per_peak;
+        const x = Math.floor(((peakStart - data.start_ms) / duration) * canvas.width);
+        const w = Math.max(1, Math.ceil((data.ms_per_peak / duration) * canvas.width));
+        const top = middle - peaks[2 * i + 1] * scale;
+        const bottom = middle - peaks[2 * i] * scale;
+        ctx.fillRect(x, top, w, Math.max(1, bottom - top));
+    }
+}
+
+// Saves typed edits on the server, which generates the export from its copy of the segments
+async function syncEditedSegments() {
+    const pending = segmentData.filter(seg => seg.needs_sync);
+    for (const seg of pending) {
+        const response = await fetch(`${API_BASE_URL}/api/sessions/${currentSessionId}/segments/${seg.index}`, {
+            method: 'PATCH',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ text: seg.current_text })
+        });
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            throw new Error(error.detail || `Saving segment ${seg.index + 1} failed (${response.status})`);
+        }
+        seg.needs_sync = false;
+    }
+}
+
+async function handleExport() {
     if (!exportFormatSelect || !exportFilename) return; // Add checks
-    if (segmentData.length === 0) return;
+    if (segmentData.length === 0 || !currentSessionId) return;
 
     const format = exportFormatSelect.value;
-    let content = "";
-    let filename = "";
-    const baseFilename = `transcript_${currentSessionId ? currentSessionId.substring(0, 8) : 'export'}`;
-
-    if (format === 'txt') {
-        // Add [HIGHLIGHT] prefix for highlighted segments in plain text
-        content = segmentData.map(seg => {
-            const prefix = seg.is_highlighted ? '[HIGHLIGHT] ' : '';
-            return prefix + seg.current_text;
-        }).join(' \n\n');
-        filename = `${baseFilename}_plain.txt`;
-    } else if (format === 'timestamped') {
-        // Keep timestamped format clean (no prefix)
-        content = segmentData.map(seg => `[${seg.start} --> ${seg.end}]\n${seg.current_text}`).join('\n\n');
-        filename = `${baseFilename}_timestamped.txt`;
-    } else {
-        console.error("Unknown export format:", format);
-        return;
+    const params = new URLSearchParams({ format });
+    const highlighted = segmentData.filter(seg => seg.is_highlighted).map(seg => seg.index);
+    highlighted.forEach(index => params.append('highlight', index));
+    if (exportAudioCheckbox && exportAudioCheckbox.checked) {
+        const audioSegments = highlighted.length > 0 ? highlighted : segmentData.map(seg => seg.index);
+        audioSegments.forEach(index => params.append('audio', index));
     }
 
-    // Basic cleaning (replace multiple spaces/newlines, trim)
-    content = content.replace(/\s{2,}/g, ' ').replace(/\n{3,}/g, '\n\n').trim();
+    exportButton.disabled = true;
+    try {
+        await syncEditedSegments();
+    } catch (error) {
+        setError(`Export failed: ${error.message}`);
+        exportButton.disabled = false;
+        return;
+    }
+    exportButton.disabled = false;
 
-    const blob = new Blob([content], { type: 'text/plain;charset=utf-8' });
-    const url = URL.createObjectURL(blob);
+    // The browser downloads the streamed response straight to disk
     const a = document.createElement('a');
-    a.href = url;
-    a.download = filename;
+    a.href = `${API_BASE_URL}/api/sessions/${currentSessionId}/export?${params}`;
     document.body.appendChild(a);
     a.click();
     document.body.removeChild(a);
-    URL.revokeObjectURL(url);
 
-    exportFilename.textContent = `Downloaded: ${filename}`;
+    exportFilename.textContent = `Export started (${format}${params.has('audio') ? ' + audio' : ''}).`;
 }
 
 function resetResults() {
     if (!segmentsContainer || !resultsSection || !exportButton || !exportFilename || !originalTextPreview || !editedTextPreview || !comparisonExpander) return;
 
-    // --- NEW: Revoke old Blob URLs to free memory ---
-    segmentData.forEach(seg => {
-        if (seg.blobUrl && seg.blobUrl.startsWith('blob:')) {
-            try {
-                URL.revokeObjectURL(seg.blobUrl);
-                // console.log(`Revoked Blob URL for segment ${seg.index}`);
-            } catch (e) {
-                console.warn(`Could not revoke Blob URL: ${seg.blobUrl}`, e);
-            }
-        }
-    });
-    // --- END NEW ---
-
     currentSessionId = null;
-    segmentData = []; // Clear data *after* revoking
+    segmentData = [];
     activeSegmentIndex = -1;
     // Removed state resets for playback/drag
     segmentsContainer.innerHTML = '';
@@ -461,6 +578,8 @@ function renderSegments() {
         // MODIFIED: Use adjustTextAreaHeight on input
         textArea.addEventListener('input', (event) => {
             segmentData[index].current_text = event.target.value;
+            segmentData[index].user_edited = true;
+            segmentData[index].needs_sync = true;
             updateComparisonPreview();
             // Adjust height while typing
             adjustTextAreaHeight(event.target); // Pass the textarea element
@@ -493,24 +612,30 @@ function renderSegments() {
             segmentElement.insertBefore(errorSpan, textArea);
         }
 
-        // Append the audio element
+        // Waveform, drawn once its peaks arrive
+        const waveformCanvas = document.createElement('canvas');
+        waveformCanvas.id = `waveform-${index}`;
+        waveformCanvas.className = 'segment-waveform';
+        waveformCanvas.style.height = `${WAVEFORM_HEIGHT}px`;
+        segmentControlsNative.appendChild(waveformCanvas);
+
+        // Append the audio element; the clip is only downloaded when played
         const audioElement = document.createElement('audio');
         audioElement.id = `audio-${index}`;
         audioElement.controls = true;
-        audioElement.preload = 'auto'; // Important for preloaded blobs
-        if (segment.blobUrl) {
-            audioElement.src = segment.blobUrl;
-        }
+        audioElement.preload = 'none';
+        audioElement.src = segment.audioUrl || `${API_BASE_URL}/api/audio/${currentSessionId}/${index}`;
         segmentControlsNative.appendChild(audioElement);
 
         // Append the highlight button HERE
         segmentControlsNative.appendChild(highlightButton);
     });
 
+    segmentData.forEach((segment, index) => drawWaveform(index));
     updateComparisonPreview();
     comparisonExpander.style.display = 'block'; // Show comparison
 
-    // Select the first segment by default, but don't scroll initially if preloading
+    // Select the first segment by default, but don't scroll initially
     selectSegment(0, false);
 
     // Set initial focus to the first textarea for keyboard navigation